@@ -0,0 +1,764 @@
+#!/usr/bin/env python3
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Stand in for the Slurm, PBS, SGE and LSF command line tools, producing the
+output MyCluster parses for a synthetic cluster. Run as
+
+    fake_scheduler.py COMMAND [ARGS...]
+
+or through a link named after the command. The cluster is configured with
+environment variables:
+
+    FAKE_SCHED_NODES    number of compute nodes (default 100)
+    FAKE_SCHED_JOBS     number of jobs in the queue (default 1000)
+    FAKE_SCHED_QUEUES   number of queues, nodes are split evenly (default 4)
+    FAKE_SCHED_LATENCY  seconds each command waits before answering (default 0)
+    FAKE_SCHED_LOG      file each command line is appended to
+"""
+
+import os
+import re
+import sys
+import time
+import json
+import getpass
+
+NODES = int(os.environ.get("FAKE_SCHED_NODES", 100))
+JOBS = int(os.environ.get("FAKE_SCHED_JOBS", 1000))
+QUEUES = max(1, min(int(os.environ.get("FAKE_SCHED_QUEUES", 4)), NODES))
+LATENCY = float(os.environ.get("FAKE_SCHED_LATENCY", 0))
+
+CORES = 48
+MEMORY_MB = 191000
+FIRST_JOB = 1000
+USER = getpass.getuser()
+SERVER = "fakeserver"
+# Job states cycle through these, the first is running the second pending
+SLURM_STATES = ["R", "PD", "R", "R", "CG"]
+SACCT_STATES = {"R": "RUNNING", "PD": "PENDING", "CG": "COMPLETING"}
+SACCT_CODES = {"COMPLETED": "CD", "FAILED": "F", "RUNNING": "R", "PENDING": "PD"}
+SGE_STATES = ["r", "qw", "r", "r", "dr"]
+LSF_STATES = ["RUN", "PEND", "RUN", "RUN", "PSUSP"]
+PBS_STATES = ["R", "Q", "R", "R", "H"]
+
+
+def queue_name(index):
+    return f"q{index % QUEUES}"
+
+
+def queue_nodes(queue):
+    index = int(queue[1:])
+    return [node_name(i) for i in range(index, NODES, QUEUES)]
+
+
+def node_name(index):
+    return f"node{index:05d}"
+
+
+def busy_cores(index):
+    return (index * 7) % (CORES + 1)
+
+
+def job_ids(argument=None):
+    """
+    The requested job ids, or every job in the queue
+    """
+    if argument is None:
+        return list(range(FIRST_JOB, FIRST_JOB + JOBS))
+    return [int(re.split(r"[._\[]", job_id)[0]) for job_id in argument]
+
+
+def job_active(job_id):
+    return FIRST_JOB <= job_id < FIRST_JOB + JOBS
+
+
+def job_queue(job_id):
+    return queue_name(job_id)
+
+
+def option(args, name, default=None):
+    if name in args and args.index(name) + 1 < len(args):
+        return args[args.index(name) + 1]
+    return default
+
+
+def positional(args, options_with_values=()):
+    """
+    Arguments that are not options or option values
+    """
+    values = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in options_with_values:
+            skip = True
+        elif not arg.startswith("-"):
+            values.append(arg)
+    return values
+
+
+def format_slurm(fmt, fields):
+    """
+    Expand a Slurm %[.][width]X format string with fields
+    """
+
+    def expand(match):
+        value = str(fields.get(match.group(3), ""))
+        width = int(match.group(2)) if match.group(2) else 0
+        if match.group(1):
+            return value[:width].rjust(width) if width else value
+        return value.ljust(width)
+
+    return re.sub(r"%(\.?)(\d*)([a-zA-Z])", expand, fmt)
+
+
+# Slurm
+
+
+def sinfo(args):
+    fmt = option(args, "-o", "%N %P %c %m %T %C")
+    for index in range(NODES):
+        used = busy_cores(index)
+        state = "idle" if used == 0 else "allocated" if used == CORES else "mixed"
+        fields = {
+            "N": node_name(index),
+            "P": queue_name(index),
+            "c": CORES,
+            "m": MEMORY_MB,
+            "T": state,
+            "C": f"{used}/{CORES - used}/0/{CORES}",
+        }
+        print(format_slurm(fmt, fields))
+
+
+def sacctmgr(args):
+    if "cluster" in args:
+        print("   Cluster     ControlHost  ControlPort   RPC     Share")
+        print("---------- --------------- ------------ ----- ---------")
+        print("  fakeclus       10.0.0.1         6817  9216         1")
+    else:
+        for index in range(3):
+            print(f"project{index}")
+
+
+def slurm_job_fields(job_id):
+    state = SLURM_STATES[job_id % len(SLURM_STATES)]
+    return {
+        "i": job_id,
+        "A": job_id,
+        "P": job_queue(job_id),
+        "j": f"job{job_id}",
+        "u": USER,
+        "t": state,
+        "T": SACCT_STATES[state],
+        "M": "0:00" if state == "PD" else "1:00:00",
+        "D": 1,
+        "R": "(Priority)" if state == "PD" else node_name(job_id % NODES),
+        "S": "2026-01-01T00:00:00",
+    }
+
+
+def squeue(args):
+    fmt = option(args, "--format", option(args, "-o"))
+    if fmt is None:
+        fmt = "%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R"
+    selected = option(args, "-j")
+    if selected is not None:
+        jobs = [job_id for job_id in job_ids(selected.split(",")) if job_active(job_id)]
+        if not jobs:
+            print("slurm_load_jobs error: Invalid job id specified", file=sys.stderr)
+            sys.exit(1)
+    else:
+        jobs = job_ids()
+    if "-h" not in args and "--noheader" not in args:
+        print(format_slurm(fmt, {key: key for key in "iAPjutTMDRS"}))
+    for job_id in jobs:
+        print(format_slurm(fmt, slurm_job_fields(job_id)))
+
+
+def sacct_rows(job_id):
+    if job_active(job_id):
+        state = SACCT_STATES[SLURM_STATES[job_id % len(SLURM_STATES)]]
+        end = "Unknown"
+    else:
+        state = "COMPLETED" if job_id % 3 else "FAILED"
+        end = "2026-01-01T01:00:00"
+    exit_code = "0:0" if state != "FAILED" else "1:0"
+    job = {
+        "JobId": job_id,
+        "JobName": f"job{job_id}",
+        "User": USER,
+        "Elapsed": "01:00:00",
+        "TotalCPU": "47:59:00",
+        "Partition": job_queue(job_id),
+        "NTasks": "",
+        "AveRSS": "",
+        "State": state,
+        "ExitCode": exit_code,
+        "start": "2026-01-01T00:00:00",
+        "end": end,
+    }
+    batch = dict(job, JobId=f"{job_id}.batch", Partition="", NTasks=1, AveRSS="1024K")
+    return [job, batch]
+
+
+def sacct(args):
+    fields = option(args, "--format", option(args, "-o", "JobId,State")).split(",")
+    selected = option(args, "-j")
+    states = option(args, "-s")
+    jobs = job_ids(selected.split(",") if selected else None)
+    for job_id in jobs:
+        # -X lists job allocations without their steps
+        for row in sacct_rows(job_id)[: 1 if "-X" in args else None]:
+            code = SACCT_CODES.get(row["State"], row["State"])
+            if states and code not in states.split(","):
+                continue
+            # Field names are not case sensitive
+            row = {key.lower(): value for key, value in row.items()}
+            print("|".join(str(row.get(field.lower(), "")) for field in fields))
+
+
+def sbatch(args):
+    print(f"Submitted batch job {FIRST_JOB + JOBS}")
+
+
+def scancel(args):
+    pass
+
+
+# PBS
+
+
+def pbs_job_fields(job_id):
+    if job_active(job_id):
+        state = PBS_STATES[job_id % len(PBS_STATES)]
+    else:
+        state = "F"
+    fields = {
+        "Job_Name": f"job{job_id}",
+        "Job_Owner": f"{USER}@{SERVER}",
+        "resources_used": {"cput": "47:59:00", "walltime": "01:00:00"},
+        "job_state": state,
+        "queue": job_queue(job_id),
+        "stime": "Thu Jan  1 00:00:00 2026",
+    }
+    if state == "F":
+        fields["Exit_status"] = 0 if job_id % 3 else 1
+        fields["obittime"] = "Thu Jan  1 01:00:00 2026"
+    return fields
+
+
+def qstat_pbs_json(args):
+    requested = positional(args, ("-F", "-u"))
+    unknown = []
+    if requested:
+        ids = []
+        for job_id in job_ids(requested):
+            # Jobs after the last one submitted do not exist
+            if job_id > FIRST_JOB + JOBS:
+                unknown.append(job_id)
+            elif "-x" in args or job_active(job_id):
+                ids.append(job_id)
+    else:
+        ids = job_ids()
+    jobs = {f"{job_id}.{SERVER}": pbs_job_fields(job_id) for job_id in ids}
+    output = {"timestamp": 1767225600, "pbs_version": "2022.1.0", "pbs_server": SERVER}
+    if jobs:
+        output["Jobs"] = jobs
+    print(json.dumps(output, indent=4))
+    for job_id in unknown:
+        print(f"qstat: Unknown Job Id {job_id}.{SERVER}", file=sys.stderr)
+    if unknown:
+        sys.exit(153)
+
+
+def qstat_pbs(args):
+    if option(args, "-F") == "json":
+        qstat_pbs_json(args)
+    elif "-Q" in args:
+        print(
+            "Queue              Max   Tot Ena Str   Que   Run   Hld   Wat   Trn   Ext Type"
+        )
+        print(
+            "---------------- ----- ----- --- --- ----- ----- ----- ----- ----- ----- ----"
+        )
+        for index in range(QUEUES):
+            print(
+                f"q{index}                 0     0 yes yes     0     0     0     0     0     0 Exec"
+            )
+    elif "-Qf" in args:
+        queue = positional(args)[0]
+        print(f"Queue: {queue}")
+        print("    queue_type = Execution")
+        print(f"    default_chunk.vntype = vn_{queue}")
+        print("    enabled = True")
+    elif "-xf" in args:
+        for job_id in job_ids(positional(args)):
+            if job_active(job_id):
+                state = PBS_STATES[job_id % len(PBS_STATES)]
+            else:
+                state = "F"
+            print(f"Job Id: {job_id}.{SERVER}")
+            print(f"    Job_Name = job{job_id}")
+            print(f"    Job_Owner = {USER}@{SERVER}")
+            print("    resources_used.cput = 47:59:00")
+            print("    resources_used.walltime = 01:00:00")
+            print(f"    job_state = {state}")
+            print(f"    queue = {job_queue(job_id)}")
+            if state == "F":
+                print(f"    Exit_status = {0 if job_id % 3 else 1}")
+            print("    stime = Thu Jan  1 00:00:00 2026")
+            print()
+    else:
+        for job_id in job_ids():
+            state = PBS_STATES[job_id % len(PBS_STATES)]
+            print(
+                f"{job_id}.{SERVER}  job{job_id}  {USER}  01:00:00 {state} {job_queue(job_id)}"
+            )
+
+
+def pbsnodes(args):
+    if "--version" in args:
+        print("pbs_version = 2022.1.0")
+        return
+    if option(args, "-F") == "json":
+        nodes = {}
+        for index in range(NODES):
+            nodes[node_name(index)] = {
+                "Mom": node_name(index),
+                "state": "free",
+                "resources_available": {
+                    "ncpus": CORES,
+                    "mem": f"{MEMORY_MB * 1024}kb",
+                    "vntype": f"vn_{queue_name(index)}",
+                    "vps_per_ppu": 1,
+                },
+                "resources_assigned": {"ncpus": busy_cores(index)},
+            }
+        print(json.dumps({"pbs_server": SERVER, "nodes": nodes}, indent=4))
+        return
+    for index in range(NODES):
+        name = node_name(index)
+        print(
+            "|".join(
+                [
+                    f"Name={name}",
+                    f"Mom={name}",
+                    "state=free",
+                    f"resources_available.ncpus={CORES}",
+                    f"resources_available.mem={MEMORY_MB * 1024}kb",
+                    f"resources_available.vntype=vn_{queue_name(index)}",
+                    "resources_available.vps_per_ppu=1",
+                    f"resources_assigned.ncpus={busy_cores(index)}",
+                ]
+            )
+        )
+
+
+def qsub(args):
+    if "-terse" in args:
+        print(FIRST_JOB + JOBS)
+    else:
+        print(f"{FIRST_JOB + JOBS}.{SERVER}")
+
+
+def qdel(args):
+    pass
+
+
+# SGE
+
+
+def qconf(args):
+    if "-spl" in args:
+        print("mpi")
+        print("smp")
+    elif "-sql" in args:
+        for index in range(QUEUES):
+            print(queue_name(index))
+    elif "-sq" in args:
+        for queue in ",".join(positional(args)).split(","):
+            print(f"qname                 {queue}")
+            print(f"hostlist              @{queue}_hosts")
+            print("pe_list               mpi smp")
+            print(f"slots                 {CORES}")
+            print()
+    elif "-shgrp_resolved" in args:
+        print(" ".join(queue_nodes(positional(args)[0][1:].split("_")[0])))
+    elif "-sp" in args:
+        pe = positional(args)[0]
+        print(f"pe_name            {pe}")
+        print("slots              99999")
+        print("allocation_rule    " + ("$fill_up" if pe == "mpi" else "$pe_slots"))
+
+
+def qhost(args):
+    host = option(args, "-h")
+    if "-xml" in args:
+        qhost_xml(host)
+        return
+    print(
+        "HOSTNAME                ARCH         NCPU NSOC NCOR NTHR  LOAD  MEMTOT  MEMUSE  SWAPTO  SWAPUS"
+    )
+    print("-" * 94)
+    print(
+        "global                  -               -    -    -    -     -       -       -       -       -"
+    )
+    for index in range(NODES):
+        name = node_name(index)
+        if host not in (None, name):
+            continue
+        print(
+            f"{name}               lx-amd64       {CORES}    2   {CORES}   {CORES}  0.50  186.5G   10.2G    4.0G     0.0"
+        )
+        print(
+            f"   {queue_name(index)}                 BIP   0/{busy_cores(index)}/{CORES}"
+        )
+
+
+def qhost_xml(host):
+    print("<?xml version='1.0'?>")
+    print("<qhost>")
+    print(" <host name='global'>")
+    print("   <hostvalue name='load_avg'>-</hostvalue>")
+    print(" </host>")
+    for index in range(NODES):
+        name = node_name(index)
+        if host not in (None, name):
+            continue
+        queue = queue_name(index)
+        print(f" <host name='{name}'>")
+        print("   <hostvalue name='arch_string'>lx-amd64</hostvalue>")
+        for value in ("num_proc", "m_core", "m_thread"):
+            print(f"   <hostvalue name='{value}'>{CORES}</hostvalue>")
+        print("   <hostvalue name='m_socket'>2</hostvalue>")
+        print("   <hostvalue name='load_avg'>0.50</hostvalue>")
+        print("   <hostvalue name='mem_total'>186.5G</hostvalue>")
+        print(f"   <queue name='{queue}'>")
+        print(f"     <queuevalue qname='{queue}' name='qtype_string'>BIP</queuevalue>")
+        print(
+            f"     <queuevalue qname='{queue}' name='slots_used'>{busy_cores(index)}</queuevalue>"
+        )
+        print(f"     <queuevalue qname='{queue}' name='slots'>{CORES}</queuevalue>")
+        print("   </queue>")
+        print(" </host>")
+    print("</qhost>")
+
+
+def qstat_sge(args):
+    if "-g" in args:
+        queues = [f"q{index}" for index in range(QUEUES)]
+        if option(args, "-q"):
+            queues = [option(args, "-q")]
+        print(
+            "CLUSTER QUEUE                   CQLOAD   USED    RES  AVAIL  TOTAL aoACDS  cdsuE"
+        )
+        print("-" * 80)
+        for queue in queues:
+            nodes = len(queue_nodes(queue))
+            used = sum(
+                busy_cores(index) for index in range(int(queue[1:]), NODES, QUEUES)
+            )
+            print(
+                f"{queue}                              0.50 {used:>6} {0:>6} {nodes * CORES - used:>6} {nodes * CORES:>6}      0      0"
+            )
+    elif "-xml" in args:
+        print("<?xml version='1.0'?>")
+        print("<job_info>")
+        print("  <queue_info>")
+        for job_id in job_ids():
+            state = SGE_STATES[job_id % len(SGE_STATES)]
+            queue = f"{job_queue(job_id)}@{node_name(job_id % NODES)}"
+            print(f'    <job_list state="{"pending" if state == "qw" else "running"}">')
+            print(f"      <JB_job_number>{job_id}</JB_job_number>")
+            print("      <JAT_prio>0.55500</JAT_prio>")
+            print(f"      <JB_name>job{job_id}</JB_name>")
+            print(f"      <JB_owner>{USER}</JB_owner>")
+            print(f"      <state>{state}</state>")
+            print("      <JAT_start_time>2026-01-01T00:00:00</JAT_start_time>")
+            if state != "qw":
+                print(f"      <queue_name>{queue}</queue_name>")
+            print(f"      <slots>{CORES}</slots>")
+            print("    </job_list>")
+        print("  </queue_info>")
+        print("</job_info>")
+    else:
+        print(
+            "job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID"
+        )
+        print("-" * 110)
+        for job_id in job_ids():
+            state = SGE_STATES[job_id % len(SGE_STATES)]
+            print(
+                f"{job_id:>7} 0.55500 job{job_id} {USER}  {state}     01/01/2026 00:00:00 {job_queue(job_id)}@{node_name(job_id % NODES)}  {CORES}"
+            )
+
+
+def qacct_record(job_id):
+    failed = 0 if job_id % 3 else 1
+    return [
+        "=" * 62,
+        f"qname        {job_queue(job_id)}",
+        f"hostname     {node_name(job_id % NODES)}",
+        f"owner        {USER}",
+        f"jobname      job{job_id}",
+        f"jobnumber    {job_id}",
+        "granted_pe   mpi",
+        f"failed       {failed}",
+        f"exit_status  {failed}",
+        "ru_wallclock 3600",
+        "cpu          172740.000",
+        "mem          1024.000",
+    ]
+
+
+def qacct(args):
+    selected = option(args, "-j")
+    if selected is not None and selected.startswith("-"):
+        selected = None
+    # The accounting file also holds every job that finished before the queue
+    jobs = job_ids([selected]) if selected else range(1, FIRST_JOB + JOBS)
+    for job_id in jobs:
+        print("\n".join(qacct_record(job_id)))
+
+
+# LSF
+
+
+def lsid(args):
+    print("IBM Spectrum LSF Standard 10.1.0.0, Jan 01 2026")
+    print("Copyright International Business Machines Corp. 1992, 2026.")
+    print()
+    print("My cluster name is fakeclus")
+    print("My master name is node00000")
+
+
+def bqueues(args):
+    queues = positional(args, ["-u"]) or [f"q{index}" for index in range(QUEUES)]
+    if "-l" in args:
+        for queue in queues:
+            nodes = len(queue_nodes(queue))
+            print(f"QUEUE: {queue}")
+            print("  -- Fake queue")
+            print()
+            print("PARAMETERS/STATISTICS")
+            print(
+                "PRIO NICE STATUS          MAX JL/U JL/P JL/H NJOBS  PEND   RUN SSUSP USUSP  RSV PJOBS"
+            )
+            print(
+                f" 30   20  Open:Active  {nodes * CORES}    -    -    -  {JOBS // QUEUES}     0  {JOBS // QUEUES}     0     0    0    0"
+            )
+            print()
+            print("USERS: all")
+            print(f"HOSTS:  {queue}_hosts/")
+            print()
+        return
+    print(
+        "QUEUE_NAME      PRIO STATUS          MAX JL/U JL/P JL/H NJOBS  PEND   RUN  SUSP"
+    )
+    for queue in queues:
+        nodes = len(queue_nodes(queue))
+        print(
+            f"{queue}  30  Open:Active  {nodes * CORES}  {nodes * CORES}  -  -  {JOBS // QUEUES}  0  {JOBS // QUEUES}  0  0"
+        )
+
+
+def bhosts(args):
+    records = [
+        {"HOST_NAME": node_name(index), "STATUS": "ok", "MAX": str(CORES)}
+        for index in range(NODES)
+    ]
+    print(json.dumps({"COMMAND": "bhosts", "HOSTS": NODES, "RECORDS": records}))
+
+
+def lshosts(args):
+    records = [
+        {"HOST_NAME": node_name(index), "ncpus": str(CORES), "maxmem": "186.5G"}
+        for index in range(NODES)
+    ]
+    print(json.dumps({"COMMAND": "lshosts", "HOSTS": NODES, "RECORDS": records}))
+
+
+def bmgroup(args):
+    print("GROUP_NAME    HOSTS")
+    for index in range(QUEUES):
+        queue = queue_name(index)
+        print(f"{queue}_hosts  {' '.join(queue_nodes(queue))}")
+
+
+def bsub(args):
+    sys.stdin.read()
+    print(f"Job <{FIRST_JOB + JOBS}> is submitted to queue <q0>.")
+
+
+def lsf_job_fields(job_id):
+    if job_active(job_id):
+        state = LSF_STATES[job_id % len(LSF_STATES)]
+    else:
+        state = "DONE" if job_id % 3 else "EXIT"
+    finished = state in ("DONE", "EXIT")
+    return {
+        "jobid": job_id,
+        "job_name": f"job{job_id}",
+        "user": USER,
+        "queue": job_queue(job_id),
+        "stat": state,
+        "run_time": "3600 second(s)",
+        "cpu_used": "172740.0 second(s)",
+        "slots": CORES,
+        "exit_code": (0 if state == "DONE" else 1) if finished else "-",
+        "start_time": "Jan  1 00:00",
+        "estimated_start_time": "-",
+        "finish_time": "Jan  1 01:00 L" if finished else "-",
+    }
+
+
+def bjobs(args):
+    fmt = option(args, "-o", "jobid user stat queue job_name")
+    delimiter = " "
+    match = re.search(r"delimiter='(.)'", fmt)
+    if match:
+        delimiter = match.group(1)
+        fmt = fmt[: match.start()]
+    fields = fmt.split()
+    selected = positional(args, ["-o", "-u", "-q", "-J"])
+    jobs = job_ids(selected or None)
+    if "-json" in args:
+        records = []
+        for job_id in jobs:
+            if job_id < FIRST_JOB - 10:
+                # Old jobs are only known to bhist
+                records.append(
+                    {"JOBID": str(job_id), "ERROR": f"Job <{job_id}> is not found"}
+                )
+                continue
+            job = lsf_job_fields(job_id)
+            # Unset fields are empty rather than -
+            records.append(
+                {
+                    field.upper(): "" if job.get(field, "-") == "-" else str(job[field])
+                    for field in fields
+                }
+            )
+        print(
+            json.dumps(
+                {"COMMAND": "bjobs", "JOBS": len(records), "RECORDS": records}, indent=2
+            )
+        )
+        return
+    if not jobs:
+        print("No unfinished job found")
+        return
+    if "-noheader" not in args:
+        print(delimiter.join(field.upper() for field in fields))
+    for job_id in jobs:
+        job = lsf_job_fields(job_id)
+        print(delimiter.join(str(job.get(field, "-")) for field in fields))
+
+
+def bhist(args):
+    for job_id in job_ids(positional(args, ["-n"]) or None):
+        print(
+            f"Job <{job_id}>, Job Name <job{job_id}>, User <{USER}>, Project <default>"
+        )
+        print("Thu Jan  1 00:00:00: Submitted from host <node00000>, to Queue <q0>;")
+        print("Thu Jan  1 00:00:01: Dispatched 48 Task(s) on Host(s) <node00001>;")
+        if job_id % 3:
+            print(
+                "Thu Jan  1 01:00:01: Done successfully. The CPU time used is 172740.0 seconds;"
+            )
+        else:
+            print(
+                "Thu Jan  1 01:00:01: Exited with exit code 1. The CPU time used is 172740.0 seconds;"
+            )
+            print("Thu Jan  1 01:00:01: Completed <exit>;")
+        print("-" * 80)
+
+
+def bkill(args):
+    pass
+
+
+def qstat(args):
+    # qstat is shared by PBS and SGE, FAKE_SCHED_TYPE says which to imitate
+    if os.environ.get("FAKE_SCHED_TYPE") == "sge":
+        qstat_sge(args)
+    else:
+        qstat_pbs(args)
+
+
+COMMANDS = {
+    "sinfo": sinfo,
+    "sacctmgr": sacctmgr,
+    "squeue": squeue,
+    "sacct": sacct,
+    "sbatch": sbatch,
+    "scancel": scancel,
+    "qstat": qstat,
+    "pbsnodes": pbsnodes,
+    "qsub": qsub,
+    "qdel": qdel,
+    "qconf": qconf,
+    "qhost": qhost,
+    "qacct": qacct,
+    "lsid": lsid,
+    "bqueues": bqueues,
+    "bhosts": bhosts,
+    "lshosts": lshosts,
+    "bmgroup": bmgroup,
+    "bsub": bsub,
+    "bjobs": bjobs,
+    "bhist": bhist,
+    "bkill": bkill,
+}
+
+
+def main(argv):
+    command = os.path.basename(argv[0])
+    args = argv[1:]
+    if command not in COMMANDS:
+        command, args = args[0], args[1:]
+    if "FAKE_SCHED_LOG" in os.environ:
+        with open(os.environ["FAKE_SCHED_LOG"], "a") as f:
+            f.write(" ".join([command] + args) + "\n")
+    time.sleep(LATENCY)
+    try:
+        COMMANDS[command](args)
+    except BrokenPipeError:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv)
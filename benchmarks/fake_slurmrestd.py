@@ -0,0 +1,278 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Stand in for slurmrestd, answering the Slurm REST API requests MyCluster
+makes for the synthetic cluster of fake_scheduler.py. Run as
+
+    fake_slurmrestd.py --socket PATH
+    fake_slurmrestd.py --port PORT
+
+The cluster is configured with the same environment variables as
+fake_scheduler.py, FAKE_SCHED_LOG gets the method and path of each request.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import socketserver
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fake_scheduler import (
+    NODES,
+    CORES,
+    MEMORY_MB,
+    LATENCY,
+    FIRST_JOB,
+    JOBS,
+    USER,
+    SLURM_STATES,
+    SACCT_STATES,
+    queue_name,
+    node_name,
+    busy_cores,
+    job_ids,
+    job_active,
+    job_queue,
+)
+
+START = int(datetime(2026, 1, 1).timestamp())
+
+
+def number(value):
+    return {"set": True, "infinite": False, "number": value}
+
+
+def ping(query, body):
+    return 200, {"meta": {"slurm": {"cluster": "fakeclus"}}}
+
+
+def nodes(query, body):
+    records = []
+    for index in range(NODES):
+        used = busy_cores(index)
+        state = "IDLE" if used == 0 else "ALLOCATED" if used == CORES else "MIXED"
+        records.append(
+            {
+                "name": node_name(index),
+                "partitions": [queue_name(index)],
+                "cpus": CORES,
+                "alloc_cpus": used,
+                "real_memory": MEMORY_MB,
+                "state": [state],
+            }
+        )
+    return 200, {"nodes": records}
+
+
+def partitions(query, body):
+    names = sorted({queue_name(index) for index in range(NODES)})
+    return 200, {"partitions": [{"name": name} for name in names]}
+
+
+def associations(query, body):
+    return 200, {
+        "associations": [
+            {"account": f"project{index}", "user": USER} for index in range(3)
+        ]
+    }
+
+
+def submit(query, body):
+    if "script" not in body.get("job", {}):
+        return 400, {"errors": [{"description": "batch job has no script"}]}
+    return 200, {"job_id": FIRST_JOB + JOBS, "result": {"job_id": FIRST_JOB + JOBS}}
+
+
+def queue_job(job_id):
+    state = SACCT_STATES[SLURM_STATES[job_id % len(SLURM_STATES)]]
+    return {
+        "job_id": job_id,
+        "array_job_id": number(0),
+        "array_task_id": {"set": False, "infinite": False, "number": 0},
+        "partition": job_queue(job_id),
+        "name": f"job{job_id}",
+        "user_name": USER,
+        "job_state": [state],
+        "start_time": number(START),
+    }
+
+
+def jobs(query, body):
+    return 200, {"jobs": [queue_job(job_id) for job_id in job_ids()]}
+
+
+def queue_job_by_id(job_id):
+    if not job_active(job_id):
+        return 404, {"errors": [{"description": "Invalid job id specified"}]}
+    return 200, {"jobs": [queue_job(job_id)]}
+
+
+def accounting_job(job_id):
+    if job_active(job_id):
+        state = SACCT_STATES[SLURM_STATES[job_id % len(SLURM_STATES)]]
+        end = 0
+    else:
+        state = "COMPLETED" if job_id % 3 else "FAILED"
+        end = START + 3600
+    exit_code = {"status": ["SUCCESS"], "return_code": number(int(state == "FAILED"))}
+    times = {
+        "elapsed": 3600,
+        "start": START,
+        "end": end,
+        "total": {"seconds": 172740, "microseconds": 0},
+    }
+    return {
+        "job_id": job_id,
+        "name": f"job{job_id}",
+        "user": USER,
+        "partition": job_queue(job_id),
+        "state": {"current": [state]},
+        "exit_code": exit_code,
+        "time": times,
+        "steps": [
+            {
+                "step": {"name": "batch"},
+                "tasks": {"count": 1},
+                "state": [state],
+                "exit_code": exit_code,
+                "time": times,
+            }
+        ],
+    }
+
+
+def accounting_jobs(query, body):
+    # step selects jobs by id, as sacct -j does
+    selected = query["step"][0].split(",") if "step" in query else None
+    return 200, {"jobs": [accounting_job(job_id) for job_id in job_ids(selected)]}
+
+
+def delete(job_id):
+    return 200, {}
+
+
+# Handlers by method, API and resource, taking a job id or the query and body
+ROUTES = {
+    ("GET", "slurm", "ping"): ping,
+    ("GET", "slurm", "nodes"): nodes,
+    ("GET", "slurm", "partitions"): partitions,
+    ("GET", "slurm", "jobs"): jobs,
+    ("POST", "slurm", "job/submit"): submit,
+    ("GET", "slurm", "job"): queue_job_by_id,
+    ("DELETE", "slurm", "job"): delete,
+    ("GET", "slurmdb", "jobs"): accounting_jobs,
+    ("GET", "slurmdb", "associations"): associations,
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.answer()
+
+    def do_DELETE(self):
+        self.answer()
+
+    def answer(self):
+        if "FAKE_SCHED_LOG" in os.environ:
+            with open(os.environ["FAKE_SCHED_LOG"], "a") as f:
+                f.write(f"slurmrestd {self.command} {self.path}\n")
+        time.sleep(LATENCY)
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length)) if length else {}
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        # Paths are /{slurm,slurmdb}/VERSION/RESOURCE[/JOB_ID]
+        api, _, *resource = url.path.strip("/").split("/")
+        job_id = None
+        if len(resource) == 2 and resource[0] == "job" and resource[1].isdigit():
+            resource, job_id = ["job"], int(resource[1])
+        route = ROUTES.get((self.command, api, "/".join(resource)))
+        if route is None:
+            status, response = 404, {"errors": [{"description": "Unknown path"}]}
+        elif job_id is not None:
+            status, response = route(job_id)
+        else:
+            status, response = route(query, body)
+        response.setdefault("errors", [])
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Fake slurmrestd")
+    parser.add_argument("--socket", help="Unix socket to listen on")
+    parser.add_argument("--port", type=int, default=6820, help="TCP port")
+    args = parser.parse_args(argv)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixHTTPServer(args.socket, Handler)
+    else:
+        server = ThreadingHTTPServer(("localhost", args.port), Handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmark the scheduler backends against the fake scheduler commands in
+fake_scheduler.py, reporting the wall time, number of scheduler commands
+run and parse time of each operation.
+
+    python benchmarks/run_benchmarks.py --nodes 10 --nodes 10000 --jobs 100000
+
+Save the results with --output and compare a later run against them with
+--baseline to catch regressions in command count and parse time. The run
+also fails if an operation's result does not match the fake cluster.
+"""
+
+import os
+import sys
+import json
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mycluster
+from mycluster.exceptions import SchedulerException, NotYetImplementedException
+from mycluster.schedulers.metrics import metrics
+
+BACKENDS = ["slurm", "slurmrest", "pbs", "sge", "lsf"]
+FAKE_SCHEDULER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fake_scheduler.py"
+)
+FAKE_SLURMRESTD = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fake_slurmrestd.py"
+)
+# First job in the fake queue, as in fake_scheduler.py. Jobs below it have
+# finished and are only known to the scheduler's accounting.
+FIRST_JOB = 1000
+FINISHED_JOB = FIRST_JOB - 1
+
+
+class WrongResult(Exception):
+    """
+    An operation's result does not match the fake cluster
+    """
+
+
+def fake_queues(nodes):
+    """
+    Names of the queues fake_scheduler.py generates for a cluster of nodes
+    """
+    count = max(1, min(int(os.environ.get("FAKE_SCHED_QUEUES", 4)), nodes))
+    return [f"q{index}" for index in range(count)]
+
+
+def fake_bin_dir(path):
+    """
+    Create a wrapper for every fake command in path
+    """
+    sys.path.insert(0, os.path.dirname(FAKE_SCHEDULER))
+    import fake_scheduler
+
+    for command in fake_scheduler.COMMANDS:
+        wrapper = os.path.join(path, command)
+        with open(wrapper, "w") as f:
+            f.write(
+                f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_SCHEDULER}" {command} "$@"\n'
+            )
+        os.chmod(wrapper, 0o755)
+    return path
+
+
+def accepts_connections(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+@contextmanager
+def fake_slurmrestd(workdir):
+    """
+    Run fake_slurmrestd.py on a socket in workdir for the slurmrest backend
+    """
+    path = os.path.join(workdir, "slurmrestd.sock")
+    server = subprocess.Popen([sys.executable, FAKE_SLURMRESTD, "--socket", path])
+    try:
+        deadline = time.monotonic() + 10
+        # The socket exists before the server listens on it, wait until a
+        # connection is accepted
+        while not accepts_connections(path):
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise click.ClickException("fake slurmrestd did not start")
+            time.sleep(0.05)
+        os.environ["MYCLUSTER_SLURMREST_URL"] = f"unix://{path}"
+        yield
+    finally:
+        server.terminate()
+        server.wait()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def operations(scheduler, workdir, nodes, jobs):
+    """
+    The benchmarked operations as (name, callable) pairs, each raising
+    WrongResult if its result does not match the fake cluster of nodes
+    nodes with jobs jobs
+    """
+    job_file = os.path.join(workdir, "bench.job")
+    state = {}
+
+    def queues():
+        queues = scheduler.queues()
+        state["queue"] = queues[0]
+        # SGE lists a queue for each parallel environment as PE:QUEUE
+        names = sorted({queue.split(":")[-1] for queue in queues})
+        if names != fake_queues(nodes):
+            raise WrongResult(f"queues {names}, expected {fake_queues(nodes)}")
+
+    def create_submit():
+        script = scheduler.create_submit(
+            state["queue"], 96, "bench", "bench.sh", "01:00:00"
+        )
+        with open(job_file, "w") as f:
+            f.write(script)
+
+    def submit():
+        state["job_id"] = scheduler.submit(job_file)
+
+    def list_current_jobs():
+        job_ids = sorted(job["id"] for job in scheduler.list_current_jobs())
+        if job_ids != list(range(FIRST_JOB, FIRST_JOB + jobs)):
+            raise WrongResult(f"{len(job_ids)} current jobs, expected {jobs}")
+
+    def get_job_details():
+        # The fake fails every third job
+        details = scheduler.get_job_details(FINISHED_JOB)
+        if details.get("status") not in scheduler.terminal_states:
+            raise WrongResult(f"job {FINISHED_JOB} {details.get('status')}")
+        if scheduler.succeeded(details):
+            raise WrongResult(f"failed job {FINISHED_JOB} succeeded")
+
+    return [
+        ("queues", queues),
+        ("create_submit", create_submit),
+        ("submit", submit),
+        ("list_current_jobs", list_current_jobs),
+        ("get_job_details", get_job_details),
+    ]
+
+
+def run_backend(backend, nodes, jobs, latency, repeat, workdir):
+    os.environ.update(
+        {
+            "FAKE_SCHED_TYPE": backend,
+            "FAKE_SCHED_NODES": str(nodes),
+            "FAKE_SCHED_JOBS": str(jobs),
+            "FAKE_SCHED_LATENCY": str(latency),
+        }
+    )
+    if backend == "slurmrest":
+        with fake_slurmrestd(workdir):
+            return measure(backend, nodes, jobs, repeat, workdir)
+    return measure(backend, nodes, jobs, repeat, workdir)
+
+
+def measure(backend, nodes, jobs, repeat, workdir):
+    scheduler = mycluster.get_scheduler(backend)
+    results = []
+    for name, operation in operations(scheduler, workdir, nodes, jobs):
+        times = []
+        commands = []
+        parse_times = []
+        error = None
+        wrong = False
+        for _ in range(repeat):
+            # Measure the scheduler's work, not what it remembers from the
+            # previous repeat
+            scheduler.cache_enabled = False
+            scheduler.reset_indexes()
+            metrics.reset()
+            start = time.perf_counter()
+            try:
+                operation()
+            except (SchedulerException, NotYetImplementedException) as e:
+                error = str(e)
+                break
+            except WrongResult as e:
+                error = f"wrong result: {e}"
+                wrong = True
+                break
+            times.append(time.perf_counter() - start)
+            commands.append(
+                sum(stats["calls"] for stats in metrics.commands().values())
+            )
+            elapsed = sum(stats["time"] for stats in metrics.commands().values())
+            parse_times.append(max(times[-1] - elapsed, 0.0))
+        result = {
+            "backend": backend,
+            "nodes": nodes,
+            "jobs": jobs,
+            "operation": name,
+        }
+        if error is None:
+            result.update(
+                {
+                    "time": statistics.median(times),
+                    "commands": max(commands),
+                    "parse time": statistics.median(parse_times),
+                }
+            )
+        else:
+            result["error"] = error
+            result["wrong result"] = wrong
+        results.append(result)
+    return results
+
+
+def result_key(result):
+    return (result["backend"], result["nodes"], result["jobs"], result["operation"])
+
+
+def regressions(results, baseline, tolerance, min_parse_time):
+    """
+    Results that run more commands or spend noticeably longer parsing than
+    the baseline
+    """
+    previous = {result_key(result): result for result in baseline}
+    found = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None or "error" in result or "error" in old:
+            continue
+        if result["commands"] > old["commands"]:
+            found.append(
+                f"{' '.join(map(str, result_key(result)))}: "
+                f"{old['commands']} -> {result['commands']} commands"
+            )
+        if (
+            result["parse time"] > old["parse time"] * (1 + tolerance)
+            and result["parse time"] - old["parse time"] > min_parse_time
+        ):
+            found.append(
+                f"{' '.join(map(str, result_key(result)))}: parse time "
+                f"{old['parse time']:.4f}s -> {result['parse time']:.4f}s"
+            )
+    return found
+
+
+@click.command()
+@click.option(
+    "--backend",
+    "backends",
+    multiple=True,
+    type=click.Choice(BACKENDS),
+    help="Backend to benchmark, may be repeated (default all)",
+)
+@click.option(
+    "--nodes",
+    "node_counts",
+    multiple=True,
+    type=int,
+    help="Cluster size in nodes, may be repeated (default 10 and 1000)",
+)
+@click.option("--jobs", type=int, default=1000, help="Jobs in the queue")
+@click.option("--latency", type=float, default=0.0, help="Seconds each command waits")
+@click.option("--repeat", type=int, default=3, help="Runs of each operation")
+@click.option(
+    "--output", type=click.Path(dir_okay=False), help="Write the results as JSON"
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Fail if the results regress against this JSON file",
+)
+@click.option(
+    "--tolerance",
+    type=float,
+    default=0.5,
+    help="Fractional parse time increase allowed over the baseline",
+)
+@click.option(
+    "--min-parse-time",
+    type=float,
+    default=0.005,
+    help="Parse time increases in seconds below this are ignored",
+)
+def main(
+    backends,
+    node_counts,
+    jobs,
+    latency,
+    repeat,
+    output,
+    baseline,
+    tolerance,
+    min_parse_time,
+):
+    """Benchmark MyCluster's scheduler backends against fake commands"""
+    workdir = tempfile.mkdtemp(prefix="mycluster-bench-")
+    try:
+        bin_dir = os.path.join(workdir, "bin")
+        os.mkdir(bin_dir)
+        os.environ["PATH"] = fake_bin_dir(bin_dir) + os.pathsep + os.environ["PATH"]
+        results = []
+        click.echo(
+            f"{'Backend':<10}{'Nodes':>8}{'Jobs':>8}  {'Operation':<20}"
+            f"{'Time (s)':>10}{'Commands':>10}{'Parse (s)':>11}"
+        )
+        for backend in backends or BACKENDS:
+            for nodes in node_counts or [10, 1000]:
+                for result in run_backend(
+                    backend, nodes, jobs, latency, repeat, workdir
+                ):
+                    results.append(result)
+                    prefix = (
+                        f"{backend:<10}{nodes:>8}{jobs:>8}  {result['operation']:<20}"
+                    )
+                    if "error" in result:
+                        click.echo(f"{prefix}{'error: ' + result['error']:>31}")
+                    else:
+                        click.echo(
+                            f"{prefix}{result['time']:>10.4f}"
+                            f"{result['commands']:>10}{result['parse time']:>11.4f}"
+                        )
+    finally:
+        shutil.rmtree(workdir)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = False
+    for result in results:
+        if result.get("wrong result"):
+            click.echo(
+                f"Wrong result: {' '.join(map(str, result_key(result)))}: "
+                f"{result['error']}",
+                err=True,
+            )
+            failed = True
+    if baseline:
+        with open(baseline) as f:
+            found = regressions(results, json.load(f), tolerance, min_parse_time)
+        for regression in found:
+            click.echo(f"Regression: {regression}", err=True)
+        failed = failed or bool(found)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -32,17 +32,24 @@
 
 
 import os
-import importlib
+import json
+import time
 import logging
-
-from subprocess import check_output, CalledProcessError
+import importlib
+import subprocess
 
 from .exceptions import ConfigurationException
 
 logger = logging.getLogger(__name__)
 
+# Seconds the detected scheduler is remembered for this host
+DETECT_CACHE_TTL = 600
+# Seconds each detection probe may take
+DETECT_PROBE_TIMEOUT = 10
+
 _available_schedulers = {
     "slurm": "mycluster.schedulers.slurm.Slurm",
+    "slurmrest": "mycluster.schedulers.slurmrest.SlurmREST",
     "pbs": "mycluster.schedulers.pbs.PBS",
     "lsf": "mycluster.schedulers.lsf.LSF",
     "sge": "mycluster.schedulers.sge.SGE",
@@ -65,57 +72,142 @@ def get_scheduler(scheduler_name):
         raise ConfigurationException(f"Invalid scheduler specified: {scheduler_name}")
 
 
-def detect_scheduler_name():
+def _start_probe(command):
+    """
+    Start a detection probe command, None if it cannot be run
+    """
+    try:
+        return subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+    except OSError:
+        return None
+
+
+def _probe_output(probe, deadline):
+    """
+    Output of a started detection probe, or None if it failed or did not
+    finish by deadline
+    """
+    if probe is None:
+        return None
+    try:
+        output, _ = probe.communicate(timeout=max(deadline - time.monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        return None
+    if probe.returncode != 0:
+        return None
+    return output
+
+
+def _detect_cache_path():
+    import click
+    import platform
+
+    return os.path.join(
+        click.get_app_dir("MyCluster"), f"scheduler-{platform.node()}.json"
+    )
+
+
+def _read_detect_cache():
+    try:
+        with open(_detect_cache_path()) as f:
+            cached = json.load(f)
+        if time.time() - cached["time"] < DETECT_CACHE_TTL:
+            return cached["name"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _write_detect_cache(name):
+    path = _detect_cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"name": name, "time": time.time()}, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logger.debug(f"Unable to cache detected scheduler: {e}")
+
+
+def detect_scheduler_name(use_cache=False):
     """
     Try to automatically detect scheduler type
+
+    If use_cache is set the result is remembered for this host for
+    DETECT_CACHE_TTL seconds
     """
     # Test for custom scheduler
     if os.getenv("MYCLUSTER_SCHED") is not None:
         logger.debug(f"Custom scheduler defined using MYCLUSTER_SCHED")
         return os.getenv("MYCLUSTER_SCHED")
 
+    if use_cache:
+        name = _read_detect_cache()
+        if name is not None:
+            logger.debug(f"Using cached scheduler {name}")
+            return name
+
+    name = _detect_scheduler_name()
+    if use_cache:
+        _write_detect_cache(name)
+    return name
+
+
+def _detect_scheduler_name():
     # Test for SLURM
     if os.getenv("SLURMHOME") is not None:
         logger.debug(f"SLURMHOME set, Slurm assumed")
         return "slurm"
 
+    # Run the command probes at the same time, the results are still checked
+    # in order of preference
+    deadline = time.monotonic() + DETECT_PROBE_TIMEOUT
+    slurm = _start_probe(["scontrol", "ping"])
+    pbs = _start_probe(["pbsnodes", "--version"])
+    lsf = _start_probe(["lsid"])
     try:
-        line = check_output(["scontrol", "ping"], universal_newlines=True)
-        if line.split("(")[0] == "Slurmctld":
+        line = _probe_output(slurm, deadline)
+        if line is not None and line.split("(")[0] == "Slurmctld":
             logger.debug(f"scontrol responded, Slurm assumed")
             return "slurm"
-    except (CalledProcessError, FileNotFoundError) as e:
-        pass
-
-    # Test for PBS
-    try:
-        line = check_output(["pbsnodes", "-a"])
-        logger.debug(f"pbsnodes responded, PBS assumed")
-        return "pbs"
-    except (CalledProcessError, FileNotFoundError) as e:
-        pass
-
-    # Test for SGE
-    if os.getenv("SGE_CLUSTER_NAME") is not None:
-        logger.debug(f"SGE_CLUSTER_NAME set, SGE assumed")
-        return "sge"
 
-    # Test for lsf
-    try:
-        line = check_output("lsid", universal_newlines=True)
-        if line.split(" ")[0] == "Platform" or line.split(" ")[0] == "IBM":
+        # Test for PBS
+        if _probe_output(pbs, deadline) is not None:
+            logger.debug(f"pbsnodes responded, PBS assumed")
+            return "pbs"
+
+        # Test for SGE
+        if os.getenv("SGE_CLUSTER_NAME") is not None:
+            logger.debug(f"SGE_CLUSTER_NAME set, SGE assumed")
+            return "sge"
+
+        # Test for lsf
+        line = _probe_output(lsf, deadline)
+        if line is not None and (
+            line.split(" ")[0] == "Platform" or line.split(" ")[0] == "IBM"
+        ):
             logger.debug(f"lsid responded, LSF assumed")
             return "lsf"
-    except (CalledProcessError, FileNotFoundError) as e:
-        pass
+    finally:
+        # Do not wait for the probes that are no longer needed
+        for probe in (slurm, pbs, lsf):
+            if probe is not None and probe.poll() is None:
+                probe.kill()
+                probe.communicate()
 
     logger.debug(f"All detection tests failed, unabled to detect local scheduler")
     raise ConfigurationException("Error, unabled to detect local scheduler")
 
 
-def detect_scheduling_sys():
+def detect_scheduling_sys(use_cache=False):
     """
     Returns the scheduler implementation
     """
-    name = detect_scheduler_name()
+    name = detect_scheduler_name(use_cache)
     return get_scheduler(name)
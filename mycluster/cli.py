@@ -31,13 +31,20 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import csv
+import glob
+import json
 import errno
 import click
-import pyfiglet
 from configparser import ConfigParser
 
 import mycluster
-from .exceptions import ConfigurationException, SchedulerException
+from .exceptions import (
+    ConfigurationException,
+    SchedulerException,
+    NotYetImplementedException,
+    WaitTimeoutException,
+)
 
 APP_NAME = "MyCluster"
 
@@ -52,6 +59,33 @@ def read_config():
     return {"email": "None", "silent": True}
 
 
+class CliContext:
+    """
+    Configuration and scheduler shared by the commands, the scheduler is
+    only detected when a command first uses it
+    """
+
+    def __init__(self, config, no_cache):
+        self.config = config
+        self.no_cache = no_cache
+        self._scheduler = None
+
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            try:
+                scheduler = mycluster.detect_scheduling_sys(use_cache=not self.no_cache)
+            except ConfigurationException as e:
+                click.echo(e)
+                exit(1)
+            scheduler.cache_enabled = not self.no_cache
+            scheduler.cache_persist = True
+            if not self.config["silent"]:
+                click.echo(f"Scheduler '{scheduler.scheduler_type()}' detected")
+            self._scheduler = scheduler
+        return self._scheduler
+
+
 @click.group()
 @click.pass_context
 @click.option("-s", "--silent", is_flag=True, help="Hide application banner")
@@ -60,23 +94,96 @@ def read_config():
     type=str,
     help="Email address to use in submission files",
 )
-def main(ctx, silent, email):
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Query the scheduler directly instead of using cached results",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Print the time spent in scheduler commands and parsing on exit",
+)
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write metrics in the Prometheus text format to this file on exit",
+)
+def main(ctx, silent, email, no_cache, profile, metrics_file):
     """CLI for MyCluster"""
+    if profile:
+        # Imported here as it loads the scheduler backends
+        from .schedulers.metrics import metrics
+
+        ctx.call_on_close(lambda: click.echo(metrics.report(), err=True))
+    if metrics_file:
+        ctx.call_on_close(lambda: write_metrics(metrics_file))
     config = read_config()
     if email is not None:
         config["email"] = email
     if not silent:
+        # Imported here as pyfiglet is slow to import
+        import pyfiglet
+
         config["silent"] = False
         click.echo(pyfiglet.Figlet().renderText("MyCluster"))
         click.echo(f"User email: '{config['email']}'")
-    try:
-        scheduler = mycluster.detect_scheduling_sys()
-        if not silent:
-            click.echo(f"Scheduler '{scheduler.scheduler_type()}' detected")
-        ctx.obj = (scheduler, config)
-    except ConfigurationException as e:
-        click.echo(e)
-        exit(1)
+    ctx.obj = CliContext(config, no_cache)
+
+
+def write_metrics(path):
+    """
+    Atomically replace path with the current metrics so a collector never
+    reads a partial file
+    """
+    from .schedulers.metrics import metrics
+
+    with open(path + ".tmp", "w") as f:
+        f.write(metrics.prometheus())
+    os.replace(path + ".tmp", path)
+
+
+def read_job_specs(specfile):
+    """
+    Read job specs from a CSV file with a header row, or from a file with
+    one JSON object per line
+    """
+    with click.open_file(specfile) as f:
+        if specfile.endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def job_spec_args(spec, user_email):
+    """
+    Convert a job spec using the create command names and defaults into
+    create_submit arguments
+    """
+
+    def optional_int(value):
+        return int(value) if value not in (None, "") else None
+
+    return {
+        "queue_id": spec["queue"],
+        "num_tasks": optional_int(spec.get("ntasks")) or 1,
+        "job_name": spec.get("jobname") or "myclusterjob",
+        "job_script": spec["runscript"],
+        "wall_clock": spec.get("maxtime") or "12:00:00",
+        "openmpi_args": spec.get("ompiargs") or "-bysocket -bind-to-socket",
+        "project_name": spec.get("project") or "default",
+        "tasks_per_node": optional_int(spec.get("taskpernode")),
+        "threads_per_task": optional_int(spec.get("threadspertask")),
+        "user_email": user_email,
+        "qos": spec.get("qos") or "default",
+        "exclusive": str(spec.get("shared", "")).lower() not in ("1", "true", "yes"),
+        "array_size": optional_int(spec.get("array")),
+        "array_limit": optional_int(spec.get("arraylimit")),
+        "array_params": spec.get("arrayparams") or None,
+    }
 
 
 @main.command()
@@ -113,11 +220,11 @@ def queues(ctx):
             "Available Task",
         )
     )
-    for q in ctx.obj[0].queues():
+    for q in ctx.obj.scheduler.queues():
         try:
-            nc = ctx.obj[0].node_config(q)
-            tpn = ctx.obj[0].tasks_per_node(q)
-            avail = ctx.obj[0].available_tasks(q)
+            nc = ctx.obj.scheduler.node_config(q)
+            tpn = ctx.obj.scheduler.tasks_per_node(q)
+            avail = ctx.obj.scheduler.available_tasks(q)
         except SchedulerException:
             nc = None
             tpn = None
@@ -183,6 +290,24 @@ def queues(ctx):
     is_flag=True,
     help="Request shared node allocation",
 )
+@click.option(
+    "--array",
+    type=int,
+    required=False,
+    help="Create an array job with this many tasks",
+)
+@click.option(
+    "--arraylimit",
+    type=int,
+    required=False,
+    help="Maximum number of array tasks to run at once",
+)
+@click.option(
+    "--arrayparams",
+    type=click.Path(exists=True, dir_okay=False),
+    required=False,
+    help="File with one line of parameters per array task",
+)
 @main.command()
 @click.pass_context
 def create(
@@ -199,13 +324,16 @@ def create(
     ompiargs,
     maxtime,
     shared,
+    array,
+    arraylimit,
+    arrayparams,
 ):
     """Create a job file to submit RUNSCRIPT to QUEUE and write it to JOBFILE"""
-    if "email" in ctx.obj[1]:
-        user_email = ctx.obj[1]["email"]
+    if "email" in ctx.obj.config:
+        user_email = ctx.obj.config["email"]
     else:
         user_email = None
-    script = ctx.obj[0].create_submit(
+    script = ctx.obj.scheduler.create_submit(
         queue,
         ntasks,
         jobname,
@@ -218,13 +346,45 @@ def create(
         user_email=user_email,
         qos=qos,
         exclusive=not shared,
+        array_size=array,
+        array_limit=arraylimit,
+        array_params=arrayparams,
     )
     with click.open_file(jobfile, "w") as f:
         f.write(script)
     click.echo(f"Job file written to {jobfile}")
 
 
-@click.argument("jobfile")
+@click.argument("specfile")
+@click.option(
+    "-o",
+    "--outputdir",
+    default=".",
+    help="Directory to write the job files to",
+    show_default=True,
+)
+@main.command("create-batch")
+@click.pass_context
+def create_batch(ctx, specfile, outputdir):
+    """Create a job file for every job in SPECFILE
+
+    SPECFILE is a CSV file (.csv) or JSON lines file describing one job per
+    row using the option names of the create command, plus the required
+    jobfile, queue and runscript fields.
+    """
+    user_email = ctx.obj.config.get("email")
+    specs = [spec for spec in read_job_specs(specfile)]
+    scripts = ctx.obj.scheduler.create_submit_batch(
+        job_spec_args(spec, user_email) for spec in specs
+    )
+    os.makedirs(outputdir, exist_ok=True)
+    for spec, script in zip(specs, scripts):
+        with open(os.path.join(outputdir, spec["jobfile"]), "w") as f:
+            f.write(script)
+    click.echo(f"{len(specs)} job files written to {outputdir}")
+
+
+@click.argument("jobfiles", nargs=-1, required=True)
 @click.option(
     "--immediate",
     is_flag=True,
@@ -235,30 +395,95 @@ def create(
     type=str,
     help="List of job dependencies jobA_id:jobB_id:jobC_id (Slurm only)",
 )
+@click.option(
+    "--parallel",
+    default=4,
+    help="Maximum number of concurrent submissions",
+    show_default=True,
+)
+@click.option(
+    "--rate",
+    type=float,
+    help="Maximum number of submissions per second",
+)
 @main.command()
 @click.pass_context
-def submit(ctx, jobfile, immediate, depends):
-    """Submit a batch script JOBFILE to the scheduler"""
-    if os.path.isfile(jobfile):
-        job_id = ctx.obj[0].submit(jobfile, immediate, depends)
+def submit(ctx, jobfiles, immediate, depends, parallel, rate):
+    """Submit the batch scripts JOBFILES to the scheduler
+
+    JOBFILES may include glob patterns such as 'jobs/*.sh'
+    """
+    scripts = []
+    for jobfile in jobfiles:
+        matches = sorted(glob.glob(jobfile)) if glob.has_magic(jobfile) else [jobfile]
+        for script in matches:
+            if os.path.isfile(script):
+                scripts.append(script)
+            else:
+                click.echo(f"Error: Job file '{script}' not found.")
+        if not matches:
+            click.echo(f"Error: No job files match '{jobfile}'.")
+    if len(scripts) == 1:
+        job_id = ctx.obj.scheduler.submit(scripts[0], immediate, depends)
         click.echo(f"Job submitted with ID '{job_id}'")
-    else:
-        click.echo(f"Error: Job file '{jobfile}' not found.")
+        return
+    results = ctx.obj.scheduler.submit_many(
+        scripts,
+        max_parallel=parallel,
+        rate_limit=rate,
+        immediate=immediate,
+        depends_on=depends,
+    )
+    for result in results:
+        if result["error"] is None:
+            click.echo(
+                f"{result['script']}: Job submitted with ID '{result['job_id']}'"
+            )
+        else:
+            click.echo(f"{result['script']}: Error: {result['error']}")
 
 
 @main.command()
 @click.pass_context
-def list(ctx):
+@click.option("--all", "all_users", is_flag=True, help="List the jobs of all users")
+@click.option("--user", multiple=True, help="List the jobs of this user")
+@click.option("--state", multiple=True, help="Only list jobs in this scheduler state")
+@click.option("--queue", multiple=True, help="Only list jobs in this queue")
+@click.option("--name", multiple=True, help="Only list jobs with this name")
+@click.option(
+    "--since",
+    help="Also list jobs finished since this time, in the scheduler's format",
+)
+def list(ctx, all_users, user, state, queue, name, since):
     """List the status of active jobs"""
+    scheduler = ctx.obj.scheduler
+    if all_users or user or state or queue or name or since:
+        users = [*user] or None
+        if users is None and not all_users:
+            users = [scheduler._get_username()]
+        jobs = scheduler.iter_jobs(
+            users=users,
+            states=[*state] or None,
+            queues=[*queue] or None,
+            names=[*name] or None,
+            since=since,
+        )
+    else:
+        jobs = scheduler.iter_current_jobs()
     print(
-        "{0:^10} | {1:^10} | {2:^10} | {3:^12}".format(
-            "Job ID", "Job Name", "Queue", "Status"
+        "{0:^10} | {1:^10} | {2:^10} | {3:^10} | {4:^12}".format(
+            "Job ID", "Job Name", "User", "Queue", "Status"
         )
     )
-    for job in ctx.obj[0].list_current_jobs():
-        print(
-            f"{job['id']:^10} | {job['name']:^10} | {job['queue']:^10} | {job['state']:^12}"
-        )
+    try:
+        for job in jobs:
+            print(
+                f"{job.id:^10} | {job.name or '':^10} | {job.user or '':^10} | "
+                f"{job.queue or '':^10} | {job.state:^12}"
+            )
+    except (SchedulerException, NotYetImplementedException) as e:
+        click.echo(e)
+        exit(1)
 
 
 @click.argument("jobid", type=int)
@@ -267,7 +492,7 @@ def list(ctx):
 def details(ctx, jobid):
     """Get the details of job with id JOBID"""
     try:
-        click.echo(ctx.obj[0].get_job_details(jobid))
+        click.echo(ctx.obj.scheduler.get_job_details(jobid))
     except SchedulerException as e:
         click.echo(e)
 
@@ -278,9 +503,101 @@ def details(ctx, jobid):
 def cancel(ctx, jobid):
     """Cancel job with id JOBID"""
     try:
-        click.echo(ctx.obj[0].delete(jobid))
+        click.echo(ctx.obj.scheduler.delete(jobid))
+    except SchedulerException as e:
+        click.echo(e)
+
+
+@main.command()
+@click.argument("jobids", nargs=-1)
+@click.option(
+    "--interval",
+    type=float,
+    help="Seconds between polls while jobs are changing state",
+)
+@click.option(
+    "--max-interval",
+    type=float,
+    help="Longest time in seconds between polls while nothing changes",
+)
+@click.pass_context
+def watch(ctx, jobids, interval, max_interval):
+    """Print job state changes of JOBIDS, or of all your jobs, as they happen"""
+    scheduler = ctx.obj.scheduler
+    events = scheduler.watch(
+        [*jobids] or None, min_interval=interval, max_interval=max_interval
+    )
+    try:
+        for event in events:
+            message = (
+                f"{event['job_id']}: {event['old_state'] or 'NEW'} -> "
+                f"{event['new_state']}"
+            )
+            exit_code = (event["details"] or {}).get("exit_code")
+            if exit_code is not None and scheduler.is_terminal(event["new_state"]):
+                message += f" (exit code {exit_code})"
+            click.echo(message)
+    except KeyboardInterrupt:
+        pass
     except SchedulerException as e:
         click.echo(e)
+        exit(1)
+    finally:
+        events.close()
+
+
+@main.command()
+@click.argument("jobids", nargs=-1, required=True)
+@click.option("--timeout", type=float, help="Seconds to wait before giving up")
+@click.option("--poll", type=float, default=5, help="Seconds between the first checks")
+@click.option(
+    "--max-poll", type=float, default=60, help="Longest time in seconds between checks"
+)
+@click.pass_context
+def wait(ctx, jobids, timeout, poll, max_poll):
+    """Wait for JOBIDS to finish and print their details, exits with 1 if any failed"""
+    scheduler = ctx.obj.scheduler
+    try:
+        details = scheduler.wait(jobids, timeout=timeout, poll=poll, max_poll=max_poll)
+    except WaitTimeoutException as e:
+        click.echo(e)
+        exit(2)
+    except SchedulerException as e:
+        click.echo(e)
+        exit(3)
+    for job_id in jobids:
+        click.echo(f"{job_id}: {details[job_id]}")
+    if not all(scheduler.succeeded(job) for job in details.values()):
+        exit(1)
+
+
+@main.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    envvar="MYCLUSTER_DAEMON_SOCKET",
+    required=True,
+    type=click.Path(dir_okay=False),
+    help="Unix socket to listen on, defaults to MYCLUSTER_DAEMON_SOCKET",
+)
+@click.option(
+    "--poll-interval",
+    type=float,
+    default=10,
+    help="Seconds scheduler query results are shared between clients",
+)
+@click.pass_context
+def daemon(ctx, socket_path, poll_interval):
+    """Answer the scheduler queries of every MyCluster user on this host"""
+    from .schedulers.daemon import SchedulerDaemon
+
+    try:
+        SchedulerDaemon(ctx.obj.scheduler, socket_path, poll_interval).serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        click.echo(e)
+        exit(1)
 
 
 if __name__ == "__main__":
@@ -41,3 +41,7 @@ class SchedulerException(Exception):
 
 class NotYetImplementedException(Exception):
     pass
+
+
+class WaitTimeoutException(SchedulerException):
+    pass
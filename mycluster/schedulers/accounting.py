@@ -0,0 +1,200 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import mmap
+import sqlite3
+import hashlib
+import logging
+import platform
+import threading
+
+import click
+
+logger = logging.getLogger(__name__)
+
+# Position of the fields used by MyCluster in a line of the SGE accounting
+# file, named as qacct reports them
+ACCOUNTING_FIELDS = {
+    "qname": 0,
+    "hostname": 1,
+    "owner": 3,
+    "jobname": 4,
+    "jobnumber": 5,
+    "failed": 11,
+    "exit_status": 12,
+    "ru_wallclock": 13,
+    "granted_pe": 33,
+    "slots": 34,
+    "taskid": 35,
+    "cpu": 36,
+    "mem": 37,
+}
+
+
+def index_path(accounting_path):
+    """
+    Default location of the offset index of the accounting file at
+    accounting_path
+    """
+    digest = hashlib.sha1(os.path.abspath(accounting_path).encode()).hexdigest()
+    return os.path.join(
+        click.get_app_dir("MyCluster"),
+        "cache",
+        f"sge-accounting-{platform.node()}-{digest[:12]}.db",
+    )
+
+
+class SGEAccountingFile:
+    """
+    Reads job records straight from the SGE accounting file instead of
+    running qacct, which scans the whole file for every query.
+
+    The byte offset of the last record of every job is kept in a SQLite
+    index at index. Each lookup first indexes the records appended since
+    the previous one, so only new bytes are ever read, and the file is
+    re-indexed from the start if it was rotated.
+    """
+
+    def __init__(self, path, index=None):
+        self.path = path
+        if index is None:
+            index = index_path(path)
+        if index != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(index)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(index, check_same_thread=False, timeout=60)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_number INTEGER PRIMARY KEY, offset INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS indexed ("
+            "path TEXT PRIMARY KEY, inode INTEGER, size INTEGER)"
+        )
+        self._db.commit()
+
+    def records(self, job_ids):
+        """
+        The accounting fields of the last record of each of job_ids that
+        has finished, as a dict keyed by job ID
+        """
+        job_numbers = {}
+        for job_id in job_ids:
+            number = str(job_id).split(".")[0]
+            if number.isdigit():
+                job_numbers[int(number)] = str(job_id)
+        with self._lock, open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or not job_numbers:
+                return {}
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as data:
+                self._update(data, os.fstat(f.fileno()).st_ino)
+                offsets = []
+                numbers = [*job_numbers]
+                # Stay within SQLite's limit on query parameters
+                for start in range(0, len(numbers), 500):
+                    chunk = numbers[start : start + 500]
+                    offsets += self._db.execute(
+                        "SELECT job_number, offset FROM jobs WHERE job_number IN "
+                        f"({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                return {
+                    job_numbers[number]: self._parse(data, offset)
+                    for number, offset in offsets
+                }
+
+    def _update(self, data, inode):
+        """
+        Index the complete records of the mapped file data that have been
+        appended since it was last indexed
+        """
+        with self._db:
+            # Take the write lock first so concurrent processes index each
+            # record only once
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute(
+                "SELECT inode, size FROM indexed WHERE path = ?", (self.path,)
+            ).fetchone()
+            start = 0
+            if (
+                row is not None
+                and row[0] == inode
+                and 0 < row[1] <= len(data)
+                and data[row[1] - 1 : row[1]] == b"\n"
+            ):
+                start = row[1]
+            elif row is not None:
+                logger.debug(f"{self.path} was rotated, indexing it again")
+                self._db.execute("DELETE FROM jobs")
+            if start == len(data):
+                return
+            # Only index complete lines, the last may still be being written
+            end = data.rfind(b"\n", start) + 1
+            if end <= start:
+                return
+            self._db.executemany(
+                "INSERT OR REPLACE INTO jobs (job_number, offset) VALUES (?, ?)",
+                self._scan(data, start, end),
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO indexed (path, inode, size) VALUES (?, ?, ?)",
+                (self.path, inode, end),
+            )
+
+    def _scan(self, data, start, end):
+        """
+        Generate the job number and offset of each record between start and
+        end of data
+        """
+        data.seek(start)
+        offset = start
+        while offset < end:
+            line = data.readline()
+            if not line.startswith(b"#"):
+                fields = line.split(b":", ACCOUNTING_FIELDS["jobnumber"] + 1)
+                if len(fields) > ACCOUNTING_FIELDS["jobnumber"] + 1:
+                    try:
+                        yield int(fields[ACCOUNTING_FIELDS["jobnumber"]]), offset
+                    except ValueError:
+                        pass
+            offset += len(line)
+
+    def _parse(self, data, offset):
+        line = data[offset : data.find(b"\n", offset)].decode(errors="replace")
+        fields = line.split(":")
+        return {
+            name: fields[index]
+            for name, index in ACCOUNTING_FIELDS.items()
+            if index < len(fields)
+        }
@@ -0,0 +1,119 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import time
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import command_deadline
+from mycluster.exceptions import SchedulerException
+
+
+def _async_method(method_name):
+    async def method(self, *args, **kwargs):
+        return await self._call(method_name, *args, **kwargs)
+
+    method.__name__ = method_name
+    method.__doc__ = f"Awaitable version of Scheduler.{method_name}"
+    return method
+
+
+class AsyncScheduler:
+    """
+    asyncio interface to a Scheduler for use from an event loop.
+
+    Scheduler calls run in a pool of max_concurrency worker threads so a
+    slow scheduler command never blocks the event loop. At most
+    max_concurrency calls are in flight at once, further calls wait their
+    turn, and each call fails with a SchedulerException if it takes longer
+    than timeout seconds. The scheduler commands of a call are killed, and
+    not retried, once its timeout has passed so its worker thread is free
+    for the next call.
+    """
+
+    def __init__(self, scheduler, max_concurrency=8, timeout=None):
+        self.scheduler = scheduler
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None
+
+    def scheduler_type(self):
+        return self.scheduler.scheduler_type()
+
+    name = _async_method("name")
+    queues = _async_method("queues")
+    node_config = _async_method("node_config")
+    tasks_per_node = _async_method("tasks_per_node")
+    available_tasks = _async_method("available_tasks")
+    accounts = _async_method("accounts")
+    create_submit = _async_method("create_submit")
+    submit = _async_method("submit")
+    submit_many = _async_method("submit_many")
+    list_current_jobs = _async_method("list_current_jobs")
+    get_job_details = _async_method("get_job_details")
+    get_jobs_details = _async_method("get_jobs_details")
+    delete = _async_method("delete")
+
+    async def _call(self, method_name, *args, **kwargs):
+        if self._semaphore is None:
+            # Created on first use so it belongs to the running loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        call = functools.partial(getattr(self.scheduler, method_name), *args, **kwargs)
+        async with self._semaphore:
+            context = contextvars.copy_context()
+            if self.timeout:
+                context.run(command_deadline.set, time.monotonic() + self.timeout)
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, context.run, call
+            )
+            try:
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                raise SchedulerException(
+                    f"{method_name} timed out after {self.timeout} seconds"
+                )
+
+    def close(self):
+        """
+        Shut down the worker threads
+        """
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
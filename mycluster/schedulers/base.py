@@ -31,21 +31,119 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import pwd
 import sys
+import time
 import logging
+import tempfile
+import threading
+import subprocess
+import contextvars
 from abc import ABC, abstractmethod
-from jinja2 import Environment, FileSystemLoader
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
-from subprocess import check_output
+
+from .cache import TTLCache, cache_path, cached_method
+from .daemon import DAEMON_METHODS, forwarded_method
+from .metrics import metrics, timed_method, timed_methods
+from .templating import templates
+from mycluster.exceptions import (
+    SchedulerException,
+    NotYetImplementedException,
+    WaitTimeoutException,
+)
 
 logger = logging.getLogger(__name__)
 
+JobInfo = namedtuple(
+    "JobInfo", ["id", "queue", "name", "state", "user"], defaults=[None]
+)
+
+# time.monotonic() by which every command run in this context must finish,
+# set for calls that have their own time limit
+command_deadline = contextvars.ContextVar("command_deadline", default=None)
+
 
 class Scheduler(ABC):
     """
     Abstract base class for a batch scheduler interface
     """
 
+    # Query methods memoized by the query cache and their time to live in
+    # seconds, subclass implementations of these are wrapped automatically
+    cache_ttl = {
+        "name": 86400,
+        "queues": 300,
+        "node_config": 86400,
+        "tasks_per_node": 86400,
+        "accounts": 3600,
+    }
+    cache_maxsize = 256
+    cache_enabled = True
+    # Persist the query cache to disk so it is shared between processes
+    cache_persist = False
+    _cache = None
+    _batch_memo = None
+    # Job states, as reported by get_job_details, of jobs that have finished
+    # and of those that finished successfully
+    terminal_states = set()
+    success_states = set()
+    # Seconds before an external command is killed
+    command_timeout = 120
+    # Times a command that failed with one of transient_errors is retried,
+    # waiting command_backoff seconds doubling on each retry
+    command_retries = 3
+    command_backoff = 1.0
+    # Times a command that timed out is retried, a hung controller would
+    # otherwise block the caller for several timeouts
+    command_timeout_retries = 0
+    # Error output of a scheduler command that indicates a transient
+    # controller problem worth retrying
+    transient_errors = []
+    # Registry recording every command run and the latency of every public
+    # method, subclass methods are wrapped automatically
+    metrics = metrics
+    _username = None
+    # Seconds between the polls of watch, starting at the minimum and
+    # backing off towards the maximum while no job changes state
+    watch_min_interval = 2
+    watch_max_interval = 60
+    # Maximum number of submissions started per second by submit_many, so
+    # bulk submission does not trip the scheduler's RPC rate limits
+    submit_rate_limit = 10
+    # Send DAEMON_METHODS to the daemon at MYCLUSTER_DAEMON_SOCKET, if set,
+    # waiting up to daemon_timeout seconds for it to answer
+    use_daemon = True
+    daemon_timeout = 5
+    # DAEMON_METHODS whose answer depends on the user asking, these are
+    # always run directly as the daemon would answer as its own user
+    user_specific_methods = set()
+    # Indexes of the cluster read by _index, keyed by name
+    _indexes = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method_name in DAEMON_METHODS:
+            if method_name in cls.__dict__:
+                setattr(
+                    cls,
+                    method_name,
+                    forwarded_method(method_name, cls.__dict__[method_name]),
+                )
+        for method_name in cls.cache_ttl:
+            if method_name in cls.__dict__:
+                setattr(
+                    cls,
+                    method_name,
+                    cached_method(method_name, getattr(cls, method_name)),
+                )
+        for method_name in list(timed_methods(cls)):
+            setattr(
+                cls, method_name, timed_method(method_name, getattr(cls, method_name))
+            )
+
     @abstractmethod
     def scheduler_type(self):
         """
@@ -105,12 +203,34 @@ class Scheduler(ABC):
         exclusive=True,
         output_name=None,
         gres=None,
+        array_size=None,
+        array_limit=None,
+        array_params=None,
     ):
         """
         Write a new job file
+
+        If array_size is set an array job of array_size tasks is created,
+        running at most array_limit at once. Each task exports its index
+        from 0 as MYCLUSTER_ARRAY_INDEX and, if array_params is given, line
+        MYCLUSTER_ARRAY_INDEX + 1 of that file as MYCLUSTER_ARRAY_PARAMS.
+        array_size defaults to the number of lines in array_params.
         """
         pass
 
+    def create_submit_batch(self, specs):
+        """
+        Generator rendering a job file for each spec, a dict of create_submit
+        arguments, in order. Queue metadata is only queried once per queue
+        for the whole batch.
+        """
+        self._batch_memo = {}
+        try:
+            for spec in specs:
+                yield self.create_submit(**spec)
+        finally:
+            self._batch_memo = None
+
     @abstractmethod
     def submit(
         self, script_name, immediate=False, depends_on=None, depends_on_always_run=False
@@ -120,6 +240,55 @@ class Scheduler(ABC):
         """
         pass
 
+    def submit_many(
+        self,
+        script_names,
+        max_parallel=4,
+        rate_limit=None,
+        immediate=False,
+        depends_on=None,
+        depends_on_always_run=False,
+    ):
+        """
+        Submit every job file in script_names with up to max_parallel
+        submissions in flight, starting at most rate_limit per second
+        (defaults to submit_rate_limit, 0 for no limit).
+
+        Returns a dict with the script, job_id and error (None on success)
+        for each script, in the same order as script_names
+        """
+        if rate_limit is None:
+            rate_limit = self.submit_rate_limit
+        lock = threading.Lock()
+        next_start = [time.monotonic()]
+
+        def submit_one(script_name):
+            if rate_limit:
+                with lock:
+                    now = time.monotonic()
+                    start = max(now, next_start[0])
+                    next_start[0] = start + 1.0 / rate_limit
+                time.sleep(start - now)
+            try:
+                job_id = self.submit(
+                    script_name, immediate, depends_on, depends_on_always_run
+                )
+                return {"script": script_name, "job_id": job_id, "error": None}
+            except Exception as e:
+                logger.debug(f"Submission of {script_name} failed: {e}")
+                return {"script": script_name, "job_id": None, "error": e}
+
+        with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+            return [result for result in pool.map(submit_one, script_names)]
+
+    def array_task_ids(self, job_id, array_size):
+        """
+        IDs of the individual tasks of array job job_id with array_size tasks
+        """
+        raise NotYetImplementedException(
+            f"Array jobs not implemented for {self.scheduler_type()}"
+        )
+
     @abstractmethod
     def list_current_jobs(self):
         """
@@ -127,6 +296,44 @@ class Scheduler(ABC):
         """
         pass
 
+    def iter_current_jobs(self):
+        """
+        Generate a JobInfo for each job currently active with the scheduler,
+        backends override this to parse the queue listing as it is read
+        """
+        for job in self.list_current_jobs():
+            yield JobInfo(job["id"], job["queue"], job["name"], job["state"])
+
+    def list_jobs(self, users=None, states=None, queues=None, names=None, since=None):
+        """
+        List the jobs matching every given filter as dicts, each filter is a
+        list of values any of which may match. users defaults to all users
+        and states are the scheduler's own state codes. If since, a datetime
+        or a time string the scheduler understands, is given jobs that have
+        finished since then are included.
+        """
+        return [
+            job._asdict()
+            for job in self.iter_jobs(
+                users=users, states=states, queues=queues, names=names, since=since
+            )
+        ]
+
+    def iter_jobs(self, users=None, states=None, queues=None, names=None, since=None):
+        """
+        Generate a JobInfo for each job matching the filters of list_jobs.
+        Backends override this to have the scheduler apply the filters, by
+        default only the current user's active jobs can be listed
+        """
+        if since is not None or users is None or set(users) != {self._get_username()}:
+            raise NotYetImplementedException(
+                f"Listing other users' or finished jobs is not implemented "
+                f"for {self.scheduler_type()}"
+            )
+        yield from self._filter_jobs(
+            self.iter_current_jobs(), states=states, queues=queues, names=names
+        )
+
     @abstractmethod
     def get_job_details(self, job_id):
         """
@@ -134,6 +341,19 @@ class Scheduler(ABC):
         """
         pass
 
+    def get_jobs_details(self, job_ids):
+        """
+        Get the details of every job in job_ids as a dict keyed by job ID,
+        jobs the scheduler does not know about are left out
+        """
+        details = {}
+        for job_id in job_ids:
+            try:
+                details[str(job_id)] = self.get_job_details(job_id)
+            except SchedulerException:
+                pass
+        return details
+
     @abstractmethod
     def delete(self, job_id):
         """
@@ -141,12 +361,154 @@ class Scheduler(ABC):
         """
         pass
 
+    def watch(self, job_ids=None, min_interval=None, max_interval=None):
+        """
+        Generate an event dict with the job_id, old_state, new_state and
+        details of each job state change, until every job in job_ids has
+        finished. If job_ids is None the current user's jobs are watched,
+        including any submitted later, until the generator is closed.
+
+        Each poll is a single queue listing followed by one bulk details
+        query for the jobs that changed. Polls start every min_interval
+        seconds and back off towards max_interval while nothing changes.
+        """
+        # Imported here as the tracker and sqlite are only needed to watch
+        from mycluster.tracker import JobTracker
+
+        min_interval = min_interval or self.watch_min_interval
+        max_interval = max_interval or self.watch_max_interval
+        tracker = JobTracker(self, ":memory:")
+        try:
+            if job_ids is not None:
+                tracker.add(*job_ids)
+            interval = min_interval
+            while True:
+                events = tracker.poll(discover=job_ids is None)
+                yield from events
+                if job_ids is not None and not tracker.active():
+                    return
+                if events:
+                    interval = min_interval
+                else:
+                    interval = min(interval * 1.5, max_interval)
+                time.sleep(interval)
+        finally:
+            tracker.close()
+
+    def wait(self, job_ids, timeout=None, poll=5, max_poll=60):
+        """
+        Block until every job in job_ids has reached a terminal state and
+        return their final details keyed by job id.
+
+        All the unfinished jobs are checked with a single query every poll
+        seconds, doubling up to max_poll seconds while none finish. Raises
+        a WaitTimeoutException if the jobs have not finished within timeout
+        seconds.
+        """
+        pending = {str(job_id) for job_id in job_ids}
+        finished = {}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = poll
+        while True:
+            newly_finished = self._finished_jobs(sorted(pending))
+            finished.update(newly_finished)
+            pending -= set(newly_finished)
+            if not pending:
+                return finished
+            if newly_finished:
+                interval = poll
+            delay = interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WaitTimeoutException(
+                        f"Timed out waiting for jobs {', '.join(sorted(pending))}"
+                    )
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            interval = min(interval * 2, max_poll)
+
+    def _finished_jobs(self, job_ids):
+        """
+        The details of the jobs in job_ids that have reached a terminal
+        state, keyed by job id
+        """
+        return {
+            job_id: details
+            for job_id, details in self.get_jobs_details(job_ids).items()
+            if self.is_terminal(details.get("status", ""))
+        }
+
+    def is_terminal(self, status):
+        """
+        Has a job with status, as reported by get_job_details, finished
+        """
+        # Slurm reports cancelled jobs as "CANCELLED by <uid>"
+        return status is not None and status.split(" ")[0] in self.terminal_states
+
+    def succeeded(self, details):
+        """
+        Did a finished job, given its get_job_details, run successfully
+        """
+        status = (details.get("status") or "").split(" ")[0]
+        # Some schedulers give no exit code, or a placeholder, for a job
+        # that succeeded
+        exit_code = str(details.get("exit_code") or "0")
+        return status in self.success_states and (
+            exit_code == "0" or not exit_code.isdigit()
+        )
+
     def accounts(self):
         """
         List billings accounts configured in scheduler
         """
         return []
 
+    def reset_indexes(self):
+        """
+        Drop the indexes of the cluster so the next query reads them again
+        """
+        self._indexes = None
+
+    def invalidate_cache(self, *method_names):
+        """
+        Drop cached query results for method_names, or all if none are given
+        """
+        if not method_names:
+            self._query_cache().invalidate()
+        for method_name in method_names:
+            self._query_cache().invalidate(f"{method_name}:")
+
+    def _index(self, name, max_age, read, refresh=False):
+        """
+        The index name, read again with read() if refresh is set, it has not
+        been read yet or it is older than max_age seconds
+        """
+        if self._indexes is None:
+            self._indexes = {}
+        index = self._indexes.get(name)
+        if refresh or index is None or time.time() - index.timestamp > max_age:
+            index = self._indexes[name] = read()
+        return index
+
+    def _query_cache(self):
+        if self._cache is None:
+            path = cache_path(self.scheduler_type()) if self.cache_persist else None
+            self._cache = TTLCache(self.cache_maxsize, path)
+        return self._cache
+
+    def _array_args(self, array_size, array_params):
+        """
+        Returns the number of tasks and absolute parameter file path for an
+        array job
+        """
+        if array_params is not None:
+            array_params = os.path.abspath(array_params)
+            if array_size is None:
+                with open(array_params) as f:
+                    array_size = sum(1 for line in f)
+        return array_size, array_params
+
     def _get_template_name(self):
         if "MYCLUSTER_TEMPLATE" in os.environ:
             logger.debug(
@@ -158,24 +520,11 @@ class Scheduler(ABC):
 
     def _load_template(self, template_name):
         """
-        Load the jinja2 template with name template_name
-        1. Check if template_name is absolute
+        Load the compiled jinja2 template with name template_name
+        1. Check if template_name is a file
         2. Try loading it from templates dir
         """
-        if os.path.isfile(template_name):
-            logger.debug(f'File "{template_name}" exists, loading it.')
-            env = Environment(loader=FileSystemLoader(os.path.dirname(template_name)))
-            return env.get_template(os.path.basename(template_name))
-        else:
-            logger.debug(
-                f'Loading template "{template_name}" from "{os.path.join(os.path.dirname(__file__), "templates")}"'
-            )
-            env = Environment(
-                loader=FileSystemLoader(
-                    os.path.join(os.path.dirname(__file__), "templates")
-                )
-            )
-            return env.get_template(template_name)
+        return templates.get_template(template_name)
 
     def _get_data(self, filename):
         """
@@ -226,8 +575,240 @@ class Scheduler(ABC):
 
         return timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
 
+    def _run(self, command, check=True, timeout=None, retries=None, stdin_file=None):
+        """
+        Run command, a list of arguments, directly without a shell and return
+        the CompletedProcess with stdout and stderr decoded to str.
+
+        The command is killed after timeout seconds (command_timeout if None,
+        0 to wait forever). Failures matching transient_errors are retried up
+        to retries times (command_retries if None) with exponential backoff,
+        timeouts at most command_timeout_retries times. If check is set a
+        non-zero exit status raises a SchedulerException. stdin_file is
+        passed to the command as stdin.
+        """
+        timeout = self._command_timeout(command, timeout)
+        if command_deadline.get() is not None:
+            # No time is left for a retry
+            retries = 0
+        retries = self.command_retries if retries is None else retries
+        timeout_retries = min(retries, self.command_timeout_retries)
+        delay = self.command_backoff
+        for attempt in range(retries + 1):
+            result = None
+            start = time.monotonic()
+            try:
+                stdin = open(stdin_file) if stdin_file else subprocess.DEVNULL
+                try:
+                    result = subprocess.run(
+                        command,
+                        stdin=stdin,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        timeout=timeout or None,
+                    )
+                finally:
+                    if stdin_file:
+                        stdin.close()
+            except subprocess.TimeoutExpired:
+                logger.debug(
+                    f"{command[0]} timed out after {round(timeout, 1):g} seconds"
+                )
+            except OSError as e:
+                raise SchedulerException(f"Unable to run {command[0]}: {e}")
+            finally:
+                self._record_command(command, time.monotonic() - start, result)
+            if result is None:
+                if attempt >= timeout_retries:
+                    break
+            else:
+                result.stdout = result.stdout.decode("UTF-8", errors="replace")
+                result.stderr = result.stderr.decode("UTF-8", errors="replace")
+                if result.returncode == 0 or not any(
+                    error in result.stderr + result.stdout
+                    for error in self.transient_errors
+                ):
+                    break
+            if attempt < retries:
+                logger.debug(f"Retrying {command[0]} in {delay} seconds")
+                time.sleep(delay)
+                delay *= 2
+        if result is None:
+            raise SchedulerException(
+                f"{command[0]} timed out after {round(timeout, 1):g} seconds"
+            )
+        if check and result.returncode != 0:
+            raise SchedulerException(
+                f"{command[0]} failed with exit code {result.returncode}: "
+                + result.stderr.strip()
+            )
+        return result
+
+    @contextmanager
+    def _stream(self, command, check=True, timeout=None):
+        """
+        Run command, a list of arguments, without a shell and provide its
+        output as a file to be read incrementally, for listings too large to
+        hold in memory.
+
+        The command is killed after timeout seconds (command_timeout if None,
+        0 to wait forever) or if the file is not read to the end. As output
+        may already have been used a failed command is never retried. If
+        check is set a non-zero exit status raises a SchedulerException
+        once the output has been read.
+        """
+        timeout = self._command_timeout(command, timeout)
+        # stderr goes to a file so a full pipe can never block the command
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                process = subprocess.Popen(
+                    command,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr,
+                    encoding="UTF-8",
+                    errors="replace",
+                )
+            except OSError as e:
+                raise SchedulerException(f"Unable to run {command[0]}: {e}")
+            timed_out = threading.Event()
+
+            def kill():
+                timed_out.set()
+                process.kill()
+
+            timer = threading.Timer(timeout, kill) if timeout else None
+            if timer is not None:
+                timer.start()
+            output = _CountingReader(process.stdout)
+            try:
+                yield output
+            finally:
+                if not output.eof:
+                    # Stopped reading early, the rest of the output is not
+                    # wanted
+                    process.kill()
+                process.stdout.close()
+                wait_start = time.monotonic()
+                returncode = process.wait()
+                if timer is not None:
+                    timer.cancel()
+                # Only the time spent waiting on the command counts, the
+                # rest was spent parsing its output
+                self.metrics.record_command(
+                    command,
+                    output.wait_time + time.monotonic() - wait_start,
+                    returncode,
+                    output.nbytes,
+                )
+            if timed_out.is_set():
+                raise SchedulerException(
+                    f"{command[0]} timed out after {round(timeout, 1):g} seconds"
+                )
+            if check and output.eof and returncode != 0:
+                stderr.seek(0)
+                raise SchedulerException(
+                    f"{command[0]} failed with exit code {returncode}: "
+                    + stderr.read().decode("UTF-8", errors="replace").strip()
+                )
+
+    def _command_timeout(self, command, timeout):
+        """
+        Seconds command may run for, timeout or command_timeout if None cut
+        short by the command_deadline of the calling context
+        """
+        timeout = self.command_timeout if timeout is None else timeout
+        deadline = command_deadline.get()
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise SchedulerException(f"No time left to run {command[0]}")
+        return min(timeout, remaining) if timeout else remaining
+
     def _check_output(self, command_list):
         """
-        check_output wrapper that decodes to a str instead of bytes
+        Run command_list and return its output as a str
+        """
+        return self._run(command_list).stdout
+
+    def _record_command(self, command, elapsed, result):
+        """
+        Record the latency of each external command in the metrics registry
+        """
+        logger.debug(f"{' '.join(command)} took {elapsed:.3f} seconds")
+        if result is None:
+            self.metrics.record_command(command, elapsed, None, 0)
+        else:
+            self.metrics.record_command(
+                command, elapsed, result.returncode, len(result.stdout)
+            )
+
+    def _filter_jobs(self, jobs, users=None, states=None, queues=None, names=None):
+        """
+        Filter JobInfos by the filters the scheduler could not apply itself
+        """
+        for job in jobs:
+            if (
+                (users is None or job.user in users)
+                and (states is None or job.state in states)
+                and (queues is None or job.queue in queues)
+                and (names is None or job.name in names)
+            ):
+                yield job
+
+    def _format_since(self, since, time_format="%Y-%m-%dT%H:%M:%S"):
+        """
+        since as a string for the scheduler, datetimes are formatted with
+        time_format
         """
-        return check_output(command_list).decode("UTF-8")
+        if hasattr(since, "strftime"):
+            return since.strftime(time_format)
+        return str(since)
+
+    def _parse_job_id(self, job_id):
+        """
+        Job ids are ints apart from array tasks and the like
+        """
+        return int(job_id) if job_id.isdigit() else job_id
+
+    def _get_username(self):
+        """
+        Name of the user running MyCluster, looked up once per process
+        """
+        if Scheduler._username is None:
+            Scheduler._username = pwd.getpwuid(os.geteuid()).pw_name
+        return Scheduler._username
+
+
+class _CountingReader:
+    """
+    Read only file wrapper counting the characters read, the time spent
+    waiting for them and whether the end of the file was reached
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self.nbytes = 0
+        self.wait_time = 0.0
+        self.eof = False
+
+    def read(self, size=-1):
+        start = time.monotonic()
+        data = self._f.read(size)
+        self.wait_time += time.monotonic() - start
+        self.nbytes += len(data)
+        if not data or size is None or size < 0:
+            self.eof = True
+        return data
+
+    def __iter__(self):
+        while True:
+            start = time.monotonic()
+            line = self._f.readline()
+            self.wait_time += time.monotonic() - start
+            if not line:
+                self.eof = True
+                return
+            self.nbytes += len(line)
+            yield line
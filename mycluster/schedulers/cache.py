@@ -0,0 +1,171 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import json
+import time
+import copy
+import logging
+import platform
+import functools
+import threading
+from collections import OrderedDict
+
+import click
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Bounded LRU cache where every entry expires after its own time to live,
+    optionally persisted as JSON to path
+    """
+
+    def __init__(self, maxsize=256, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self._loaded = False
+
+    def get(self, key):
+        """
+        Returns (True, value) if key is cached and not expired, else (False, None)
+        """
+        with self._lock:
+            self._load()
+            if key in self._data:
+                expires, value = self._data[key]
+                if expires > time.time():
+                    self._data.move_to_end(key)
+                    return True, copy.deepcopy(value)
+                del self._data[key]
+            return False, None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._load()
+            self._data[key] = (time.time() + ttl, copy.deepcopy(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._save()
+
+    def invalidate(self, prefix=None):
+        """
+        Drop every entry, or only those whose key starts with prefix
+        """
+        with self._lock:
+            self._load()
+            if prefix is None:
+                self._data.clear()
+            else:
+                for key in [k for k in self._data if k.startswith(prefix)]:
+                    del self._data[key]
+            self._save()
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Ignoring unreadable cache file {self.path}: {e}")
+            return
+        now = time.time()
+        for key, expires, value in entries:
+            if expires > now:
+                self._data[key] = (expires, value)
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}"
+            with open(tmp, "w") as f:
+                json.dump([[k, e, v] for k, (e, v) in self._data.items()], f)
+            os.replace(tmp, self.path)
+        except (OSError, TypeError) as e:
+            logger.debug(f"Unable to write cache file {self.path}: {e}")
+
+
+def cache_key(method_name, args, kwargs):
+    return f"{method_name}:" + json.dumps([args, kwargs], sort_keys=True, default=str)
+
+
+def cache_path(scheduler_type):
+    """
+    Location of the on-disk query cache for this scheduler type and host
+    """
+    return os.path.join(
+        click.get_app_dir("MyCluster"),
+        "cache",
+        f"{scheduler_type}-{platform.node()}.json",
+    )
+
+
+def cached_method(method_name, func):
+    """
+    Wrap the Scheduler method func so results are memoized in the instances
+    query cache for the TTL configured in Scheduler.cache_ttl
+    """
+
+    def lookup(self, key, args, kwargs):
+        if not self.cache_enabled:
+            return func(self, *args, **kwargs)
+        cache = self._query_cache()
+        hit, value = cache.get(key)
+        if hit:
+            logger.debug(f"Cache hit for {key}")
+            return value
+        value = func(self, *args, **kwargs)
+        cache.set(key, value, self.cache_ttl[method_name])
+        return value
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        key = cache_key(method_name, args, kwargs)
+        if self._batch_memo is not None:
+            # Within create_submit_batch each query is only answered once
+            if key not in self._batch_memo:
+                self._batch_memo[key] = lookup(self, key, args, kwargs)
+            return self._batch_memo[key]
+        return lookup(self, key, args, kwargs)
+
+    return wrapper
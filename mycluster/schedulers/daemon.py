@@ -0,0 +1,407 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import pwd
+import json
+import errno
+import socket
+import struct
+import logging
+import functools
+import threading
+import socketserver
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from .cache import TTLCache, cache_key
+from mycluster.exceptions import NotYetImplementedException
+
+logger = logging.getLogger(__name__)
+
+# Scheduler queries a client sends to the daemon when one is configured and
+# the daemon query answering each, iter_current_jobs is answered with the
+# listing of list_current_jobs
+DAEMON_METHODS = {
+    "list_current_jobs": "list_current_jobs",
+    "iter_current_jobs": "list_current_jobs",
+    "get_job_details": "get_job_details",
+    "get_jobs_details": "get_jobs_details",
+    "_finished_jobs": "_finished_jobs",
+    "queues": "queues",
+    "available_tasks": "available_tasks",
+}
+
+
+def daemon_socket():
+    """
+    Path of the daemon socket clients use, None if no daemon is configured
+    """
+    return os.getenv("MYCLUSTER_DAEMON_SOCKET") or None
+
+
+class DaemonUnavailable(Exception):
+    """
+    The daemon could not answer a query, the client runs it itself
+    """
+
+    pass
+
+
+def _encode(value):
+    if isinstance(value, timedelta):
+        return {"__timedelta__": value.total_seconds()}
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _decode(value):
+    if "__timedelta__" in value:
+        return timedelta(seconds=value["__timedelta__"])
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    return value
+
+
+def _dumps(message):
+    return (json.dumps(message, default=_encode) + "\n").encode()
+
+
+def _loads(line):
+    return json.loads(line, object_hook=_decode)
+
+
+class DaemonClient:
+    """
+    Sends scheduler queries to the daemon listening on the Unix socket path
+    """
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+
+    def call(self, scheduler_type, method_name, args, kwargs=None):
+        request = {
+            "scheduler": scheduler_type,
+            "method": method_name,
+            "args": args,
+            "kwargs": kwargs or {},
+        }
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                sock.sendall(_dumps(request))
+                with sock.makefile("rb") as f:
+                    line = f.readline()
+            response = _loads(line)
+        except (OSError, ValueError) as e:
+            raise DaemonUnavailable(f"No response from daemon at {self.path}: {e}")
+        if "error" in response:
+            raise DaemonUnavailable(response["error"])
+        return response["result"]
+
+
+def forwarded_method(method_name, func):
+    """
+    Wrap the Scheduler method func so it is answered by the daemon when
+    MYCLUSTER_DAEMON_SOCKET is set, falling back to func if the daemon
+    cannot answer
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        path = daemon_socket()
+        if (
+            path is None
+            or not self.use_daemon
+            or method_name in self.user_specific_methods
+        ):
+            return func(self, *args, **kwargs)
+        try:
+            result = DaemonClient(path, self.daemon_timeout).call(
+                self.scheduler_type(), DAEMON_METHODS[method_name], [*args], kwargs
+            )
+        except DaemonUnavailable as e:
+            logger.debug(f"Running {method_name} directly: {e}")
+            return func(self, *args, **kwargs)
+        if method_name == "iter_current_jobs":
+            from .base import JobInfo
+
+            return iter(
+                [
+                    JobInfo(
+                        job["id"], job["queue"], job["name"], job["state"], job["user"]
+                    )
+                    for job in result
+                ]
+            )
+        return result
+
+    return wrapper
+
+
+class SchedulerDaemon:
+    """
+    Answers the scheduler queries of every client on this host from one
+    scheduler instance.
+
+    The queue of all users is listed at most once every poll_interval
+    seconds and each client is only shown their own jobs, identified by
+    the credentials of the connecting process. Job details and available
+    tasks are cached for poll_interval seconds, queues for the scheduler's
+    own cache_ttl. Concurrent requests for the same query wait for a single
+    scheduler call. Job details are only shared with the owner of the job,
+    as last seen in the queue. The scheduler's user_specific_methods are
+    not answered.
+    """
+
+    # Owners of jobs seen in the queue that are remembered
+    max_owners = 100000
+
+    def __init__(self, scheduler, path, poll_interval=10):
+        self.scheduler = scheduler
+        # The daemon must answer queries itself rather than ask a daemon
+        self.scheduler.use_daemon = False
+        self.path = path
+        self.poll_interval = poll_interval
+        self._cache = TTLCache(maxsize=4096)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._usernames = {}
+        self._owners = OrderedDict()
+        self._owners_lock = threading.Lock()
+        self._server = None
+
+    def serve_forever(self):
+        self._remove_stale_socket()
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                uid = daemon._peer_uid(self.request)
+                for line in self.rfile:
+                    self.wfile.write(_dumps(daemon.handle(_loads(line), uid)))
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self._server.daemon_threads = True
+        # Every user may connect, each is only answered with their own jobs
+        os.chmod(self.path, 0o666)
+        logger.info(f"Serving {self.scheduler.scheduler_type()} on {self.path}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self.path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def handle(self, request, uid):
+        """
+        Response to request from the user with uid, None if unknown
+        """
+        try:
+            if request.get("scheduler") != self.scheduler.scheduler_type():
+                raise DaemonUnavailable(
+                    f"Daemon serves {self.scheduler.scheduler_type()}"
+                )
+            method_name = request["method"]
+            args = request.get("args", [])
+            kwargs = request.get("kwargs", {})
+            if method_name in self.scheduler.user_specific_methods:
+                raise DaemonUnavailable(f"{method_name} depends on the user")
+            if method_name == "list_current_jobs":
+                result = self.list_current_jobs(uid, *args, **kwargs)
+            elif method_name == "get_job_details":
+                result = self.get_job_details(uid, *args, **kwargs)
+            elif method_name == "get_jobs_details":
+                result = self.get_jobs_details(uid, *args, **kwargs)
+            elif method_name == "_finished_jobs":
+                result = self.finished_jobs(uid, *args, **kwargs)
+            elif method_name == "queues":
+                result = self.scheduler.queues(*args, **kwargs)
+            elif method_name == "available_tasks":
+                result = self._cached(
+                    cache_key(method_name, args, kwargs),
+                    lambda: self.scheduler.available_tasks(*args, **kwargs),
+                )
+            else:
+                raise DaemonUnavailable(f"Unknown method {method_name}")
+            return {"result": result}
+        except Exception as e:
+            logger.debug(f"Unable to answer {request}: {e}")
+            return {"error": str(e)}
+
+    def list_current_jobs(self, uid):
+        username = self._username(uid)
+        jobs = self._all_jobs()
+        if jobs is None:
+            # The scheduler can only list the daemon user's own jobs
+            if uid != os.geteuid():
+                raise DaemonUnavailable("Only the daemon user's jobs are listed")
+            return self._cached("list_current_jobs", self.scheduler.list_current_jobs)
+        return [job for job in jobs if job["user"] == username]
+
+    def get_job_details(self, uid, job_id):
+        details = self.get_jobs_details(uid, [job_id])
+        if str(job_id) not in details:
+            raise DaemonUnavailable(f"No details of job {job_id}")
+        return details[str(job_id)]
+
+    def get_jobs_details(self, uid, job_ids):
+        """
+        Details of job_ids, each job is cached on its own so the clients
+        tracking overlapping jobs share the scheduler queries
+        """
+        job_ids = [str(job_id) for job_id in job_ids]
+        self._check_owner(uid, job_ids)
+        details = {}
+        for job_id in job_ids:
+            hit, value = self._cache.get(cache_key("get_job_details", [job_id], {}))
+            if hit:
+                details[job_id] = value
+        missing = [job_id for job_id in job_ids if job_id not in details]
+        if missing:
+            found = self._cached(
+                cache_key("get_jobs_details", [missing], {}),
+                lambda: self.scheduler.get_jobs_details(missing),
+            )
+            for job_id, value in found.items():
+                self._cache.set(
+                    cache_key("get_job_details", [job_id], {}),
+                    value,
+                    self.poll_interval,
+                )
+            details.update(found)
+        return details
+
+    def finished_jobs(self, uid, job_ids):
+        job_ids = [str(job_id) for job_id in job_ids]
+        self._check_owner(uid, job_ids)
+        return self._cached(
+            cache_key("_finished_jobs", [sorted(job_ids)], {}),
+            lambda: self.scheduler._finished_jobs(job_ids),
+        )
+
+    def _check_owner(self, uid, job_ids):
+        """
+        Refuse to share the details of jobs not known to belong to uid
+        """
+        if uid == os.geteuid():
+            return
+        username = self._username(uid)
+        # Refresh the owners of the jobs in the queue
+        self._all_jobs()
+        with self._owners_lock:
+            others = [
+                job_id for job_id in job_ids if self._owners.get(job_id) != username
+            ]
+        if others:
+            raise DaemonUnavailable(
+                f"Jobs {', '.join(others)} are not known to belong to {username}"
+            )
+
+    def _all_jobs(self):
+        """
+        The jobs of every user, None if the scheduler cannot list them
+        """
+
+        def list_jobs():
+            try:
+                jobs = self.scheduler.list_jobs()
+            except NotYetImplementedException:
+                return None
+            # Owners are remembered after the jobs leave the queue so their
+            # final details can be shared
+            with self._owners_lock:
+                for job in jobs:
+                    self._owners[str(job["id"])] = job["user"]
+                    self._owners.move_to_end(str(job["id"]))
+                while len(self._owners) > self.max_owners:
+                    self._owners.popitem(last=False)
+            return jobs
+
+        return self._cached("list_jobs", list_jobs)
+
+    def _cached(self, key, func):
+        hit, value = self._cache.get(key)
+        if hit:
+            return value
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            # Another request may have refreshed the value while this waited
+            hit, value = self._cache.get(key)
+            if hit:
+                return value
+            value = func()
+            self._cache.set(key, value, self.poll_interval)
+            return value
+
+    def _peer_uid(self, sock):
+        """
+        User ID of the process at the other end of sock, None if the
+        platform cannot tell
+        """
+        if not hasattr(socket, "SO_PEERCRED"):
+            return None
+        creds = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        pid, uid, gid = struct.unpack("3i", creds)
+        return uid
+
+    def _username(self, uid):
+        if uid is None:
+            raise DaemonUnavailable("Unable to identify the client user")
+        if uid not in self._usernames:
+            self._usernames[uid] = pwd.getpwuid(uid).pw_name
+        return self._usernames[uid]
+
+    def _remove_stale_socket(self):
+        """
+        Remove a socket left behind by a daemon that is no longer running
+        """
+        if not os.path.exists(self.path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self.path)
+            except OSError as e:
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    os.unlink(self.path)
+                    return
+                raise
+        raise OSError(errno.EADDRINUSE, f"A daemon is already serving {self.path}")
@@ -31,17 +31,169 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-import os
 import re
+import json
 import math
-import subprocess
+import time
 import datetime
 
-from .base import Scheduler
-from mycluster.exceptions import SchedulerException, ConfigurationException
+from .base import Scheduler, JobInfo
+from mycluster.exceptions import (
+    SchedulerException,
+    ConfigurationException,
+    NotYetImplementedException,
+)
+
+
+def _memory_gb(value):
+    """
+    Gigabytes in an LSF memory size such as 186.5G, 0 if unknown
+    """
+    match = re.match(r"([\d.]+)([KMGT]?)", str(value).strip().upper())
+    if match is None:
+        return 0.0
+    scale = {"K": 1 / 1024**2, "M": 1 / 1024, "": 1 / 1024, "G": 1, "T": 1024}
+    return float(match.group(1)) * scale[match.group(2)]
+
+
+def _json_records(output):
+    """
+    Records of the -json output of an LSF command, keyed by lower case field
+    """
+    try:
+        records = json.loads(output).get("RECORDS", [])
+    except ValueError:
+        raise SchedulerException("Error parsing LSF output")
+    return [{key.lower(): value for key, value in record.items()} for record in records]
+
+
+class LSFIndex:
+    """
+    Hosts and statistics of every queue, parsed from one `bqueues -l`, one
+    `bhosts -json`, one `lshosts -json` and one `bmgroup -w` call
+    """
+
+    def __init__(self, bqueues, bhosts, lshosts, bmgroup, timestamp=None):
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.hosts = {}
+        for record in _json_records(bhosts):
+            self.hosts[record["host_name"]] = {"slots": record.get("max", "-")}
+        for record in _json_records(lshosts):
+            host = self.hosts.setdefault(record["host_name"], {"slots": "-"})
+            host["ncpus"] = record.get("ncpus", "-")
+            host["memory"] = _memory_gb(record.get("maxmem"))
+        self.groups = {}
+        for line in bmgroup.splitlines()[1:]:
+            if line.strip():
+                group, *members = line.split()
+                self.groups[group] = members
+        self.queue_hosts = {}
+        self.queue_stats = {}
+        queue = None
+        header = None
+        for line in bqueues.splitlines():
+            if line.startswith("QUEUE:"):
+                queue = line.split(":", 1)[1].strip()
+                self.queue_stats[queue] = {}
+                self.queue_hosts[queue] = []
+            elif queue is None:
+                continue
+            elif line.startswith("PRIO"):
+                header = line.split()
+            elif header is not None:
+                self.queue_stats[queue] = dict(zip(header, line.split()))
+                header = None
+            elif line.startswith("HOSTS:"):
+                self.queue_hosts[queue] = self._resolve(line.split()[1:])
+
+    def _resolve(self, members, seen=()):
+        """
+        Host names of the bqueues or bmgroup host list members
+        """
+        hosts = []
+        for member in members:
+            # Drop host preferences such as hostA+2
+            member = member.split("+")[0]
+            if member in ("all", "allremote", "others"):
+                hosts += [*self.hosts]
+            elif member.endswith("/") or member in self.groups:
+                group = member.rstrip("/")
+                if group not in seen:
+                    hosts += self._resolve(self.groups.get(group, []), seen + (group,))
+            elif member and member != "none" and not member.startswith("~"):
+                hosts.append(member)
+        return hosts
+
+    def _first_host(self, queue_id):
+        """
+        Details of the first host of queue_id, None if it has no hosts
+        """
+        if queue_id not in self.queue_hosts:
+            raise SchedulerException(f"Unknown queue {queue_id}")
+        for name in self.queue_hosts[queue_id]:
+            if name in self.hosts:
+                return self.hosts[name]
+        return None
+
+    def tasks_per_node(self, queue_id):
+        host = self._first_host(queue_id)
+        if host is None:
+            return 1
+        # Hosts without a slot limit run a task per CPU
+        for slots in (host["slots"], host.get("ncpus", "-")):
+            if str(slots).isdigit():
+                return int(slots)
+        return 1
+
+    def node_config(self, queue_id):
+        host = self._first_host(queue_id)
+        if host is None:
+            return {"max task": 0, "max thread": 0, "max memory": 0}
+        tasks = self.tasks_per_node(queue_id)
+        return {
+            "max task": tasks,
+            "max thread": tasks,
+            "max memory": host.get("memory", 0.0),
+        }
+
+    def available_tasks(self, queue_id):
+        if queue_id not in self.queue_stats:
+            raise SchedulerException(f"Unknown queue {queue_id}")
+        stats = self.queue_stats[queue_id]
+        max_tasks = int(stats["MAX"]) if stats.get("MAX", "-").isdigit() else 0
+        run_tasks = int(stats["RUN"]) if stats.get("RUN", "-").isdigit() else 0
+        return {"available": max_tasks - run_tasks, "max tasks": max_tasks}
 
 
 class LSF(Scheduler):
+    terminal_states = {"DONE", "EXIT"}
+    success_states = {"DONE"}
+    transient_errors = [
+        "LSF is down",
+        "LIM is down",
+        "not responding",
+        "Failed in an LSF library call",
+    ]
+    # bjobs flag listing the jobs in each state, the flags select a group
+    # of states so the listing is also filtered by state
+    _bjobs_state_flags = {
+        "RUN": "-r",
+        "PEND": "-p",
+        "PSUSP": "-s",
+        "USUSP": "-s",
+        "SSUSP": "-s",
+        "DONE": "-d",
+        "EXIT": "-d",
+    }
+    # Queues are listed for the user, bqueues -u
+    user_specific_methods = {"queues"}
+    # Seconds an LSFIndex is reused before LSF is queried again
+    index_max_age = 10
+    # bjobs output fields used by get_job_details
+    _bjobs_format = "jobid run_time cpu_used queue slots stat exit_code start_time estimated_start_time finish_time"
+    # Event log files bhist searches for jobs bjobs has forgotten, 0 for all
+    bhist_event_files = 5
+
     def scheduler_type(self):
         return "lsf"
 
@@ -54,69 +206,36 @@ class LSF(Scheduler):
 
     def queues(self):
         queue_list = []
-        with os.popen("bqueues -w -u `whoami`") as f:
-            f.readline()  # read header
-            for line in f:
-                q = line.split(" ")[0].strip()
-                queue_list.append(q)
+        output = self._run(["bqueues", "-w", "-u", self._get_username()], check=False)
+        # Skip the header
+        for line in output.stdout.splitlines()[1:]:
+            q = line.split(" ")[0].strip()
+            queue_list.append(q)
         return queue_list
 
+    def index(self, refresh=False):
+        """
+        Return an LSFIndex of the queues and hosts, re-reading them if the
+        current one is older than index_max_age seconds
+        """
+        return self._index("index", self.index_max_age, self._read_index, refresh)
+
+    def _read_index(self):
+        return LSFIndex(
+            self._check_output(["bqueues", "-l"]),
+            self._check_output(["bhosts", "-o", "HOST_NAME STATUS MAX", "-json"]),
+            self._check_output(["lshosts", "-o", "HOST_NAME ncpus maxmem", "-json"]),
+            self._run(["bmgroup", "-w"], check=False).stdout,
+        )
+
     def node_config(self, queue_id):
-        # Find first node with queue and record node config
-        # bqueues -l queue_id
-        host_list = None
-        config = {}
-        q_output = self._check_output(["bqueues", "-l", queue_id]).splitlines()
-        for line in q_output:
-            if line.startswith("HOSTS:"):
-                host_list = line.strip().rsplit(" ", 1)[1].replace("/", "")
-                if host_list == "none":
-                    config["max task"] = 0
-                    config["max thread"] = 0
-                    config["max memory"] = 0
-                    return config
-        bhosts_output = self._check_output(["bhosts", "-l", host_list]).splitlines()
-        line = re.sub(" +", " ", bhosts_output[2]).strip()
-        tasks = int(line.split(" ")[3])
-        line = re.sub(" +", " ", bhosts_output[6]).strip()
-        memory = float(line.split(" ")[11].replace("G", ""))
-        config["max task"] = tasks
-        config["max thread"] = tasks
-        config["max memory"] = memory
-        return config
+        return self.index().node_config(queue_id)
 
     def tasks_per_node(self, queue_id):
-        host_list = None
-        q_output = self._check_output(["bqueues", "-l", queue_id]).splitlines()
-        for line in q_output:
-            if line.startswith("HOSTS:"):
-                host_list = line.strip().rsplit(" ", 1)[1].replace("/", "")
-                if host_list == "none":
-                    return 1
-        bhosts_output = self._check_output(["bhosts", "-l", host_list]).splitlines()
-        line = re.sub(" +", " ", bhosts_output[2]).strip()
-        tasks = int(line.split(" ")[3])
-        return tasks
+        return self.index().tasks_per_node(queue_id)
 
     def available_tasks(self, queue_id):
-        # split queue id into queue and parallel env
-        # list free slots
-        free_tasks = 0
-        max_tasks = 0
-        run_tasks = 0
-        queue_name = queue_id
-        q_output = self._check_output(["bqueues", queue_name]).splitlines()
-        for line in q_output:
-            if line.startswith(queue_name):
-                new_line = re.sub(" +", " ", line).strip()
-                try:
-                    max_tasks = int(new_line.split(" ")[4])
-                except:
-                    pass
-                pen_tasks = int(new_line.split(" ")[8])
-                run_tasks = int(new_line.split(" ")[9])
-                sus_tasks = int(new_line.split(" ")[10])
-        return {"available": max_tasks - run_tasks, "max tasks": max_tasks}
+        return self.index().available_tasks(queue_id)
 
     def create_submit(
         self,
@@ -133,10 +252,14 @@ class LSF(Scheduler):
         qos=None,
         exclusive=True,
         output_name=None,
-        gres=None
+        gres=None,
+        array_size=None,
+        array_limit=None,
+        array_params=None,
     ):
+        queue_tasks_per_node = self.tasks_per_node(queue_id)
         if tasks_per_node is None:
-            tasks_per_node = self.tasks_per_node(queue_id)
+            tasks_per_node = queue_tasks_per_node
         num_nodes = int(math.ceil(float(num_tasks) / float(tasks_per_node)))
 
         if threads_per_task is None:
@@ -149,14 +272,16 @@ class LSF(Scheduler):
             wall_clock = wall_clock.rsplit(":", 1)[0]
 
         if "mycluster-" in job_script:
-            my_script = self._get_data(my_script)
+            job_script = self._get_data(job_script)
 
-        num_queue_slots = num_nodes * self.tasks_per_node(queue_id)
+        num_queue_slots = num_nodes * queue_tasks_per_node
 
         if output_name is None:
             output_name = job_name + ".out"
 
-        template = self._load_template("lsf.jinja")
+        array_size, array_params = self._array_args(array_size, array_params)
+
+        template = self._load_template(self._get_template_name())
 
         script_str = template.render(
             my_name=job_name,
@@ -174,6 +299,9 @@ class LSF(Scheduler):
             openmpi_args=openmpi_args,
             qos=qos,
             exclusive=exclusive,
+            array_size=array_size,
+            array_limit=array_limit,
+            array_params=array_params,
         )
 
         return script_str
@@ -184,105 +312,167 @@ class LSF(Scheduler):
         job_id = None
         if immediate:
             raise NotYetImplementedException("Immediate not yet implemented for LSF")
+        command = ["bsub"]
         if depends_on and depends_on_always_run:
-            cmd = 'bsub -w "ended(%s)" < %s ' % (depends_on, script_name)
-            with os.popen(cmd) as f:
-                output = f.readline()
-                try:
-                    job_id = int(output.split(" ")[1].replace("<", "").replace(">", ""))
-                except:
-                    raise SchedulerException("Job submission failed: " + output)
+            command += ["-w", f"ended({depends_on})"]
         elif depends_on is not None:
-            cmd = 'bsub -w "done(%s)" < %s ' % (depends_on, script_name)
-            with os.popen(cmd) as f:
-                output = f.readline()
-                try:
-                    job_id = int(output.split(" ")[1].replace("<", "").replace(">", ""))
-                except:
-                    raise SchedulerException("Job submission failed: " + output)
-        else:
-            with os.popen("bsub <" + script_name) as f:
-                output = f.readline()
-                try:
-                    job_id = int(output.split(" ")[1].replace("<", "").replace(">", ""))
-                except:
-                    raise SchedulerException("Job submission failed: " + output)
+            command += ["-w", f"done({depends_on})"]
+        # Never retry a submission, the first attempt may have succeeded
+        output = self._run(command, check=False, retries=0, stdin_file=script_name)
+        try:
+            job_id = int(
+                output.stdout.splitlines()[0]
+                .split(" ")[1]
+                .replace("<", "")
+                .replace(">", "")
+            )
+        except (IndexError, ValueError):
+            raise SchedulerException(
+                "Job submission failed: " + output.stdout + output.stderr
+            )
         return job_id
 
+    def array_task_ids(self, job_id, array_size):
+        return [f"{job_id}[{index}]" for index in range(1, array_size + 1)]
+
     def list_current_jobs(self):
-        jobs = []
-        output = subprocess.run(
-            'bjobs -noheader -u `whoami` -o "jobid queue job_name stat"',
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True,
-        )
-        if output.returncode == 0:
-            for line in output.stdout.decode("utf-8").splitlines():
-                if line == "No unfinished job found":
-                    return jobs
-                job_info = re.sub(" +", " ", line.strip()).split(" ")
-                jobs.append(
-                    {
-                        "id": int(job_info[0]),
-                        "queue": job_info[1],
-                        "name": job_info[2],
-                        "state": job_info[3],
-                    }
-                )
+        return [job._asdict() for job in self.iter_current_jobs()]
+
+    def iter_current_jobs(self):
+        return self.iter_jobs(users=[self._get_username()])
+
+    def iter_jobs(self, users=None, states=None, queues=None, names=None, since=None):
+        if since is not None:
+            raise NotYetImplementedException(
+                "Listing jobs finished since a time is not implemented for LSF"
+            )
+        command = [
+            "bjobs",
+            "-noheader",
+            "-o",
+            "jobid queue stat user job_name delimiter='|'",
+        ]
+        # bjobs takes a single user, queue and name, any more are filtered
+        # once listed
+        if users is not None and len(users) == 1:
+            command += ["-u", users[0]]
+            users = None
         else:
-            raise SchedulerException("Error fetching job queue listing")
-        return jobs
+            command += ["-u", "all"]
+        if queues is not None and len(queues) == 1:
+            command += ["-q", queues[0]]
+            queues = None
+        if names is not None and len(names) == 1:
+            command += ["-J", names[0]]
+            names = None
+        if states:
+            flags = {self._bjobs_state_flags.get(state) for state in states}
+            if len(flags) == 1 and None not in flags:
+                command.append(flags.pop())
+            elif "-d" in flags:
+                command.append("-a")
+        with self._stream(command) as f:
+            yield from self._filter_jobs(
+                self._parse_bjobs_listing(f), users, states, queues, names
+            )
+
+    def _parse_bjobs_listing(self, f):
+        for line in f:
+            if line.startswith("No ") and line.rstrip().endswith("job found"):
+                return
+            # The name is last as it may contain the delimiter
+            job_id, queue, state, user, name = line.rstrip("\n").split("|", 4)
+            yield JobInfo(self._parse_job_id(job_id), queue, name, state, user)
 
     def get_job_details(self, job_id):
         """
         Get full job and step stats for job_id
         """
+        return self.get_jobs_details([job_id]).get(str(job_id), {})
+
+    def get_jobs_details(self, job_ids):
+        """
+        Get the details of all job_ids with a single bjobs call, falling back
+        to a single bhist call for jobs bjobs no longer reports
+        """
+        job_ids = [str(job_id) for job_id in job_ids]
+        if not job_ids:
+            return {}
+        details = {}
+        output = self._run(
+            ["bjobs", "-a", "-json", "-o", self._bjobs_format] + job_ids, check=False
+        )
+        try:
+            records = _json_records(output.stdout)
+        except SchedulerException:
+            records = []
+        for record in records:
+            # Jobs bjobs does not know about are reported with an error
+            if "error" not in record:
+                stats_dict = self._parse_bjobs(record)
+                details[stats_dict["job_id"]] = stats_dict
+        missing = [job_id for job_id in job_ids if job_id not in details]
+        if missing:
+            details.update(self._bhist_details(missing))
+        return {job_id: details[job_id] for job_id in job_ids if job_id in details}
+
+    def _parse_bjobs(self, record):
+        """
+        Details of a job from its bjobs -json record
+        """
+
+        def value(field):
+            return "-" if record.get(field, "") == "" else str(record[field])
+
         stats_dict = {}
-        with os.popen(
-            "bjobs -o \"jobid run_time cpu_used  queue slots  stat exit_code start_time estimated_start_time finish_time delimiter='|'\" -noheader "
-            + str(job_id)
-        ) as f:
-            try:
-                line = f.readline()
-                cols = line.split("|")
-                stats_dict["job_id"] = cols[0]
-                if cols[1] != "-":
-                    stats_dict["wallclock"] = datetime.timedelta(
-                        seconds=float(cols[1].split(" ")[0])
-                    )
-                if cols[2] != "-":
-                    stats_dict["cpu"] = datetime.timedelta(seconds=float(cols[2].split(" ")[0]))
-                stats_dict["queue"] = cols[3]
-                stats_dict["status"] = cols[5]
-                stats_dict["exit_code"] = cols[6]
-                stats_dict["start"] = cols[7]
-                stats_dict["start_time"] = cols[8]
-                if stats_dict["status"] in ["DONE", "EXIT"]:
-                    stats_dict["end"] = cols[9]
-            except:
-                with os.popen("bhist -l " + str(job_id)) as f:
-                    try:
-                        output = f.readlines()
-                        for line in output:
-                            if "Done successfully" in line:
-                                stats_dict["status"] = "DONE"
-                                return stats_dict
-                            elif "Completed <exit>" in line:
-                                stats_dict["status"] = "EXIT"
-                                return stats_dict
-                            else:
-                                stats_dict["status"] = "UNKNOWN"
-                    except Exception as e:
-                        raise SchedulerException(
-                            "Error fetching job details from bjobs, check job id."
-                        )
+        stats_dict["job_id"] = value("jobid")
+        if value("run_time") != "-":
+            stats_dict["wallclock"] = datetime.timedelta(
+                seconds=float(value("run_time").split(" ")[0])
+            )
+        if value("cpu_used") != "-":
+            stats_dict["cpu"] = datetime.timedelta(
+                seconds=float(value("cpu_used").split(" ")[0])
+            )
+        stats_dict["queue"] = value("queue")
+        stats_dict["status"] = value("stat")
+        stats_dict["exit_code"] = value("exit_code")
+        stats_dict["start"] = value("start_time")
+        stats_dict["start_time"] = value("estimated_start_time")
+        if stats_dict["status"] in ["DONE", "EXIT"]:
+            stats_dict["end"] = value("finish_time")
         return stats_dict
 
-    def delete(self, job_id):
-        cmd = f"bkill {job_id}"
-        output = subprocess.run(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
+    def _bhist_details(self, job_ids):
+        """
+        Get the final status of each of job_ids from a single bhist call once
+        bjobs has forgotten them, searching bhist_event_files event log files
+        """
+        details = {}
+        output = self._run(
+            ["bhist", "-a", "-l", "-n", str(self.bhist_event_files)] + job_ids,
+            check=False,
         )
+        # Jobs are separated by a line of dashes and long lines are wrapped
+        # onto lines indented by 21 spaces
+        for block in re.split(r"\n-{10,}\n?", output.stdout):
+            text = re.sub(r"\n {21}", "", block)
+            match = re.search(r"Job <([^>]+)>", text)
+            if match is None:
+                continue
+            stats_dict = {"job_id": match.group(1), "status": "UNKNOWN"}
+            if "Done successfully" in text:
+                stats_dict["status"] = "DONE"
+                stats_dict["exit_code"] = "0"
+            elif "Completed <exit>" in text:
+                stats_dict["status"] = "EXIT"
+                exit_code = re.search(r"Exited with exit code (\d+)", text)
+                if exit_code is not None:
+                    stats_dict["exit_code"] = exit_code.group(1)
+            details[stats_dict["job_id"]] = stats_dict
+        return details
+
+    def delete(self, job_id):
+        output = self._run(["bkill", str(job_id)], check=False)
         if output.returncode != 0:
             raise SchedulerException(f"Error cancelling job {job_id}")
@@ -0,0 +1,298 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import time
+import inspect
+import logging
+import functools
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsRegistry:
+    """
+    In process record of every scheduler command run and the latency of
+    every public Scheduler method.
+
+    Hooks added with add_hook are called with a dict describing each
+    command and method call as it completes.
+    """
+
+    def __init__(self, history=1000):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._hooks = []
+        self._history_size = history
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all recorded metrics
+        """
+        with self._lock:
+            self._commands = {}
+            self._methods = {}
+            self._history = deque(maxlen=self._history_size)
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def record_command(self, command, elapsed, returncode, nbytes):
+        """
+        Record a command run, returncode is None if it timed out
+        """
+        record = {
+            "type": "command",
+            "argv": list(command),
+            "time": elapsed,
+            "returncode": returncode,
+            "bytes": nbytes,
+        }
+        with self._lock:
+            stats = self._commands.setdefault(
+                command[0],
+                {"calls": 0, "failures": 0, "time": 0.0, "max time": 0.0, "bytes": 0},
+            )
+            stats["calls"] += 1
+            stats["failures"] += returncode != 0
+            stats["time"] += elapsed
+            stats["max time"] = max(stats["max time"], elapsed)
+            stats["bytes"] += nbytes
+            self._history.append(record)
+        # Charge the command to every method running in this thread
+        for frame in getattr(self._local, "frames", []):
+            frame["command time"] += elapsed
+        self._call_hooks(record)
+
+    def record_method(self, scheduler, method_name, elapsed, command_time):
+        """
+        Record a method call, parse time is the time not spent waiting on
+        commands run from the same thread
+        """
+        record = {
+            "type": "method",
+            "scheduler": scheduler,
+            "method": method_name,
+            "time": elapsed,
+            "command time": command_time,
+            "parse time": max(elapsed - command_time, 0.0),
+        }
+        with self._lock:
+            stats = self._methods.setdefault(
+                (scheduler, method_name),
+                {
+                    "calls": 0,
+                    "time": 0.0,
+                    "max time": 0.0,
+                    "command time": 0.0,
+                    "parse time": 0.0,
+                },
+            )
+            stats["calls"] += 1
+            stats["time"] += elapsed
+            stats["max time"] = max(stats["max time"], elapsed)
+            stats["command time"] += command_time
+            stats["parse time"] += record["parse time"]
+        self._call_hooks(record)
+
+    def _call_hooks(self, record):
+        for hook in list(self._hooks):
+            try:
+                hook(record)
+            except Exception as e:
+                logger.debug(f"Metrics hook {hook} failed: {e}")
+
+    def commands(self):
+        """
+        Statistics of each command keyed by command name
+        """
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._commands.items()}
+
+    def methods(self):
+        """
+        Statistics of each method keyed by (scheduler class, method name)
+        """
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._methods.items()}
+
+    def history(self):
+        """
+        The most recent command records, oldest first
+        """
+        with self._lock:
+            return list(self._history)
+
+    def report(self):
+        """
+        Human readable breakdown of method and command times
+        """
+        lines = [
+            f"{'Method':<40}{'Calls':>8}{'Total (s)':>12}"
+            f"{'Commands (s)':>14}{'Parse (s)':>12}"
+        ]
+        for (scheduler, method_name), stats in sorted(
+            self.methods().items(), key=lambda item: -item[1]["time"]
+        ):
+            lines.append(
+                f"{scheduler + '.' + method_name:<40}{stats['calls']:>8}"
+                f"{stats['time']:>12.3f}{stats['command time']:>14.3f}"
+                f"{stats['parse time']:>12.3f}"
+            )
+        lines.append("")
+        lines.append(
+            f"{'Command':<40}{'Calls':>8}{'Total (s)':>12}"
+            f"{'Max (s)':>14}{'Failures':>12}{'Bytes':>12}"
+        )
+        for name, stats in sorted(
+            self.commands().items(), key=lambda item: -item[1]["time"]
+        ):
+            lines.append(
+                f"{name:<40}{stats['calls']:>8}{stats['time']:>12.3f}"
+                f"{stats['max time']:>14.3f}{stats['failures']:>12}"
+                f"{stats['bytes']:>12}"
+            )
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        samples = {
+            "mycluster_command_calls_total": ("counter", "Scheduler commands run"),
+            "mycluster_command_failures_total": (
+                "counter",
+                "Scheduler commands that failed or timed out",
+            ),
+            "mycluster_command_seconds_total": (
+                "counter",
+                "Time spent running scheduler commands",
+            ),
+            "mycluster_command_output_bytes_total": (
+                "counter",
+                "Output read from scheduler commands",
+            ),
+            "mycluster_method_calls_total": ("counter", "Scheduler method calls"),
+            "mycluster_method_seconds_total": (
+                "counter",
+                "Time spent in scheduler methods",
+            ),
+            "mycluster_method_parse_seconds_total": (
+                "counter",
+                "Time spent in scheduler methods outside of commands",
+            ),
+        }
+        values = {name: [] for name in samples}
+        for name, stats in sorted(self.commands().items()):
+            labels = f'command="{_escape(name)}"'
+            values["mycluster_command_calls_total"].append((labels, stats["calls"]))
+            values["mycluster_command_failures_total"].append(
+                (labels, stats["failures"])
+            )
+            values["mycluster_command_seconds_total"].append((labels, stats["time"]))
+            values["mycluster_command_output_bytes_total"].append(
+                (labels, stats["bytes"])
+            )
+        for (scheduler, method_name), stats in sorted(self.methods().items()):
+            labels = f'scheduler="{_escape(scheduler)}",method="{_escape(method_name)}"'
+            values["mycluster_method_calls_total"].append((labels, stats["calls"]))
+            values["mycluster_method_seconds_total"].append((labels, stats["time"]))
+            values["mycluster_method_parse_seconds_total"].append(
+                (labels, stats["parse time"])
+            )
+        lines = []
+        for name, (metric_type, help_text) in samples.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in values[name]:
+                lines.append(f"{name}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _push_frame(self):
+        frame = {"command time": 0.0}
+        if not hasattr(self._local, "frames"):
+            self._local.frames = []
+        self._local.frames.append(frame)
+        return frame
+
+    def _pop_frame(self):
+        self._local.frames.pop()
+
+
+def _escape(label_value):
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def timed_method(method_name, func):
+    """
+    Wrap the Scheduler method func so each call is recorded in the instances
+    metrics registry
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        registry = self.metrics
+        frame = registry._push_frame()
+        start = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            registry._pop_frame()
+            registry.record_method(
+                type(self).__name__, method_name, elapsed, frame["command time"]
+            )
+
+    wrapper._timed = True
+    return wrapper
+
+
+def timed_methods(cls):
+    """
+    Names of the public methods of cls that should be timed, generators are
+    skipped as they return before doing any work
+    """
+    for name, member in inspect.getmembers(cls, inspect.isfunction):
+        if name.startswith("_") or getattr(member, "_timed", False):
+            continue
+        if inspect.isgeneratorfunction(inspect.unwrap(member)):
+            continue
+        yield name
+
+
+metrics = MetricsRegistry()
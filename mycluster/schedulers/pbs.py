@@ -31,20 +31,84 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-import os
 import re
+import json
 import math
-import subprocess
+import time
+import datetime
+from collections import namedtuple
 
-from .base import Scheduler
+from .base import Scheduler, JobInfo
 from mycluster.exceptions import (
     SchedulerException,
     ConfigurationException,
     NotYetImplementedException,
 )
 
+PBSNode = namedtuple(
+    "PBSNode", ["name", "ncpus", "assigned_ncpus", "memory", "vps_per_ppu"]
+)
+
+# Megabytes in each unit PBS sizes are given in
+_size_units = {"b": 1 / 1024**2, "kb": 1 / 1024, "mb": 1, "gb": 1024, "tb": 1024**2}
+
+
+def _size_mb(value):
+    """
+    Megabytes in the PBS size value, such as 191000kb
+    """
+    match = re.match(r"(\d+)([kmgt]?b)?$", str(value).strip().lower())
+    if match is None:
+        return 0
+    return int(match.group(1)) * _size_units[match.group(2) or "b"]
+
+
+class PBSNodeIndex:
+    """
+    Resources of every vnode grouped by vntype, parsed from the output of a
+    single `pbsnodes -a -F json` call
+    """
+
+    def __init__(self, output, timestamp=None):
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.vntypes = {}
+        # vntype of each queue, looked up by PBS once for each index
+        self.queue_vntypes = {}
+        try:
+            nodes = json.loads(output).get("nodes", {})
+        except ValueError:
+            raise SchedulerException("Error parsing pbsnodes output")
+        for name, attributes in nodes.items():
+            available = attributes.get("resources_available", {})
+            assigned = attributes.get("resources_assigned", {})
+            node = PBSNode(
+                name=name,
+                ncpus=int(available.get("ncpus", 0)),
+                assigned_ncpus=int(assigned.get("ncpus", 0)),
+                memory=_size_mb(available.get("mem", 0)),
+                vps_per_ppu=int(available.get("vps_per_ppu", 0)),
+            )
+            # A vnode may have several vntypes
+            for vntype in str(available.get("vntype", "")).split(","):
+                self.vntypes.setdefault(vntype.strip(), []).append(node)
+
+    def vnodes(self, vntype):
+        return self.vntypes.get(vntype, [])
+
 
 class PBS(Scheduler):
+    terminal_states = {"F", "X", "CA", "PBS_F"}
+    success_states = {"PBS_F", "X"}
+    # Seconds a PBSNodeIndex is reused before pbsnodes is queried again
+    node_index_max_age = 10
+    # Characters of qstat -F json output read at a time
+    json_read_size = 65536
+    transient_errors = [
+        "cannot connect to server",
+        "Connection refused",
+        "timed out",
+    ]
+
     def scheduler_type(self):
         return "pbs"
 
@@ -62,78 +126,57 @@ class PBS(Scheduler):
             raise SchedulerException("Error fetching queues")
         return queue_list
 
+    def node_index(self, refresh=False):
+        """
+        Return a PBSNodeIndex of the vnodes, re-reading pbsnodes if the
+        current one is older than node_index_max_age seconds. The vntype of
+        each queue is remembered for as long as the index.
+        """
+        return self._index(
+            "node_index",
+            self.node_index_max_age,
+            lambda: PBSNodeIndex(self._check_output(["pbsnodes", "-a", "-F", "json"])),
+            refresh,
+        )
+
     def _get_vnode_name(self, queue_id):
-        try:
-            output = self._check_output(["qstat", "-Qf", queue_id])
-            for line in output.splitlines():
-                if line.strip().startswith("default_chunk.vntype"):
-                    return line.split("=")[-1].strip()
-        except Exception as e:
-            raise SchedulerException("Error fetching node config")
+        # Queue vntypes are looked up once for each node index
+        vnode_names = self.node_index().queue_vntypes
+        if queue_id not in vnode_names:
+            vnode_type = None
+            try:
+                output = self._check_output(["qstat", "-Qf", queue_id])
+                for line in output.splitlines():
+                    if line.strip().startswith("default_chunk.vntype"):
+                        vnode_type = line.split("=")[-1].strip()
+            except Exception as e:
+                raise SchedulerException("Error fetching node config")
+            vnode_names[queue_id] = vnode_type
+        return vnode_names[queue_id]
+
+    def _vnodes(self, queue_id):
+        """
+        The vnodes of the vntype queue_id runs on
+        """
+        return self.node_index().vnodes(self._get_vnode_name(queue_id))
 
     def node_config(self, queue_id):
         max_threads = 1
         max_memory = 1
-        try:
-            tpn = tasks_per_node(queue_id)
-            vnode_type = vnode_type = vnode_type = self._get_vnode_name(queue_id)
-            if vnode_type is not None:
-                output = self._check_output(
-                    "pbsnodes -a -F dsv | grep {}".format(vnode_type), shell=True
-                )
-            for line in output.splitlines():
-                for item in line.split("|"):
-                    [key, value] = item.strip().split("=")
-                    if key.strip() == "resources_available.vps_per_ppu":
-                        if int(value) > max_threads:
-                            max_threads = int(value) * tpn
-                    if key.strip() == "resources_available.mem":
-                        # strip kb and convert to mb
-                        mem = float(value[:-2]) / 1024
-                        if mem > max_memory:
-                            max_memory = mem
-        except Exception as e:
-            raise SchedulerException("Error fetching node config")
-        return {"max thread": max_threads, "max memory": max_memory}
+        tpn = self.tasks_per_node(queue_id)
+        for node in self._vnodes(queue_id):
+            if node.vps_per_ppu > max_threads:
+                max_threads = node.vps_per_ppu * tpn
+            max_memory = max(max_memory, node.memory)
+        return {"max task": tpn, "max thread": max_threads, "max memory": max_memory}
 
     def tasks_per_node(self, queue_id):
-        tpn = 1
-        try:
-            vnode_type = vnode_type = self._get_vnode_name(queue_id)
-            if vnode_type is not None:
-                output = self._check_output(
-                    "pbsnodes -a -F dsv | grep {}".format(vnode_type), shell=True
-                )
-                for line in output.splitlines():
-                    for item in line.split("|"):
-                        [key, value] = item.strip().split("=")
-                        if key.strip() == "resources_available.ncpus":
-                            if int(value) > tpn:
-                                tpn = int(value)
-        except Exception as e:
-            raise SchedulerException("Error fetching node config")
-        return tpn
+        return max([1] + [node.ncpus for node in self._vnodes(queue_id)])
 
     def available_tasks(self, queue_id):
-        free_tasks = 0
-        max_tasks = 0
-        assigned_tasks = 0
-        try:
-            vnode_type = self._get_vnode_name(queue_id)
-            if vnode_type is not None:
-                output = self._check_output(
-                    "pbsnodes -a -F dsv | grep {}".format(vnode_type), shell=True
-                )
-            for line in output.splitlines():
-                for item in line.split("|"):
-                    [key, value] = item.strip().split("=")
-                    if key.strip() == "resources_available.ncpus":
-                        max_tasks += int(value)
-                    elif key.strip() == "resources_assigned.ncpus":
-                        assigned_tasks += int(value)
-            free_tasks = max_tasks - assigned_tasks
-        except Exception as e:
-            raise SchedulerException("Error fetching node config")
+        nodes = self._vnodes(queue_id)
+        max_tasks = sum(node.ncpus for node in nodes)
+        free_tasks = max_tasks - sum(node.assigned_ncpus for node in nodes)
         return {"available": free_tasks, "max tasks": max_tasks}
 
     def _min_tasks_per_node(self, queue_id):
@@ -154,7 +197,10 @@ class PBS(Scheduler):
         qos=None,
         exclusive=True,
         output_name=None,
-        gres=None
+        gres=None,
+        array_size=None,
+        array_limit=None,
+        array_params=None,
     ):
         queue_name = queue_id
         if tasks_per_node is None:
@@ -164,15 +210,13 @@ class PBS(Scheduler):
         if threads_per_task is None:
             threads_per_task = 1
 
-        if "mycluster-" in my_script:
-            my_script = self._get_data(my_script)
+        if "mycluster-" in job_script:
+            job_script = self._get_data(job_script)
 
         if ":" not in wall_clock:
             wall_clock = wall_clock + ":00:00"
 
-        num_nodes = int(math.ceil(float(num_tasks) / float(tasks_per_node)))
-
-        num_queue_slots = num_nodes * queue_tpn
+        num_queue_slots = num_nodes * self.tasks_per_node(queue_id)
 
         if not exclusive:
             if num_nodes == 1:  # Assumes fill up rule
@@ -183,7 +227,9 @@ class PBS(Scheduler):
         if output_name is None:
             output_name = job_name + ".out"
 
-        template = self._load_template("pbs.jinja")
+        array_size, array_params = self._array_args(array_size, array_params)
+
+        template = self._load_template(self._get_template_name())
 
         script_str = template.render(
             my_name=job_name,
@@ -200,6 +246,9 @@ class PBS(Scheduler):
             wall_clock=wall_clock,
             openmpi_args=openmpi_args,
             qos=qos,
+            array_size=array_size,
+            array_limit=array_limit,
+            array_params=array_params,
         )
 
         return script_str
@@ -209,90 +258,192 @@ class PBS(Scheduler):
     ):
         job_id = None
         if not immediate:
+            command = ["qsub"]
             if depends_on and depends_on_always_run:
-                with os.popen(
-                    "qsub -W depend=afterany:%s %s" % (depends_on, script_name)
-                ) as f:
-                    output = f.readline()
-                    try:
-                        job_id = output.strip().split(".")[0]
-                    except:
-                        raise SchedulerException("Job submission failed: " + output)
+                command += ["-W", f"depend=afterany:{depends_on}"]
             elif depends_on is not None:
-                with os.popen(
-                    "qsub -W depend=afterok:%s %s" % (depends_on, script_name)
-                ) as f:
-                    output = f.readline()
-                    try:
-                        job_id = output.strip().split(".")[0]
-                    except:
-                        raise SchedulerException("Job submission failed: " + output)
-            else:
-                with os.popen("qsub " + script_name) as f:
-                    output = f.readline()
-                    try:
-                        job_id = output.strip().split(".")[0]
-                    except:
-                        raise SchedulerException("Job submission failed: " + output)
+                command += ["-W", f"depend=afterok:{depends_on}"]
+            command.append(script_name)
+            # Never retry a submission, the first attempt may have succeeded
+            output = self._run(command, check=False, retries=0)
+            if output.returncode != 0 or not output.stdout.strip():
+                raise SchedulerException(
+                    "Job submission failed: " + output.stdout + output.stderr
+                )
+            job_id = output.stdout.splitlines()[0].strip().split(".")[0]
         else:
             raise NotYetImplementedException("Immediate not yet implemented for PBS")
         return job_id
 
+    def array_task_ids(self, job_id, array_size):
+        job_id = str(job_id).replace("[]", "")
+        if array_size == 1:
+            # Submitted as a single job
+            return [job_id]
+        return [f"{job_id}[{index}]" for index in range(array_size)]
+
     def list_current_jobs(self):
-        raise NotYetImplementedException(
-            "list_current_jobs not yet implemented for PBS"
+        return [job._asdict() for job in self.iter_current_jobs()]
+
+    def iter_current_jobs(self):
+        return self.iter_jobs(users=[self._get_username()])
+
+    def iter_jobs(self, users=None, states=None, queues=None, names=None, since=None):
+        command = ["qstat", "-f", "-F", "json"]
+        if since is not None:
+            # Finished jobs are only listed while PBS keeps their history
+            command.append("-x")
+            since = self._parse_since(since)
+        if users:
+            command += ["-u", ",".join(users)]
+        jobs = (
+            JobInfo(
+                self._parse_job_id(job_id.split(".")[0]),
+                attributes.get("queue"),
+                attributes.get("Job_Name"),
+                attributes.get("job_state"),
+                attributes.get("Job_Owner", "").split("@")[0],
+            )
+            for job_id, attributes in self._iter_qstat_json(command)
+            if since is None
+            or attributes.get("job_state") not in ("F", "X")
+            or self._parse_time(attributes.get("obittime")) >= since
+        )
+        # qstat only selects jobs by user, and the owner is checked again as
+        # not every version applies -u to full listings
+        yield from self._filter_jobs(
+            jobs, users=users, states=states, queues=queues, names=names
         )
 
+    def _parse_since(self, since):
+        if hasattr(since, "strftime"):
+            return since
+        try:
+            return datetime.datetime.fromisoformat(since)
+        except ValueError:
+            raise SchedulerException(
+                f"Invalid time {since}, expected YYYY-MM-DDTHH:MM:SS"
+            )
+
+    def _parse_time(self, value):
+        """
+        datetime of a qstat time such as Thu Jan  1 00:00:00 2026, the
+        earliest possible time if value is missing or malformed
+        """
+        try:
+            return datetime.datetime.strptime(value, "%a %b %d %H:%M:%S %Y")
+        except (TypeError, ValueError):
+            return datetime.datetime.min
+
+    def _iter_qstat_json(self, command):
+        """
+        Generate the job ID and attributes of every job in the qstat -F json
+        output of command, decoding each job as soon as it has been read.
+        Raises a SchedulerException once the output has been read if qstat
+        failed.
+        """
+        # PBS does not always escape control characters in job attributes
+        decoder = json.JSONDecoder(strict=False)
+        with self._stream(command) as f:
+            buffer = ""
+
+            def read_more():
+                nonlocal buffer
+                chunk = f.read(self.json_read_size)
+                buffer += chunk
+                return bool(chunk)
+
+            def decode(pos):
+                while True:
+                    try:
+                        return decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError as e:
+                        if not read_more():
+                            raise SchedulerException(f"Error parsing qstat output: {e}")
+
+            def next_char(pos, skip=" \t\r\n"):
+                while True:
+                    while pos < len(buffer) and buffer[pos] in skip:
+                        pos += 1
+                    if pos < len(buffer):
+                        return pos
+                    if not read_more():
+                        raise SchedulerException("Truncated qstat output")
+
+            # Jobs are the values of the "Jobs" object, which is missing
+            # when no jobs match
+            while '"Jobs"' not in buffer:
+                if not read_more():
+                    return
+            pos = next_char(buffer.index('"Jobs"') + len('"Jobs"'), " \t\r\n:")
+            pos = next_char(pos + 1)
+            while buffer[pos] != "}":
+                job_id, pos = decode(pos)
+                attributes, pos = decode(next_char(pos, " \t\r\n:"))
+                yield job_id, attributes
+                pos = next_char(pos, " \t\r\n,")
+                if pos > self.json_read_size:
+                    # Drop what has been decoded
+                    buffer = buffer[pos:]
+                    pos = 0
+            # Read to the end so the exit status is recorded
+            while read_more():
+                buffer = ""
+
     def get_job_details(self, job_id):
         """
         Get full job and step stats for job_id
         """
-        stats_dict = {}
-        with os.popen("qstat -xf " + str(job_id)) as f:
-            try:
-                line = f.readline().strip()
-                while line:
-                    if line.startswith("Job Id:"):
-                        stats_dict["job_id"] = line.split(":")[1].split(".")[0].strip()
-                    elif line.startswith("resources_used.walltime"):
-                        stats_dict["wallclock"] = get_timedelta(line.split("=")[1])
-                    elif line.startswith("resources_used.cput"):
-                        stats_dict["cpu"] = get_timedelta(line.split("=")[1])
-                    elif line.startswith("queue"):
-                        stats_dict["queue"] = line.split("=")[1].strip()
-                    elif line.startswith("job_state"):
-                        stats_dict["status"] = line.split("=")[1].strip()
-                    elif line.startswith("Exit_status"):
-                        stats_dict["exit_code"] = line.split("=")[1].strip()
-                    elif line.startswith("Exit_status"):
-                        stats_dict["exit_code"] = line.split("=")[1].strip()
-                    elif line.startswith("stime"):
-                        stats_dict["start"] = line.split("=")[1].strip()
-                    line = f.readline().strip()
-                if stats_dict["status"] == "F" and "exit_code" not in stats_dict:
-                    stats_dict["status"] = "CA"
-                elif stats_dict["status"] == "F" and stats_dict["exit_code"] == "0":
-                    stats_dict["status"] = "PBS_F"
-            except Exception as e:
-                with os.popen("qstat -xaw " + str(job_id)) as f:
-                    try:
-                        output = f.readlines()
-                        for line in output:
-                            if str(job_id) in line:
-                                cols = line.split()
-                                stats_dict["job_id"] = cols[0].split(".")[0]
-                                stats_dict["queue"] = cols[2]
-                                stats_dict["status"] = cols[9]
-                                stats_dict["wallclock"] = get_timedelta(cols[10])
-                                return stats_dict
-                    except Exception as e:
-                        stats_dict["status"] = "UNKNOWN"
+        return self.get_jobs_details([job_id]).get(str(job_id), {})
+
+    def get_jobs_details(self, job_ids):
+        """
+        Get the details of all job_ids with a single qstat call
+        """
+        job_ids = [str(job_id) for job_id in job_ids]
+        if not job_ids:
+            return {}
+        details = {}
+        try:
+            for job_id, attributes in self._iter_qstat_json(
+                ["qstat", "-x", "-f", "-F", "json"] + job_ids
+            ):
+                stats_dict = self._job_details(job_id, attributes)
+                details[stats_dict["job_id"]] = stats_dict
+        except SchedulerException as e:
+            # qstat fails if any job is unknown, but still lists the others
+            if "Unknown Job Id" not in str(e):
+                raise
+        return {
+            job_id: details[job_id.split(".")[0]]
+            for job_id in job_ids
+            if job_id.split(".")[0] in details
+        }
+
+    def _job_details(self, job_id, attributes):
+        """
+        Details of a job from its qstat -F json attributes
+        """
+        stats_dict = {"job_id": job_id.split(".")[0]}
+        resources_used = attributes.get("resources_used", {})
+        if "walltime" in resources_used:
+            stats_dict["wallclock"] = self._get_timedelta(resources_used["walltime"])
+        if "cput" in resources_used:
+            stats_dict["cpu"] = self._get_timedelta(resources_used["cput"])
+        if "queue" in attributes:
+            stats_dict["queue"] = attributes["queue"]
+        stats_dict["status"] = attributes.get("job_state", "UNKNOWN")
+        if "Exit_status" in attributes:
+            stats_dict["exit_code"] = str(attributes["Exit_status"])
+        if "stime" in attributes:
+            stats_dict["start"] = attributes["stime"]
+        if stats_dict["status"] == "F" and "exit_code" not in stats_dict:
+            stats_dict["status"] = "CA"
+        elif stats_dict["status"] == "F" and stats_dict["exit_code"] == "0":
+            stats_dict["status"] = "PBS_F"
         return stats_dict
 
     def delete(self, job_id):
-        cmd = f"qdel {job_id}"
-        output = subprocess.run(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-        )
+        output = self._run(["qdel", str(job_id)], check=False)
         if output.returncode != 0:
             raise SchedulerException(f"Error cancelling job {job_id}")
@@ -34,14 +34,88 @@
 import os
 import re
 import math
-import subprocess
+import time
 import datetime
-
-from .base import Scheduler
+import sqlite3
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from .base import Scheduler, JobInfo
+from .accounting import SGEAccountingFile
 from mycluster.exceptions import SchedulerException, ConfigurationException
 
+logger = logging.getLogger(__name__)
+
+
+class SGEHostIndex:
+    """
+    Hardware of every execution host and the slots each queue has on it,
+    parsed from the output of a single `qhost -q -xml` call
+    """
+
+    def __init__(self, output, timestamp=None):
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.hosts = {}
+        self.queues = {}
+        # Hosts of each host group, resolved by SGE once for each index
+        self.host_groups = {}
+        for host in ElementTree.fromstring(output).iter("host"):
+            name = host.get("name")
+            if name == "global":
+                continue
+            self.hosts[name] = {
+                value.get("name"): value.text for value in host.iter("hostvalue")
+            }
+            for queue in host.iter("queue"):
+                slots = {
+                    value.get("name"): value.text for value in queue.iter("queuevalue")
+                }.get("slots")
+                self.queues.setdefault(queue.get("name"), {})[name] = int(slots or 0)
+
+    def node_config(self, host_names):
+        """
+        Hardware of the first host in host_names that is up
+        """
+        for name in host_names:
+            values = self.hosts.get(name, {})
+            if values.get("load_avg", "-") == "-":
+                continue
+            # SGE <= 6.2u4 does not report cores and threads
+            cores = values.get("m_core", "-")
+            threads = values.get("m_thread", "-")
+            return {
+                "max task": int(values["num_proc"] if cores == "-" else cores),
+                "max thread": int(values["num_proc"] if threads == "-" else threads),
+                "max memory": values.get("mem_total"),
+            }
+        return {"max task": 0, "max thread": 0, "max memory": 0}
+
+    def queue_slots(self, queue_name):
+        """
+        Slots of queue_name on the first of its hosts, 0 if it has none
+        """
+        return next(iter(self.queues.get(queue_name, {}).values()), 0)
+
 
 class SGE(Scheduler):
+    terminal_states = {"DONE", "FAILED"}
+    success_states = {"DONE"}
+    # qstat -s letter selecting each group of job state codes
+    _qstat_state_letters = {"p": set("q"), "r": set("rt"), "s": set("sST")}
+    # Seconds an SGEHostIndex is reused before qhost is queried again
+    host_index_max_age = 300
+    # The queues and free slots are those of the user, qstat -U
+    user_specific_methods = {"queues", "available_tasks"}
+    _accounting = None
+    transient_errors = [
+        "unable to contact qmaster",
+        "failed receiving gdi request",
+        "commlib error",
+        "unable to send message to qmaster",
+    ]
+
     def scheduler_type(self):
         return "sge"
 
@@ -49,152 +123,145 @@ class SGE(Scheduler):
         return os.getenv("SGE_CLUSTER_NAME")
 
     def queues(self):
-        # list all parallel env
-        # for parallel_env list queues associated
-        # Find first node with queue and record node config
+        # Every parallel environment and queue is listed once, the queues
+        # offering each parallel environment are read from the queue
+        # configurations and the queues the user may use from one summary
+        parallel_env_list = [
+            line.strip() for line in self._qcommand(["qconf", "-spl"]) if line.strip()
+        ]
+        queue_names = [
+            line.strip() for line in self._qcommand(["qconf", "-sql"]) if line.strip()
+        ]
+        # Skip the header and separator
+        permitted = {line.split(" ")[0].strip() for line in self._qstat_g_c([])[2:]}
+        queue_pes = self._queue_parallel_envs(
+            [queue_name for queue_name in queue_names if queue_name in permitted]
+        )
         queue_list = []
-        parallel_env_list = []
-        with os.popen("qconf -spl") as f:
-            for line in f:
-                parallel_env_list.append(line.strip())
         for parallel_env in parallel_env_list:
-            with os.popen("qstat -pe " + parallel_env + " -U `whoami` -g c") as f:
-                f.readline()  # read header
-                f.readline()  # read separator
-                for line in f:
-                    queue_name = line.split(" ")[0].strip()
-                    # Check if user has permission to use queue
-                    with os.popen("qstat -g c -U `whoami` -q " + queue_name) as f2:
-                        try:
-                            f2.readline()
-                            f2.readline()
-                            if len(f2.readline()):
-                                queue_list.append(parallel_env + ":" + queue_name)
-                        except:
-                            pass
+            for queue_name in queue_names:
+                if parallel_env in queue_pes.get(queue_name, ()):
+                    queue_list.append(parallel_env + ":" + queue_name)
         return queue_list
 
+    def _queue_parallel_envs(self, queue_names):
+        """
+        The parallel environments of each queue in queue_names, read with a
+        single qconf call. Queues missing from its output are read one at a
+        time in parallel.
+        """
+        if not queue_names:
+            return {}
+        queue_pes = self._parse_pe_lists(
+            self._qcommand(["qconf", "-sq", ",".join(queue_names)])
+        )
+        missing = [
+            queue_name for queue_name in queue_names if queue_name not in queue_pes
+        ]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(len(missing), 8)) as pool:
+                for lines in pool.map(
+                    lambda queue_name: self._qcommand(["qconf", "-sq", queue_name]),
+                    missing,
+                ):
+                    queue_pes.update(self._parse_pe_lists(lines))
+        return queue_pes
+
+    def _parse_pe_lists(self, lines):
+        """
+        The pe_list of every queue configuration in the qconf -sq output
+        lines, including host specific values such as [@hosts=mpi]
+        """
+        queue_pes = {}
+        queue_name = None
+        attribute = None
+        for line in lines:
+            if not line.strip():
+                continue
+            if not line[0].isspace():
+                attribute, _, line = line.partition(" ")
+            if attribute == "qname":
+                queue_name = line.strip()
+                queue_pes[queue_name] = set()
+            elif attribute == "pe_list" and queue_name is not None:
+                for value in re.split(r"[\s,\[\]\\]+", line):
+                    value = value.split("=")[-1]
+                    if value and value != "NONE":
+                        queue_pes[queue_name].add(value)
+        return queue_pes
+
+    def _qcommand(self, command):
+        """
+        Output lines of an SGE command, empty if it fails
+        """
+        return self._run(command, check=False).stdout.splitlines()
+
+    def _qstat_g_c(self, args):
+        """
+        Output lines of the cluster queue summary for the current user
+        """
+        return self._qcommand(["qstat", "-g", "c", "-U", self._get_username()] + args)
+
+    def host_index(self, refresh=False):
+        """
+        Return an SGEHostIndex of the execution hosts, re-reading qhost if
+        the current one is older than host_index_max_age seconds. Host
+        group membership is remembered for as long as the index.
+        """
+        return self._index(
+            "host_index",
+            self.host_index_max_age,
+            lambda: SGEHostIndex(self._check_output(["qhost", "-q", "-xml"])),
+            refresh,
+        )
+
+    def _queue_hosts(self, queue_name):
+        """
+        Names of the hosts in the hostlist of queue_name, host groups are
+        resolved
+        """
+        host_list = []
+        for line in self._qcommand(["qconf", "-sq", queue_name]):
+            if line.split(" ")[0] == "hostlist":
+                host_list = line.split()[1:]
+        # Host groups are resolved once for each host index
+        host_groups = self.host_index().host_groups
+        hosts = []
+        for host in host_list:
+            if host.startswith("@"):
+                if host not in host_groups:
+                    host_groups[host] = [
+                        name
+                        for line in self._qcommand(["qconf", "-shgrp_resolved", host])
+                        for name in line.split()
+                    ]
+                hosts += host_groups[host]
+            elif host != "NONE":
+                hosts.append(host)
+        return hosts
+
     def node_config(self, queue_id):
-        # Find first node with queue and record node config
-        parallel_env = queue_id.split(":")[0]
+        # Record node config of the first available node with queue
         queue_name = queue_id.split(":")[1]
-        host_group = 0
-        with os.popen("qconf -sq " + queue_name) as f:
-            for line in f:
-                if line.split(" ")[0] == "hostlist":
-                    new_line = re.sub(" +", " ", line)
-                    host_group = new_line.split(" ")[1]
-
-        config = {}
-        host_name = ""
-        found = False
-        if host_group[0] is "@":
-            # Is a host group
-            with os.popen("qconf -shgrp_resolved " + host_group) as f:
-                for line in f:
-                    for host_name in line.split(" "):
-                        with os.popen("qhost -q -h " + host_name) as f:
-                            header = f.readline()  # read header
-                            f.readline()  # read separator
-                            new_header = re.sub(" +", " ", header).strip()
-                            # sge <=6.2u4 style
-                            if (new_header.split(" ")[3]) == "LOAD":
-                                for line in f:
-                                    if line[0] != " ":
-                                        name = line.split(" ")[0]
-                                        if name != "global":
-                                            new_line = re.sub(" +", " ", line).strip()
-                                            if new_line.split(" ")[3] != "-":
-                                                config["max task"] = int(
-                                                    new_line.split(" ")[2]
-                                                )
-                                                config["max thread"] = int(
-                                                    new_line.split(" ")[2]
-                                                )
-                                                config["max memory"] = new_line.split(
-                                                    " "
-                                                )[4]
-                                                found = True
-                                                break
-                            else:
-                                for line in f:
-                                    if line[0] != " ":
-                                        name = line.split(" ")[0]
-                                        if name != "global":
-                                            new_line = re.sub(" +", " ", line).strip()
-                                            if new_line.split(" ")[3] != "-":
-                                                config["max task"] = int(
-                                                    new_line.split(" ")[4]
-                                                )
-                                                config["max thread"] = int(
-                                                    new_line.split(" ")[5]
-                                                )
-                                                config["max memory"] = new_line.split(
-                                                    " "
-                                                )[7]
-                                                found = True
-                                                break
-                        if found:
-                            break
-        else:
-            # Is a host
-            host_name = host_group
-            with os.popen("qhost -q -h " + host_name) as f:
-                header = f.readline()  # read header
-                f.readline()  # read separator
-                new_header = re.sub(" +", " ", header).strip()
-                if (new_header.split(" ")[3]) == "LOAD":  # sge <=6.2u4 style
-                    for line in f:
-                        if line[0] != " ":
-                            name = line.split(" ")[0]
-                            if name != "global":
-                                new_line = re.sub(" +", " ", line).strip()
-                                if new_line.split(" ")[3] != "-":
-                                    config["max task"] = int(new_line.split(" ")[2])
-                                    config["max thread"] = int(new_line.split(" ")[2])
-                                    config["max memory"] = new_line.split(" ")[4]
-                                else:
-                                    config["max task"] = 0
-                                    config["max thread"] = 0
-                                    config["max memory"] = 0
-                else:
-                    for line in f:
-                        if line[0] != " ":
-                            name = line.split(" ")[0]
-                            if name != "global":
-                                new_line = re.sub(" +", " ", line).strip()
-                                if new_line.split(" ")[3] != "-":
-                                    config["max task"] = int(new_line.split(" ")[4])
-                                    config["max thread"] = int(new_line.split(" ")[5])
-                                    config["max memory"] = new_line.split(" ")[7]
-                                else:
-                                    config["max task"] = 0
-                                    config["max thread"] = 0
-                                    config["max memory"] = 0
-        return config
+        return self.host_index().node_config(self._queue_hosts(queue_name))
 
     def tasks_per_node(self, queue_id):
         parallel_env = queue_id.split(":")[0]
         queue_name = queue_id.split(":")[1]
-        tasks = 0
-        with os.popen("qconf -sq " + queue_name) as f:
-            for line in f:
-                if line.split(" ")[0] == "slots":
-                    tasks = int(re.split("\W+", line)[1])
+        tasks = self.host_index().queue_slots(queue_name)
 
         pe_tasks = tasks
-        with os.popen("qconf -sp " + parallel_env) as f:
-            try:
-                for line in f:
-                    if line.split(" ")[0] == "allocation_rule":
-                        try:
-                            # This may throw exception as allocation rule
-                            # may not always be an integer
-                            pe_tasks = int(re.split("\W+", line)[1])
-                        except ValueError as e:
-                            raise SchedulerException("Error parsing SGE output")
-            except:
-                pass
+        try:
+            for line in self._qcommand(["qconf", "-sp", parallel_env]):
+                if line.split(" ")[0] == "allocation_rule":
+                    try:
+                        # This may throw exception as allocation rule
+                        # may not always be an integer
+                        pe_tasks = int(re.split("\W+", line)[1])
+                    except ValueError as e:
+                        raise SchedulerException("Error parsing SGE output")
+        except:
+            pass
 
         return min(tasks, pe_tasks)
 
@@ -205,16 +272,14 @@ class SGE(Scheduler):
         max_tasks = 0
         parallel_env = queue_id.split(":")[0]
         queue_name = queue_id.split(":")[1]
-        with os.popen(" qstat -pe " + parallel_env + " -U `whoami` -g c") as f:
-            f.readline()  # read header
-            f.readline()  # read separator
-            for line in f:
-                # remove multiple white space
-                new_line = re.sub(" +", " ", line)
-                qn = new_line.split(" ")[0]
-                if qn == queue_name:
-                    free_tasks = int(new_line.split(" ")[4])
-                    max_tasks = int(new_line.split(" ")[5])
+        # Skip the header and separator
+        for line in self._qstat_g_c(["-pe", parallel_env])[2:]:
+            # remove multiple white space
+            new_line = re.sub(" +", " ", line)
+            qn = new_line.split(" ")[0]
+            if qn == queue_name:
+                free_tasks = int(new_line.split(" ")[4])
+                max_tasks = int(new_line.split(" ")[5])
 
         return {"available": free_tasks, "max tasks": max_tasks}
 
@@ -228,15 +293,14 @@ class SGE(Scheduler):
         queue_name = queue_id.split(":")[1]
         tasks = 1
         pe_tasks = tasks
-        with os.popen("qconf -sp " + parallel_env) as f:
-            try:
-                for line in f:
-                    if line.split(" ")[0] == "allocation_rule":
-                        # This may throw exception as allocation rule
-                        # may not always be an integer
-                        pe_tasks = int(re.split("\W+", line)[1])
-            except:
-                pass
+        try:
+            for line in self._qcommand(["qconf", "-sp", parallel_env]):
+                if line.split(" ")[0] == "allocation_rule":
+                    # This may throw exception as allocation rule
+                    # may not always be an integer
+                    pe_tasks = int(re.split("\W+", line)[1])
+        except:
+            pass
 
         return max(tasks, pe_tasks)
 
@@ -255,7 +319,10 @@ class SGE(Scheduler):
         qos=None,
         exclusive=True,
         output_name=None,
-        gres=None
+        gres=None,
+        array_size=None,
+        array_limit=None,
+        array_params=None,
     ):
         parallel_env = queue_id.split(":")[0]
         queue_name = queue_id.split(":")[1]
@@ -286,7 +353,9 @@ class SGE(Scheduler):
                     tasks_per_node, self._min_tasks_per_node(queue_id)
                 )
 
-        template = self._load_template("sge.jinja")
+        array_size, array_params = self._array_args(array_size, array_params)
+
+        template = self._load_template(self._get_template_name())
 
         script_str = template.render(
             my_name=job_name,
@@ -305,6 +374,9 @@ class SGE(Scheduler):
             openmpi_args=openmpi_args,
             qos=qos,
             exclusive=exclusive,
+            array_size=array_size,
+            array_limit=array_limit,
+            array_params=array_params,
         )
 
         return script_str
@@ -314,77 +386,224 @@ class SGE(Scheduler):
     ):
         job_id = None
 
-        output = subprocess.run(
-            f"qsub -V -terse {script_name}",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True,
+        # Never retry a submission, the first attempt may have succeeded
+        output = self._run(
+            ["qsub", "-V", "-terse", script_name], check=False, retries=0
         )
         if output.returncode == 0:
             job_id = 0
-            out = output.stdout.decode("utf-8")
+            out = output.stdout
             try:
-                job_id = int(out.readline().strip())
+                # Array jobs are reported as job_id.first-last:step
+                job_id = int(out.splitlines()[0].strip().split(".")[0])
                 return job_id
             except:
                 raise SchedulerException("Error submitting job to SGE")
         else:
-            raise SchedulerException(
-                f"Error submitting job to SGE: {output.stderr.decode('utf-8')}"
-            )
+            raise SchedulerException(f"Error submitting job to SGE: {output.stderr}")
+
+    def array_task_ids(self, job_id, array_size):
+        return [f"{job_id}.{index}" for index in range(1, array_size + 1)]
 
     def list_current_jobs(self):
-        jobs = []
-        output = subprocess.run(
-            "qstat -u `whoami`",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True,
-        )
-        if output.returncode == 0:
-            for line in output.stdout.decode("utf-8").splitlines():
-                if line.startswith("job-ID") or line.startswith("---"):
+        return [job._asdict() for job in self.iter_current_jobs()]
+
+    def iter_current_jobs(self):
+        return self.iter_jobs(users=[self._get_username()])
+
+    def iter_jobs(self, users=None, states=None, queues=None, names=None, since=None):
+        jobs = self._iter_qstat_jobs(users, states, queues)
+        if since is not None:
+            jobs = itertools.chain(jobs, self._iter_qacct_jobs(users, queues, since))
+        # qstat cannot select jobs by name and only selects by groups of
+        # states, so both are filtered once listed
+        yield from self._filter_jobs(jobs, states=states, names=names)
+
+    def _iter_qstat_jobs(self, users, states, queues):
+        command = ["qstat", "-xml", "-u", ",".join(users) if users else "*"]
+        if states:
+            # qstat selects pending, running and suspended jobs by letter
+            letters = {
+                letter
+                for state in states
+                for letter, codes in self._qstat_state_letters.items()
+                if set(state) & codes
+            }
+            if letters:
+                command += ["-s", "".join(sorted(letters))]
+        if queues:
+            command += ["-q", ",".join(queues)]
+        # The XML listing is parsed as it is read, one job_list at a time
+        with self._stream(command) as f:
+            for event, element in ElementTree.iterparse(f):
+                if element.tag == "job_list":
+                    yield JobInfo(
+                        self._parse_job_id(element.findtext("JB_job_number")),
+                        element.findtext("queue_name", ""),
+                        element.findtext("JB_name"),
+                        element.findtext("state"),
+                        element.findtext("JB_owner"),
+                    )
+                    element.clear()
+
+    def _iter_qacct_jobs(self, users, queues, since):
+        """
+        Jobs that finished since the time since from the accounting file
+        """
+        command = ["qacct", "-j", "-b", self._format_since(since, "%Y%m%d%H%M.%S")]
+        # qacct takes a single owner and queue, any more are filtered once
+        # listed
+        if users is not None and len(users) == 1:
+            command += ["-o", users[0]]
+        if queues is not None and len(queues) == 1:
+            command += ["-q", queues[0]]
+        record = {}
+        with self._stream(command, check=False) as f:
+            # Records are separated by a line of "=" characters
+            for line in itertools.chain(f, ["="]):
+                if not line.startswith("="):
+                    key, _, value = line.strip().partition(" ")
+                    record[key] = value.strip()
                     continue
-                job_info = re.sub(" +", " ", line.strip()).split(" ")
-                jobs.append(
-                    {
-                        "id": int(job_info[0]),
-                        "queue": job_info[6],
-                        "name": job_info[2],
-                        "state": job_info[4],
-                    }
-                )
-        else:
-            raise SchedulerException("Error fetching job queue listing")
-        return jobs
+                if "jobnumber" in record:
+                    failed = record.get("failed", "0").split(" ")[0] != "0"
+                    exit_code = record.get("exit_status", "0").split(" ")[0]
+                    job = JobInfo(
+                        self._parse_job_id(record["jobnumber"]),
+                        record.get("qname"),
+                        record.get("jobname"),
+                        "FAILED" if failed or exit_code != "0" else "DONE",
+                        record.get("owner"),
+                    )
+                    if (users is None or job.user in users) and (
+                        queues is None or job.queue in queues
+                    ):
+                        yield job
+                record = {}
 
     def get_job_details(self, job_id):
         """
         Get full job and step stats for job_id
-        First check using sacct, then fallback to squeue
         """
-        stats_dict = {}
-        output = {}
-        with os.popen("qacct -j " + str(job_id)) as f:
+        records = self._accounting_records([job_id])
+        if records is not None:
+            return self._parse_qacct(job_id, records.get(str(job_id), {}))
+        records = self._parse_qacct_records(
+            self._qcommand(["qacct", "-j", str(job_id)]), [str(job_id)]
+        )
+        return self._parse_qacct(job_id, records.get(str(job_id), {}))
+
+    def get_jobs_details(self, job_ids):
+        """
+        Get the details of all job_ids with a single scan of the accounting
+        records by qacct
+        """
+        job_ids = [str(job_id) for job_id in job_ids]
+        records = self._accounting_records(job_ids)
+        if records is None and len(job_ids) < 2:
+            return super().get_jobs_details(job_ids)
+        if records is None:
+            records = self._qacct_records(job_ids)
+        details = {}
+        for job_id, output in records.items():
             try:
-                f.readline()  # read header
-                for line in f:
-                    new_line = re.sub(" +", " ", line.strip())
-                    output[new_line.split(" ")[0]] = new_line.split(" ", 1)[1]
-            except:
+                details[job_id] = self._parse_qacct(job_id, output)
+            except SchedulerException:
                 pass
+        return details
+
+    def _qacct_records(self, job_ids):
+        """
+        The qacct fields of the last record of each of job_ids, from a
+        single qacct call read as it is listed
+        """
+        with self._stream(["qacct", "-j"], check=False) as f:
+            return self._parse_qacct_records(f, job_ids)
+
+    def _parse_qacct_records(self, lines, job_ids):
+        """
+        The fields of the last record of each of job_ids in the qacct output
+        lines. A rescheduled job has a record for every run, as the
+        accounting file the last one is kept.
+        """
+        wanted = set(job_ids)
+        records = {}
+        record = {}
+        # Records are separated by a line of "=" characters
+        for line in itertools.chain(lines, ["="]):
+            if line.startswith("="):
+                if record.get("jobnumber") in wanted:
+                    records[record["jobnumber"]] = record
+                record = {}
+                continue
+            new_line = re.sub(" +", " ", line.strip())
+            if " " in new_line:
+                record[new_line.split(" ")[0]] = new_line.split(" ", 1)[1]
+        return records
+
+    def _accounting_path(self):
+        """
+        Path of the accounting file, MYCLUSTER_SGE_ACCOUNTING or the cell's
+        own accounting file if it can be read, None to use qacct
+        """
+        path = os.getenv("MYCLUSTER_SGE_ACCOUNTING")
+        if path:
+            return path
+        if "SGE_ROOT" not in os.environ:
+            return None
+        path = os.path.join(
+            os.environ["SGE_ROOT"],
+            os.getenv("SGE_CELL", "default"),
+            "common",
+            "accounting",
+        )
+        return path if os.access(path, os.R_OK) else None
+
+    def _accounting_records(self, job_ids):
+        """
+        The accounting fields of each of job_ids read straight from the
+        accounting file, None if there is none or it cannot be read
+        """
+        path = self._accounting_path()
+        if not path:
+            return None
+        try:
+            if self._accounting is None or self._accounting.path != path:
+                self._accounting = SGEAccountingFile(path)
+            records = self._accounting.records(job_ids)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.debug(f"Unable to read SGE accounting file {path}: {e}")
+            return None
+        for record in records.values():
+            # qacct reports memory to 3 decimal places
+            try:
+                record["mem"] = f"{float(record['mem']):.3f}"
+            except (KeyError, ValueError):
+                pass
+        return records
+
+    def _parse_qacct(self, job_id, output):
+        """
+        Build the job details from the qacct fields of job_id
+        """
+        stats_dict = {}
+        if "ru_wallclock" not in output:
+            raise SchedulerException(f"Job {job_id} not found in SGE accounting")
+        stats_dict["job_id"] = str(job_id)
         stats_dict["wallclock"] = datetime.timedelta(
-            seconds=int(output["ru_wallclock"])
+            seconds=int(float(output["ru_wallclock"]))
         )
         stats_dict["mem"] = output["mem"]
         stats_dict["cpu"] = datetime.timedelta(seconds=int(output["cpu"].split(".")[0]))
         stats_dict["queue"] = output["granted_pe"] + ":" + output["qname"]
+        stats_dict["exit_code"] = output["exit_status"].split(" ")[0]
+        if output["failed"].split(" ")[0] == "0" and stats_dict["exit_code"] == "0":
+            stats_dict["status"] = "DONE"
+        else:
+            stats_dict["status"] = "FAILED"
         return stats_dict
 
     def delete(self, job_id):
-        cmd = f"qdel {job_id}"
-        output = subprocess.run(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-        )
+        output = self._run(["qdel", str(job_id)], check=False)
         if output.returncode != 0:
             raise SchedulerException(f"Error cancelling job {job_id}")
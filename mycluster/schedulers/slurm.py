@@ -34,82 +34,170 @@
 import os
 import re
 import math
-import subprocess
+import time
+import shlex
+import logging
+from collections import namedtuple
 
-from .base import Scheduler
+from .base import Scheduler, JobInfo
 from mycluster.exceptions import SchedulerException
 
+logger = logging.getLogger(__name__)
+
+SlurmNode = namedtuple(
+    "SlurmNode", ["name", "partition", "cpus", "memory", "state", "idle_cpus"]
+)
+
+
+class ClusterSnapshot:
+    """
+    Point in time view of every node in every partition, parsed from the
+    output of a single `sinfo -N` call using sinfo_format
+    """
+
+    # Node name, partition, CPUs, memory (MB), state, CPUs (A/I/O/T)
+    sinfo_format = "%N|%P|%c|%m|%T|%C"
+
+    def __init__(self, output, timestamp=None):
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.partitions = {}
+        for line in output.splitlines():
+            cols = line.strip().split("|")
+            if len(cols) != 6:
+                continue
+            partition = cols[1].replace("*", "")
+            node = SlurmNode(
+                name=cols[0],
+                partition=partition,
+                cpus=int(cols[2]),
+                memory=int(cols[3].rstrip("+")),
+                state=cols[4],
+                idle_cpus=int(cols[5].split("/")[1]),
+            )
+            self.partitions.setdefault(partition, []).append(node)
+
+    @classmethod
+    def from_nodes(cls, nodes, timestamp=None):
+        """
+        Build a snapshot from SlurmNodes gathered some other way
+        """
+        snapshot = cls("", timestamp)
+        for node in nodes:
+            snapshot.partitions.setdefault(node.partition, []).append(node)
+        return snapshot
+
+    def _nodes(self, queue_id):
+        if queue_id not in self.partitions:
+            raise SchedulerException("Requested partition %s has no nodes" % queue_id)
+        return self.partitions[queue_id]
+
+    def node_config(self, queue_id):
+        # Record node config of first node in queue
+        node = self._nodes(queue_id)[0]
+        return {
+            "max task": node.cpus,
+            "max thread": node.cpus,
+            "max memory": node.memory,
+        }
+
+    def tasks_per_node(self, queue_id):
+        return self._nodes(queue_id)[0].cpus
+
+    def available_tasks(self, queue_id):
+        nodes = self._nodes(queue_id)
+        free_tasks = sum(node.idle_cpus for node in nodes if "idle" in node.state)
+        max_tasks = sum(node.cpus for node in nodes)
+        return {"available": free_tasks, "max tasks": max_tasks}
+
 
 class Slurm(Scheduler):
+    terminal_states = {
+        "COMPLETED",
+        "FAILED",
+        "CANCELLED",
+        "TIMEOUT",
+        "NODE_FAIL",
+        "OUT_OF_MEMORY",
+        "PREEMPTED",
+        "BOOT_FAIL",
+        "DEADLINE",
+    }
+    success_states = {"COMPLETED"}
+    # Seconds a ClusterSnapshot is reused before sinfo is queried again
+    snapshot_max_age = 10
+    # How far back wait asks sacct for the state of the jobs, jobs outside
+    # the window are looked up on their own
+    finished_window = "now-7days"
+    # sacct output that does not describe a job
+    transient_errors = [
+        "Socket timed out",
+        "Unable to contact slurm controller",
+        "Zero Bytes were transmitted",
+        "Connection refused",
+        "Resource temporarily unavailable",
+    ]
+    _sacct_errors = [
+        "SLURM accounting storage is disabled",
+        "slurm_load_jobs error: Invalid job id specified",
+    ]
+
     def scheduler_type(self):
         return "slurm"
 
     def name(self):
-        with os.popen("sacctmgr show cluster") as f:
-            f.readline()
-            f.readline()
-            return f.readline().strip().split(" ")[0]
+        output = self._check_output(["sacctmgr", "show", "cluster"]).splitlines()
+        if len(output) < 3 or not output[2].strip():
+            raise SchedulerException("Unable to read the cluster name from sacctmgr")
+        return output[2].strip().split(" ")[0]
+
+    def snapshot(self, refresh=False):
+        """
+        Return a ClusterSnapshot of the partitions, re-reading sinfo if the
+        current one is older than snapshot_max_age seconds
+        """
+        return self._index(
+            "snapshot", self.snapshot_max_age, self._read_snapshot, refresh
+        )
+
+    def _read_snapshot(self):
+        output = self._check_output(
+            ["sinfo", "-N", "-h", "-o", ClusterSnapshot.sinfo_format]
+        )
+        return ClusterSnapshot(output)
 
     def queues(self):
-        queue_list = []
-        with os.popen("sinfo -sh") as f:
-            for line in f:
-                q = line.split(" ")[0].strip().replace("*", "")
-                queue_list.append(q)
-        return queue_list
+        # Partitions without nodes are missing from the node snapshot
+        output = self._check_output(["sinfo", "-h", "-o", "%P"])
+        return [
+            *dict.fromkeys(
+                line.strip().replace("*", "")
+                for line in output.splitlines()
+                if line.strip()
+            )
+        ]
 
     def node_config(self, queue_id):
-        # Find first node with queue and record node config
-        queue_name = queue_id
-        tasks = 0
-        config = {}
-        with os.popen("sinfo -Nelh -p " + queue_name) as f:
-            line = f.readline()
-            if len(line):
-                new_line = re.sub(" +", " ", line.strip())
-                tasks = int(new_line.split(" ")[4])
-                memory = int(new_line.split(" ")[6])
-                config["max task"] = tasks
-                config["max thread"] = tasks
-                config["max memory"] = memory
-            else:
-                raise SchedulerException(
-                    "Requested partition %s has no nodes" % queue_name
-                )
-        return config
+        return self.snapshot().node_config(queue_id)
 
     def tasks_per_node(self, queue_id):
-        queue_name = queue_id
-        tasks = 0
-        with os.popen("sinfo -Nelh -p " + queue_name) as f:
-            line = f.readline()
-            new_line = re.sub(" +", " ", line.strip())
-            tasks = int(new_line.split(" ")[4])
-        return tasks
+        return self.snapshot().tasks_per_node(queue_id)
 
     def available_tasks(self, queue_id):
-        free_tasks = 0
-        max_tasks = 0
-        queue_name = queue_id
-        nc = self.node_config(queue_id)
-        with os.popen(f"sinfo -sh -p {queue_name} -o '%C'") as f:
-            line = f.readline()
-            max_tasks = int(line.split("/")[3])
-
-        with os.popen(f"sinfo -h -p {queue_name} -o '%T %C' | grep 'idle' | cut -d ' ' -f 2") as f:
-            for line in f:
-                free_tasks += int(line.split("/")[1])
-
-        return {"available": free_tasks, "max tasks": max_tasks}
+        return self.snapshot().available_tasks(queue_id)
 
     def accounts(self):
-        account_list = []
-        with os.popen(
-            "sacctmgr --noheader list assoc user=`id -un` format=Account"
-        ) as f:
-            for line in f:
-                account_list.append(line)
-        return account_list
+        output = self._run(
+            [
+                "sacctmgr",
+                "--noheader",
+                "list",
+                "assoc",
+                f"user={self._get_username()}",
+                "format=Account",
+            ],
+            check=False,
+        )
+        return [line.strip() for line in output.stdout.splitlines()]
 
     def create_submit(
         self,
@@ -126,7 +214,10 @@ class Slurm(Scheduler):
         qos=None,
         exclusive=True,
         output_name=None,
-        gres=None
+        gres=None,
+        array_size=None,
+        array_limit=None,
+        array_params=None,
     ):
         queue_name = queue_id
         if tasks_per_node is None:
@@ -144,6 +235,8 @@ class Slurm(Scheduler):
         if output_name is None:
             output_name = job_name + ".out"
 
+        array_size, array_params = self._array_args(array_size, array_params)
+
         template = self._load_template(self._get_template_name())
 
         script_str = template.render(
@@ -161,98 +254,87 @@ class Slurm(Scheduler):
             openmpi_args=openmpi_args,
             qos=qos,
             exclusive=exclusive,
-            gres=gres
+            gres=gres,
+            array_size=array_size,
+            array_limit=array_limit,
+            array_params=array_params,
         )
         return script_str
 
     def submit(
         self, script_name, immediate=False, depends_on=None, depends_on_always_run=False
     ):
-        additional_cmd = ""
-        if "MYCLUSTER_SUBMIT_OPT" in os.environ:
-            additional_cmd = os.environ["MYCLUSTER_SUBMIT_OPT"]
+        additional_args = shlex.split(os.environ.get("MYCLUSTER_SUBMIT_OPT", ""))
         if not immediate:
+            command = ["sbatch"] + additional_args
             if depends_on and depends_on_always_run:
-                command = f"sbatch {additional_cmd} --kill-on-invalid-dep=yes --dependency=afterany:{depends_on} {script_name}"
+                command += [
+                    "--kill-on-invalid-dep=yes",
+                    f"--dependency=afterany:{depends_on}",
+                ]
             elif depends_on is not None:
-                command = f"sbatch {additional_cmd} --kill-on-invalid-dep=yes --dependency=afterok:{depends_on} {script_name}"
-            else:
-                command = f"sbatch {additional_cmd} {script_name}"
-            print(f"running {command}")
-            with os.popen(command) as f:
-                output = f.readline()
-                try:
-                    job_id = int(output.split(" ")[-1].strip())
-                except:
-                    raise SchedulerException("Job submission failed: " + output)
+                command += [
+                    "--kill-on-invalid-dep=yes",
+                    f"--dependency=afterok:{depends_on}",
+                ]
+            command.append(script_name)
+            logger.debug(f"running {' '.join(command)}")
+            # Never retry a submission, the first attempt may have succeeded
+            output = self._run(command, check=False, retries=0)
+            try:
+                job_id = int(output.stdout.splitlines()[0].split(" ")[-1].strip())
+            except (IndexError, ValueError):
+                raise SchedulerException(
+                    "Job submission failed: " + output.stdout + output.stderr
+                )
         else:
-            with os.popen(
-                'grep -- "SBATCH -p" ' + script_name + " | sed 's/#SBATCH//'"
-            ) as f:
-                partition = f.readline().rstrip()
-            with os.popen(
-                'grep -- "SBATCH --nodes" ' + script_name + " | sed 's/#SBATCH//'"
-            ) as f:
-                nnodes = f.readline().rstrip()
-            with os.popen(
-                'grep -- "SBATCH --ntasks" ' + script_name + " | sed 's/#SBATCH//'"
-            ) as f:
-                ntasks = f.readline().rstrip()
-            with os.popen(
-                'grep -- "SBATCH -A" ' + script_name + " | sed 's/#SBATCH//'"
-            ) as f:
-                project = f.readline().rstrip()
-            with os.popen(
-                'grep -- "SBATCH -J" ' + script_name + " | sed 's/#SBATCH//'"
-            ) as f:
-                job = f.readline().rstrip()
-
-            cmd_line = (
-                "salloc --exclusive "
-                + nnodes
-                + " "
-                + partition
-                + " "
-                + ntasks
-                + " "
-                + project
-                + " "
-                + job
-                + " bash ./"
-                + script_name
-            )
+            directives = {}
+            with open(script_name) as f:
+                for line in f:
+                    for option in ["-p", "--nodes", "--ntasks", "-A", "-J"]:
+                        if line.startswith(f"#SBATCH {option}"):
+                            directives.setdefault(option, shlex.split(line[7:]))
+            command = ["salloc", "--exclusive"]
+            for option in ["--nodes", "-p", "--ntasks", "-A", "-J"]:
+                command += directives.get(option, [])
+            command += ["bash", "./" + script_name]
+            output = self._run(command, check=False, timeout=0, retries=0)
             try:
-                output = subprocess.check_output(cmd_line, shell=True)
-                try:
-                    job_id = int(output.split(" ")[-1].strip())
-                except:
-                    raise SchedulerException("Job submission failed: " + output)
-            except:
-                raise SchedulerException("Job submission failed: " + cmd_line)
+                job_id = int(output.stdout.split(" ")[-1].strip())
+            except ValueError:
+                raise SchedulerException("Job submission failed: " + " ".join(command))
         return job_id
 
+    def array_task_ids(self, job_id, array_size):
+        return [f"{job_id}_{index}" for index in range(array_size)]
+
     def list_current_jobs(self):
-        jobs = []
-        output = subprocess.run(
-            "squeue -h -u `whoami`",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=True,
-        )
-        if output.returncode == 0:
-            for line in output.stdout.decode("utf-8").splitlines():
-                job_info = re.sub(" +", " ", line.strip()).split(" ")
-                jobs.append(
-                    {
-                        "id": int(job_info[0]),
-                        "queue": job_info[1],
-                        "name": job_info[2],
-                        "state": job_info[4],
-                    }
-                )
+        return [job._asdict() for job in self.iter_current_jobs()]
+
+    def iter_current_jobs(self):
+        return self.iter_jobs(users=[self._get_username()])
+
+    def iter_jobs(self, users=None, states=None, queues=None, names=None, since=None):
+        if since is None:
+            command = ["squeue", "-h", "-o", "%i|%P|%t|%u|%j"]
+            filters = {"-u": users, "-t": states, "-p": queues, "-n": names}
         else:
-            raise SchedulerException("Error fetching job queue listing")
-        return jobs
+            # Finished jobs are only known to the accounting database
+            command = ["sacct", "-n", "-P", "-X", "-S", self._format_since(since)]
+            command += ["-o", "JobID,Partition,State,User,JobName"]
+            if users is None:
+                command.append("-a")
+            filters = {"-u": users, "-s": states, "-r": queues, "--name": names}
+        for flag, values in filters.items():
+            if values:
+                command += [flag, ",".join(values)]
+        # The name is last as it may contain the delimiter
+        with self._stream(command) as f:
+            for line in f:
+                job_id, queue, state, user, name = line.rstrip("\n").split("|", 4)
+                # sacct reports states such as "CANCELLED by 1000"
+                state = state.split(" ")[0]
+                yield JobInfo(self._parse_job_id(job_id), queue, name, state, user)
 
     def get_job_details(self, job_id):
         """
@@ -260,67 +342,199 @@ class Slurm(Scheduler):
         First check using sacct, then fallback to squeue
         """
         stats_dict = {}
-        sacct_cmd = f"sacct --noheader --format JobId,Elapsed,TotalCPU,Partition,NTasks,AveRSS,State,ExitCode,start,end -P -j {job_id}"
-        squeue_cmd = f'squeue --format "%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R %S" -h -j {job_id}'
-        output = subprocess.run(
-            sacct_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-        )
+        output = self._run(self._sacct_cmd(job_id), check=False)
         if output.returncode != 0:
             raise SchedulerException("Error fetching job details from sacct")
-        lines = output.stdout.decode("utf-8").splitlines()
+        lines = output.stdout.splitlines()
         if len(lines) != 0:
-            if lines[0] not in [
-                "SLURM accounting storage is disabled",
-                "slurm_load_jobs error: Invalid job id specified",
-            ]:
-                cols = lines[0].split("|")
-                stats_dict["job_id"] = cols[0]
-                stats_dict["wallclock"] = self._get_timedelta(cols[1])
-                stats_dict["cpu"] = self._get_timedelta(cols[2])
-                stats_dict["queue"] = cols[3]
-                stats_dict["status"] = cols[6]
-                stats_dict["exit_code"] = cols[7].split(":")[0]
-                stats_dict["start"] = cols[8]
-                stats_dict["end"] = cols[9]
-                steps = []
-                for line in lines[1:]:
-                    step = {}
-                    cols = line.split("|")
-                    step_val = cols[0].split(".")[1]
-                    step["step"] = step_val
-                    step["wallclock"] = self._get_timedelta(cols[1])
-                    step["cpu"] = self._get_timedelta(cols[2])
-                    step["ntasks"] = cols[4]
-                    step["status"] = cols[6]
-                    step["exit_code"] = cols[7].split(":")[0]
-                    step["start"] = cols[8]
-                    step["end"] = cols[9]
-                    steps.append(step)
-                stats_dict["steps"] = steps
+            if lines[0] not in self._sacct_errors:
+                stats_dict = self._parse_sacct(lines)
         else:
-            output = subprocess.run(
-                squeue_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-            )
+            output = self._run(self._squeue_cmd(job_id), check=False)
             if output.returncode != 0:
                 raise SchedulerException(
                     "Error fetching job details from squeue, check job id."
                 )
-            lines = output.stdout.decode("utf-8").splitlines()
+            lines = output.stdout.splitlines()
             for line in lines:
                 if line == "slurm_load_jobs error: Invalid job id specified":
                     raise SchedulerException("Invalid job id specified")
-                new_line = re.sub(" +", " ", line.strip())
-                job_id = int(new_line.split(" ")[0])
-                state = new_line.split(" ")[4]
-                stats_dict["job_id"] = str(job_id)
-                stats_dict["status"] = state
-                stats_dict["start_time"] = new_line.split(" ")[8]
+                stats_dict = self._parse_squeue(line)
         return stats_dict
 
-    def delete(self, job_id):
-        cmd = f"scancel {job_id}"
-        output = subprocess.run(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
+    def get_jobs_details(self, job_ids):
+        """
+        Get the details of all job_ids with a single sacct call, falling back
+        to a single squeue call for any jobs sacct does not know about
+        """
+        job_ids = [str(job_id) for job_id in job_ids]
+        if not job_ids:
+            return {}
+        output = self._run(self._sacct_cmd(",".join(job_ids)), check=False)
+        if output.returncode != 0:
+            raise SchedulerException("Error fetching job details from sacct")
+        job_lines = {}
+        for line in output.stdout.splitlines():
+            if line in self._sacct_errors:
+                continue
+            # Steps are reported as job_id.step after their job
+            job_lines.setdefault(line.split("|")[0].split(".")[0], []).append(line)
+        details = {}
+        for job_id in job_ids:
+            if job_id in job_lines:
+                details[job_id] = self._parse_sacct(job_lines[job_id])
+                continue
+            # The tasks of an array job are reported as job_id_task
+            tasks = [
+                self._parse_sacct(lines)
+                for task_id, lines in job_lines.items()
+                if task_id.split("_")[0] == job_id
+            ]
+            if tasks:
+                details[job_id] = self._array_details(job_id, tasks)
+
+        missing = [job_id for job_id in job_ids if job_id not in details]
+        if missing:
+            output = self._run(self._squeue_cmd(",".join(missing)), check=False)
+            for line in output.stdout.splitlines():
+                if line.startswith("slurm_load_jobs error"):
+                    continue
+                stats_dict = self._parse_squeue(line)
+                details[stats_dict["job_id"]] = stats_dict
+                parent = stats_dict["job_id"].split("_")[0]
+                if parent in missing and parent not in details:
+                    details[parent] = dict(stats_dict, job_id=parent)
+        return details
+
+    def _array_details(self, job_id, tasks):
+        """
+        Details of the array job job_id from the details of its tasks, with
+        the status of a task still to finish, else of a task that failed
+        """
+        unfinished = [task for task in tasks if not self.is_terminal(task["status"])]
+        failed = [task for task in tasks if not self.succeeded(task)]
+        details = dict((unfinished or failed or tasks)[0], job_id=job_id)
+        details["tasks"] = tasks
+        return details
+
+    def _finished_jobs(self, job_ids):
+        """
+        Ask sacct for the state of the jobs in the finished_window, then
+        fetch the details of those that finished and of those sacct did not
+        list, which ended before the window or are unknown. Raises a
+        SchedulerException for jobs Slurm does not know about.
+        """
+        job_ids = [str(job_id) for job_id in job_ids]
+        output = self._run(
+            [
+                "sacct",
+                "-X",
+                "-n",
+                "-P",
+                "-o",
+                "JobID,State",
+                "-S",
+                self.finished_window,
+                "-E",
+                "now",
+                "-j",
+                ",".join(job_ids),
+            ],
+            check=False,
         )
+        if output.returncode != 0 or any(
+            error in output.stdout for error in self._sacct_errors
+        ):
+            # Accounting is unavailable, fall back to get_jobs_details
+            return super()._finished_jobs(job_ids)
+        wanted = set(job_ids)
+        # Whether every listed row of each job, or of each task of an array
+        # job, has finished
+        listed = {}
+        for line in output.stdout.splitlines():
+            row_id, _, state = line.partition("|")
+            job_id = row_id if row_id in wanted else row_id.split("_")[0]
+            if job_id in wanted:
+                listed[job_id] = listed.get(job_id, True) and self.is_terminal(state)
+        lookup = [job_id for job_id in job_ids if listed.get(job_id, True)]
+        if not lookup:
+            return {}
+        details = self.get_jobs_details(lookup)
+        unknown = [
+            job_id
+            for job_id in lookup
+            if job_id not in listed and job_id not in details
+        ]
+        if unknown:
+            raise SchedulerException(f"Unknown jobs {', '.join(unknown)}")
+        return {
+            job_id: details[job_id]
+            for job_id in lookup
+            if job_id in details and self.is_terminal(details[job_id].get("status"))
+        }
+
+    def _sacct_cmd(self, job_ids):
+        return [
+            "sacct",
+            "--noheader",
+            "--format",
+            "JobId,Elapsed,TotalCPU,Partition,NTasks,AveRSS,State,ExitCode,start,end",
+            "-P",
+            "-j",
+            str(job_ids),
+        ]
+
+    def _squeue_cmd(self, job_ids):
+        return [
+            "squeue",
+            "--format",
+            "%.18i %.9P %.8j %.8u %.2t %.10M %.6D %R %S",
+            "-h",
+            "-j",
+            str(job_ids),
+        ]
+
+    def _parse_sacct(self, lines):
+        """
+        Parse the sacct lines of a single job, the job itself followed by
+        its steps
+        """
+        stats_dict = {}
+        cols = lines[0].split("|")
+        stats_dict["job_id"] = cols[0]
+        stats_dict["wallclock"] = self._get_timedelta(cols[1])
+        stats_dict["cpu"] = self._get_timedelta(cols[2])
+        stats_dict["queue"] = cols[3]
+        stats_dict["status"] = cols[6]
+        stats_dict["exit_code"] = cols[7].split(":")[0]
+        stats_dict["start"] = cols[8]
+        stats_dict["end"] = cols[9]
+        steps = []
+        for line in lines[1:]:
+            step = {}
+            cols = line.split("|")
+            step_val = cols[0].split(".")[1]
+            step["step"] = step_val
+            step["wallclock"] = self._get_timedelta(cols[1])
+            step["cpu"] = self._get_timedelta(cols[2])
+            step["ntasks"] = cols[4]
+            step["status"] = cols[6]
+            step["exit_code"] = cols[7].split(":")[0]
+            step["start"] = cols[8]
+            step["end"] = cols[9]
+            steps.append(step)
+        stats_dict["steps"] = steps
+        return stats_dict
+
+    def _parse_squeue(self, line):
+        new_line = re.sub(" +", " ", line.strip())
+        return {
+            "job_id": new_line.split(" ")[0],
+            "status": new_line.split(" ")[4],
+            "start_time": new_line.split(" ")[8],
+        }
+
+    def delete(self, job_id):
+        output = self._run(["scancel", str(job_id)], check=False)
         if output.returncode != 0:
             raise SchedulerException(f"Error cancelling job {job_id}")
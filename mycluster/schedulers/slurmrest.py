@@ -0,0 +1,571 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import json
+import time
+import shlex
+import socket
+import logging
+import threading
+import http.client
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlencode, quote
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import Scheduler, JobInfo
+from .slurm import Slurm, SlurmNode, ClusterSnapshot
+from mycluster.exceptions import SchedulerException, NotYetImplementedException
+
+logger = logging.getLogger(__name__)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over the Unix socket at path
+    """
+
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections to url, an http:// or https:// address or
+    unix:// followed by a socket path, reused by every request. At most
+    size idle connections are kept.
+    """
+
+    def __init__(self, url, size=8, timeout=60):
+        self.url = urlsplit(url)
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.url.scheme == "unix":
+            return UnixHTTPConnection(self.url.path, timeout=self.timeout)
+        if self.url.scheme == "https":
+            return http.client.HTTPSConnection(self.url.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.url.netloc, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        """
+        Returns the status and body of the response to the request, waiting
+        up to timeout seconds (the pool's timeout if None) for each socket
+        operation
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        # An idle connection may have been closed by the server, the request
+        # is then tried once more on a new connection. A submission is only
+        # retried if it could not be sent, it may otherwise have been run.
+        while True:
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect()
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                conn = None
+                stale = isinstance(
+                    e, (http.client.RemoteDisconnected, ConnectionResetError)
+                )
+                if reused and (
+                    isinstance(e, BrokenPipeError) or stale and method != "POST"
+                ):
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    if len(self._idle) < self.size:
+                        self._idle.append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.close()
+            return response.status, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def _number(value):
+    """
+    Value of a slurmrestd number, which newer API versions wrap in a dict
+    with set and number, None if unset
+    """
+    if isinstance(value, dict):
+        return value.get("number") if value.get("set", True) else None
+    return value
+
+
+def _first(value):
+    """
+    First entry of a slurmrestd flag list, older API versions give a string
+    """
+    if isinstance(value, list):
+        return value[0] if value else ""
+    return value or ""
+
+
+class SlurmREST(Slurm):
+    """
+    Slurm through the slurmrestd REST API instead of the command line tools.
+
+    Requests go over a pool of keep-alive connections to the address in
+    MYCLUSTER_SLURMREST_URL, a unix:// socket path or an http(s):// URL
+    (default http://localhost:6820). When SLURM_JWT is set it is sent as
+    the authentication token, as with the Slurm tools.
+    """
+
+    api_version = "v0.0.40"
+    # Idle connections kept open to slurmrestd
+    pool_size = 8
+    _pool = None
+    _pool_lock = threading.Lock()
+    # Short state codes of job states, as listed by squeue
+    _state_codes = {
+        "BOOT_FAIL": "BF",
+        "CANCELLED": "CA",
+        "COMPLETED": "CD",
+        "COMPLETING": "CG",
+        "CONFIGURING": "CF",
+        "DEADLINE": "DL",
+        "FAILED": "F",
+        "NODE_FAIL": "NF",
+        "OUT_OF_MEMORY": "OOM",
+        "PENDING": "PD",
+        "PREEMPTED": "PR",
+        "REQUEUED": "RQ",
+        "RESIZING": "RS",
+        "RUNNING": "R",
+        "SUSPENDED": "S",
+        "STOPPED": "ST",
+        "TIMEOUT": "TO",
+    }
+
+    def scheduler_type(self):
+        return "slurmrest"
+
+    def _get_template_name(self):
+        # Jobs are written with the sbatch template
+        if "MYCLUSTER_TEMPLATE" in os.environ:
+            return super()._get_template_name()
+        return "slurm.jinja"
+
+    def _request(self, method, path, body=None, query=None):
+        """
+        Send a request to slurmrestd and return the decoded response, raising
+        a SchedulerException if it reports an error
+        """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ConnectionPool(
+                    os.getenv("MYCLUSTER_SLURMREST_URL", "http://localhost:6820"),
+                    size=self.pool_size,
+                    timeout=self.command_timeout or None,
+                )
+        if query:
+            path += "?" + urlencode(
+                {key: value for key, value in query.items() if value is not None}
+            )
+        headers = {"Accept": "application/json"}
+        if os.getenv("SLURM_JWT"):
+            headers["X-SLURM-USER-NAME"] = self._get_username()
+            headers["X-SLURM-USER-TOKEN"] = os.environ["SLURM_JWT"]
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        # Cut short by the deadline of the calling context as commands are
+        timeout = self._command_timeout(["slurmrestd"], None) or None
+        start = time.monotonic()
+        try:
+            status, data = self._pool.request(method, path, body, headers, timeout)
+        except (OSError, http.client.HTTPException) as e:
+            self.metrics.record_command(
+                ["slurmrestd", method, path], time.monotonic() - start, None, 0
+            )
+            raise SchedulerException(f"Unable to reach slurmrestd: {e}")
+        self.metrics.record_command(
+            ["slurmrestd", method, path],
+            time.monotonic() - start,
+            0 if status < 400 else status,
+            len(data),
+        )
+        try:
+            response = json.loads(data) if data else {}
+        except ValueError:
+            raise SchedulerException(f"Invalid response from slurmrestd ({status})")
+        errors = [
+            error.get("description") or error.get("error") or str(error)
+            for error in response.get("errors", [])
+        ]
+        if status >= 400 or errors:
+            raise SchedulerException(
+                f"slurmrestd {method} {path} failed ({status}): {'; '.join(errors)}"
+            )
+        return response
+
+    def _slurm(self, method, path, **kwargs):
+        return self._request(method, f"/slurm/{self.api_version}/{path}", **kwargs)
+
+    def _slurmdb(self, method, path, **kwargs):
+        return self._request(method, f"/slurmdb/{self.api_version}/{path}", **kwargs)
+
+    def name(self):
+        meta = self._slurm("GET", "ping").get("meta", {})
+        return meta.get("slurm", {}).get("cluster", "undefined")
+
+    def _read_snapshot(self):
+        nodes = []
+        for node in self._slurm("GET", "nodes").get("nodes", []):
+            state = node.get("state", [])
+            if isinstance(state, list):
+                state = "+".join(state)
+            cpus = node.get("cpus", 0)
+            for partition in node.get("partitions", []):
+                nodes.append(
+                    SlurmNode(
+                        name=node["name"],
+                        partition=partition,
+                        cpus=cpus,
+                        memory=node.get("real_memory", 0),
+                        state=state.lower(),
+                        idle_cpus=cpus - node.get("alloc_cpus", 0),
+                    )
+                )
+        return ClusterSnapshot.from_nodes(nodes)
+
+    def queues(self):
+        return [
+            partition["name"]
+            for partition in self._slurm("GET", "partitions").get("partitions", [])
+        ]
+
+    def accounts(self):
+        response = self._slurmdb(
+            "GET", "associations", query={"user": self._get_username()}
+        )
+        return sorted(
+            {association["account"] for association in response["associations"]}
+        )
+
+    def submit(
+        self, script_name, immediate=False, depends_on=None, depends_on_always_run=False
+    ):
+        if immediate:
+            raise NotYetImplementedException("Immediate not implemented for slurmrest")
+        with open(script_name) as f:
+            script = f.read()
+        # slurmrestd does not read #SBATCH directives, they are sent as the
+        # job description instead
+        options = []
+        for line in script.splitlines():
+            if line.startswith("#SBATCH"):
+                options += shlex.split(line[len("#SBATCH") :])
+        options += shlex.split(os.environ.get("MYCLUSTER_SUBMIT_OPT", ""))
+        job = self._job_description(options)
+        if depends_on is not None:
+            condition = "afterany" if depends_on_always_run else "afterok"
+            job["dependency"] = f"{condition}:{depends_on}"
+            job["kill_on_invalid_dependency"] = True
+        job["current_working_directory"] = os.getcwd()
+        # The environment is stored with the job where others may read it,
+        # the Slurm token and settings are left out
+        job["environment"] = [
+            f"{key}={value}"
+            for key, value in os.environ.items()
+            if not key.startswith("SLURM_") and key != "MYCLUSTER_SLURMREST_URL"
+        ]
+        job["script"] = script
+        response = self._slurm("POST", "job/submit", body={"job": job})
+        job_id = response.get("job_id", response.get("result", {}).get("job_id"))
+        if job_id is None:
+            raise SchedulerException("Job submission failed: no job id returned")
+        return int(job_id)
+
+    def _job_description(self, options):
+        """
+        slurmrestd job description of the sbatch command line options
+        """
+        job = {}
+        # Options given as --option=value are split like --option value
+        args = []
+        for option in options:
+            if option.startswith("--") and "=" in option:
+                args += option.split("=", 1)
+            else:
+                args.append(option)
+        flags = {
+            "--exclusive": ("shared", ["none"]),
+            "--no-requeue": ("requeue", False),
+        }
+        fields = {
+            "-J": ("name", str),
+            "--job-name": ("name", str),
+            "-A": ("account", str),
+            "--account": ("account", str),
+            "-p": ("partition", str),
+            "--partition": ("partition", str),
+            "-N": ("nodes", str),
+            "--nodes": ("nodes", str),
+            "-n": ("tasks", int),
+            "--ntasks": ("tasks", int),
+            "-c": ("cpus_per_task", int),
+            "--cpus-per-task": ("cpus_per_task", int),
+            "-o": ("standard_output", str),
+            "--output": ("standard_output", str),
+            "-e": ("standard_error", str),
+            "--error": ("standard_error", str),
+            "--mail-user": ("mail_user", str),
+            "--mail-type": ("mail_type", lambda value: value.split(",")),
+            "-q": ("qos", str),
+            "--qos": ("qos", str),
+            "-t": ("time_limit", self._time_limit),
+            "--time": ("time_limit", self._time_limit),
+            "--gres": ("tres_per_node", lambda value: f"gres/{value}"),
+            "-a": ("array", str),
+            "--array": ("array", str),
+            "--cpu-freq": ("cpu_frequency_governor", str),
+        }
+        index = 0
+        while index < len(args):
+            option = args[index]
+            if option in flags:
+                field, value = flags[option]
+                job[field] = value
+            elif option in fields and index + 1 < len(args):
+                field, convert = fields[option]
+                index += 1
+                job[field] = convert(args[index])
+            else:
+                logger.debug(f"Ignoring sbatch option {option} for slurmrest")
+            index += 1
+        return job
+
+    def _time_limit(self, value):
+        """
+        Minutes of an sbatch time limit in [days-]hours:minutes:seconds
+        """
+        limit = self._get_timedelta(value)
+        return {"set": True, "number": int(limit.total_seconds() // 60)}
+
+    def iter_jobs(self, users=None, states=None, queues=None, names=None, since=None):
+        if since is None:
+            jobs = self._iter_queue()
+            if states:
+                # Accept full state names as well as squeue's codes
+                states = [self._state_codes.get(state, state) for state in states]
+        else:
+            jobs = self._iter_accounting(users, since)
+        yield from self._filter_jobs(
+            jobs,
+            users=users or None,
+            states=states or None,
+            queues=queues or None,
+            names=names or None,
+        )
+
+    def _iter_queue(self):
+        """
+        JobInfo of every job in the queue, with squeue's state codes
+        """
+        for job in self._slurm("GET", "jobs").get("jobs", []):
+            job_id = str(job["job_id"])
+            task = _number(job.get("array_task_id"))
+            if task is not None:
+                job_id = f"{job.get('array_job_id', job_id)}_{task}"
+            state = _first(job.get("job_state"))
+            yield JobInfo(
+                self._parse_job_id(job_id),
+                job.get("partition"),
+                job.get("name"),
+                self._state_codes.get(state, state),
+                job.get("user_name"),
+            )
+
+    def _iter_accounting(self, users, since):
+        """
+        JobInfo of every job known to the accounting database since since
+        """
+        query = {"start_time": self._format_since(since)}
+        if users:
+            query["users"] = ",".join(users)
+        for job in self._slurmdb("GET", "jobs", query=query).get("jobs", []):
+            yield JobInfo(
+                self._parse_job_id(str(job["job_id"])),
+                job.get("partition"),
+                job.get("name"),
+                _first(job.get("state", {}).get("current")),
+                job.get("user"),
+            )
+
+    def get_job_details(self, job_id):
+        """
+        Get full job and step stats for job_id from the accounting database,
+        falling back to the queue
+        """
+        details = self.get_jobs_details([job_id])
+        if str(job_id) not in details:
+            raise SchedulerException("Invalid job id specified")
+        return details[str(job_id)]
+
+    def get_jobs_details(self, job_ids):
+        """
+        Get the details of all job_ids from the accounting database with a
+        single request. Jobs not yet in the accounting database are looked
+        up in the queue with a request each, sent concurrently over the
+        connection pool.
+        """
+        job_ids = [str(job_id) for job_id in job_ids]
+        if not job_ids:
+            return {}
+        details = {}
+        try:
+            jobs = self._slurmdb("GET", "jobs", query={"step": ",".join(job_ids)}).get(
+                "jobs", []
+            )
+        except SchedulerException as e:
+            logger.debug(f"Jobs not in the accounting database: {e}")
+            jobs = []
+        wanted = set(job_ids)
+        for job in jobs:
+            job_id = str(job["job_id"])
+            task = _number(job.get("array", {}).get("task_id"))
+            if task is not None:
+                array_id = f"{job['array']['job_id']}_{task}"
+                job_id = array_id if array_id in wanted else job_id
+            if job_id in wanted:
+                details[job_id] = self._accounting_details(job, job_id)
+        missing = [job_id for job_id in job_ids if job_id not in details]
+        if missing:
+            with ThreadPoolExecutor(
+                max_workers=min(len(missing), self.pool_size)
+            ) as pool:
+                for job_id, queued in zip(missing, pool.map(self._queued_job, missing)):
+                    if queued is not None:
+                        details[job_id] = queued
+        return details
+
+    def _finished_jobs(self, job_ids):
+        return Scheduler._finished_jobs(self, job_ids)
+
+    def _queued_job(self, job_id):
+        """
+        Details, in the form squeue gives them, of job_id in the queue, None
+        if it is not there
+        """
+        try:
+            jobs = self._slurm("GET", f"job/{quote(job_id)}").get("jobs", [])
+        except SchedulerException as e:
+            logger.debug(f"Job {job_id} not in the queue: {e}")
+            return None
+        if not jobs:
+            return None
+        state = _first(jobs[0].get("job_state"))
+        return {
+            "job_id": job_id,
+            "status": self._state_codes.get(state, state),
+            "start_time": self._format_time(jobs[0].get("start_time")),
+        }
+
+    def _accounting_details(self, job, job_id):
+        """
+        Job details, in the form sacct gives them, of a slurmdb job
+        """
+        stats_dict = {"job_id": job_id}
+        stats_dict.update(self._usage(job))
+        stats_dict["queue"] = job.get("partition")
+        stats_dict["status"] = _first(job.get("state", {}).get("current"))
+        stats_dict["exit_code"] = str(
+            _number(job.get("exit_code", {}).get("return_code")) or 0
+        )
+        stats_dict["start"] = self._format_time(job.get("time", {}).get("start"))
+        stats_dict["end"] = self._format_time(job.get("time", {}).get("end"))
+        steps = []
+        for step in job.get("steps", []):
+            step_dict = {"step": str(step.get("step", {}).get("name", ""))}
+            step_dict.update(self._usage(step))
+            step_dict["ntasks"] = str(step.get("tasks", {}).get("count", ""))
+            step_dict["status"] = _first(step.get("state"))
+            step_dict["exit_code"] = str(
+                _number(step.get("exit_code", {}).get("return_code")) or 0
+            )
+            step_dict["start"] = self._format_time(step.get("time", {}).get("start"))
+            step_dict["end"] = self._format_time(step.get("time", {}).get("end"))
+            steps.append(step_dict)
+        stats_dict["steps"] = steps
+        return stats_dict
+
+    def _usage(self, record):
+        """
+        Wallclock and CPU time of a slurmdb job or step
+        """
+        times = record.get("time", {})
+        cpu = times.get("total", {})
+        return {
+            "wallclock": timedelta(seconds=times.get("elapsed", 0)),
+            "cpu": timedelta(
+                seconds=cpu.get("seconds", 0), microseconds=cpu.get("microseconds", 0)
+            ),
+        }
+
+    def _format_time(self, timestamp):
+        """
+        A Unix timestamp in the form sacct reports times
+        """
+        timestamp = _number(timestamp)
+        if not timestamp:
+            return "Unknown"
+        return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%S")
+
+    def delete(self, job_id):
+        self._slurm("DELETE", f"job/{quote(str(job_id))}")
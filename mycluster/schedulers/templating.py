@@ -0,0 +1,115 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import stat
+import shlex
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
+
+
+class TemplateRegistry:
+    """
+    Process wide store of compiled jinja2 templates keyed on the resolved
+    template path and its modification time, so each template is compiled
+    once and only recompiled when the file changes.
+
+    If MYCLUSTER_TEMPLATE_CACHE is set to a directory the compiled bytecode
+    is also cached there and shared between processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._environments = {}
+
+    def resolve(self, template_name):
+        """
+        Returns the absolute path and modification time of template_name
+        1. Check if template_name is a file
+        2. Try loading it from templates dir
+        """
+        for path in (template_name, os.path.join(TEMPLATE_DIR, template_name)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                return os.path.abspath(path), st.st_mtime_ns
+        raise FileNotFoundError(f"Template {template_name} not found")
+
+    def get_template(self, template_name):
+        path, mtime = self.resolve(template_name)
+        with self._lock:
+            entry = self._templates.get(path)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+            logger.debug(f'Compiling template "{path}"')
+            env = self._environment(os.path.dirname(path))
+            template = env.get_template(os.path.basename(path))
+            self._templates[path] = (mtime, template)
+            return template
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+            self._environments.clear()
+
+    def _environment(self, directory):
+        if directory not in self._environments:
+            # Imported here as jinja2 is slow to import and only needed when
+            # a submission script is created
+            from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+            bytecode_cache = None
+            if "MYCLUSTER_TEMPLATE_CACHE" in os.environ:
+                cache_dir = os.environ["MYCLUSTER_TEMPLATE_CACHE"]
+                os.makedirs(cache_dir, exist_ok=True)
+                bytecode_cache = FileSystemBytecodeCache(cache_dir)
+            # The registry does the caching so the environment should not
+            env = Environment(
+                loader=FileSystemLoader(directory),
+                cache_size=0,
+                bytecode_cache=bytecode_cache,
+            )
+            # Quotes a value such as a file path as a single shell word
+            env.filters["shell_quote"] = shlex.quote
+            self._environments[directory] = env
+        return self._environments[directory]
+
+
+templates = TemplateRegistry()
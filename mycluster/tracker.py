@@ -0,0 +1,238 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import click
+
+from .exceptions import NotYetImplementedException
+
+
+class JobTracker:
+    """
+    Tracks the state of a set of jobs in a local SQLite store.
+
+    Each poll() lists the queue with a single iter_current_jobs() call and
+    only fetches get_jobs_details() for jobs whose queue state changed or
+    that have left the queue, returning the resulting state transitions as
+    events. Jobs that reach a terminal state are no longer polled. A job
+    missing from both the queue and the scheduler's accounting for
+    missing_polls polls gets a final UNKNOWN event and is dropped.
+    """
+
+    missing_polls = 5
+
+    def __init__(self, scheduler, path=None):
+        self.scheduler = scheduler
+        # Consecutive polls each job was found in neither the queue nor
+        # the accounting
+        self._missing = {}
+        if path is None:
+            path = os.path.join(
+                click.get_app_dir("MyCluster"),
+                f"jobs-{scheduler.scheduler_type()}.db",
+            )
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._listeners = []
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, queue_state TEXT, state TEXT, "
+            "details TEXT, updated REAL)"
+        )
+        self._db.commit()
+
+    def add(self, *job_ids):
+        """
+        Start tracking job_ids
+        """
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO jobs (job_id) VALUES (?)",
+                [(str(job_id),) for job_id in job_ids],
+            )
+            self._db.commit()
+
+    def remove(self, *job_ids):
+        """
+        Stop tracking job_ids
+        """
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM jobs WHERE job_id = ?",
+                [(str(job_id),) for job_id in job_ids],
+            )
+            self._db.commit()
+
+    def add_listener(self, callback):
+        """
+        Call callback(event) for every state transition found by poll()
+        """
+        self._listeners.append(callback)
+
+    def states(self):
+        """
+        Returns a dict of the last known state of every tracked job
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT job_id, state FROM jobs").fetchall()
+        return {job_id: state for job_id, state in rows}
+
+    def details(self, job_id):
+        """
+        Returns the last fetched details of job_id, or None
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT details FROM jobs WHERE job_id = ?", (str(job_id),)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def active(self):
+        """
+        IDs of the tracked jobs that have not reached a terminal state
+        """
+        return [
+            job_id
+            for job_id, state in self.states().items()
+            if not self.scheduler.is_terminal(state)
+        ]
+
+    def poll(self, discover=False):
+        """
+        Query the scheduler once and return a list of state transition
+        events, dicts with the job_id, old_state, new_state and details.
+
+        If discover is set the current user's jobs in the queue that are
+        not yet tracked start being tracked.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id, queue_state, state FROM jobs"
+            ).fetchall()
+            tracked = {
+                job_id: (queue_state, state)
+                for job_id, queue_state, state in rows
+                if not self.scheduler.is_terminal(state)
+            }
+            if not tracked and not discover:
+                return []
+            try:
+                queue = {
+                    str(job.id): job.state for job in self.scheduler.iter_current_jobs()
+                }
+            except NotYetImplementedException:
+                # No queue listing, fall back to fetching every job
+                queue = {job_id: None for job_id in tracked}
+            if discover:
+                known = {row[0] for row in rows}
+                for job_id in queue:
+                    if job_id not in known:
+                        self._db.execute(
+                            "INSERT INTO jobs (job_id) VALUES (?)", (job_id,)
+                        )
+                        tracked[job_id] = (None, None)
+
+            changed = [
+                job_id
+                for job_id, (queue_state, state) in tracked.items()
+                if job_id not in queue
+                or queue[job_id] != queue_state
+                or queue[job_id] is None
+            ]
+            details = self.scheduler.get_jobs_details(changed) if changed else {}
+
+            events = []
+            now = time.time()
+            for job_id in changed:
+                old_state = tracked[job_id][1]
+                job_details = details.get(job_id)
+                if job_details is None and job_id not in queue:
+                    # Not yet visible in accounting, try again next poll
+                    # unless it has been missing for too long
+                    self._missing[job_id] = self._missing.get(job_id, 0) + 1
+                    if self._missing[job_id] < self.missing_polls:
+                        continue
+                    del self._missing[job_id]
+                    self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+                    events.append(
+                        {
+                            "job_id": job_id,
+                            "old_state": old_state,
+                            "new_state": "UNKNOWN",
+                            "details": None,
+                        }
+                    )
+                    continue
+                self._missing.pop(job_id, None)
+                if job_details is None:
+                    new_state = queue[job_id]
+                else:
+                    new_state = job_details.get("status", queue.get(job_id))
+                self._db.execute(
+                    "UPDATE jobs SET queue_state = ?, state = ?, details = ?, "
+                    "updated = ? WHERE job_id = ?",
+                    (
+                        queue.get(job_id),
+                        new_state,
+                        json.dumps(job_details, default=str),
+                        now,
+                        job_id,
+                    ),
+                )
+                if new_state != old_state:
+                    events.append(
+                        {
+                            "job_id": job_id,
+                            "old_state": old_state,
+                            "new_state": new_state,
+                            "details": job_details,
+                        }
+                    )
+            self._db.commit()
+
+        for event in events:
+            for callback in self._listeners:
+                callback(event)
+        return events
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,91 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+sys.path.insert(0, BENCHMARKS)
+
+import run_benchmarks  # noqa: E402
+
+import mycluster  # noqa: E402
+
+NODES = 10
+JOBS = 25
+QUEUES = 4
+# First job in the fake queue, those below it have finished
+FIRST_JOB = 1000
+
+
+@pytest.fixture
+def fake_cluster(tmp_path, monkeypatch):
+    """
+    Factory for schedulers whose commands are the fakes in
+    benchmarks/fake_scheduler.py, modelling a cluster of NODES nodes in
+    QUEUES queues with JOBS jobs queued
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    run_benchmarks.fake_bin_dir(str(bin_dir))
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    # Keep the query cache and indexes out of the real home directory
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    monkeypatch.delenv("XDG_CONFIG_HOME", raising=False)
+    monkeypatch.setenv("FAKE_SCHED_NODES", str(NODES))
+    monkeypatch.setenv("FAKE_SCHED_JOBS", str(JOBS))
+    monkeypatch.setenv("FAKE_SCHED_QUEUES", str(QUEUES))
+    monkeypatch.delenv("FAKE_SCHED_LATENCY", raising=False)
+
+    def scheduler(backend):
+        monkeypatch.setenv("FAKE_SCHED_TYPE", backend)
+        scheduler = mycluster.get_scheduler(backend)
+        scheduler.cache_enabled = False
+        return scheduler
+
+    return scheduler
+
+
+@pytest.fixture
+def fake_slurmrestd(tmp_path, monkeypatch):
+    """
+    Context manager running benchmarks/fake_slurmrestd.py for the
+    slurmrest backend, on the same socket each time it is entered
+    """
+    monkeypatch.setenv("MYCLUSTER_SLURMREST_URL", "")
+
+    def server():
+        return run_benchmarks.fake_slurmrestd(str(tmp_path))
+
+    return server
@@ -0,0 +1,102 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+
+from mycluster.schedulers.cache import TTLCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1, 60)
+    cache.set("b", 2, 60)
+    assert cache.get("a") == (True, 1)
+    cache.set("c", 3, 60)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("mycluster.schedulers.cache.time.time", lambda: now[0])
+    cache = TTLCache()
+    cache.set("short", 1, 5)
+    cache.set("long", 2, 60)
+    now[0] += 10
+    assert cache.get("short") == (False, None)
+    assert cache.get("long") == (True, 2)
+
+
+def test_values_are_copied():
+    cache = TTLCache()
+    value = {"jobs": [1]}
+    cache.set("key", value, 60)
+    value["jobs"].append(2)
+    cache.get("key")[1]["jobs"].append(3)
+    assert cache.get("key") == (True, {"jobs": [1]})
+
+
+def test_invalidate_prefix():
+    cache = TTLCache()
+    cache.set("queues:[]", ["q0"], 60)
+    cache.set("get_job_details:[1]", {}, 60)
+    cache.invalidate("queues:")
+    assert cache.get("queues:[]") == (False, None)
+    assert cache.get("get_job_details:[1]") == (True, {})
+
+
+def test_persisted_between_instances(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache" / "slurm.json")
+    now = [1000.0]
+    monkeypatch.setattr("mycluster.schedulers.cache.time.time", lambda: now[0])
+    cache = TTLCache(path=path)
+    cache.set("short", 1, 5)
+    cache.set("long", [1, 2], 60)
+    now[0] += 10
+    reloaded = TTLCache(path=path)
+    assert reloaded.get("long") == (True, [1, 2])
+    assert reloaded.get("short") == (False, None)
+    # Eviction is persisted too
+    small = TTLCache(maxsize=1, path=path)
+    small.set("new", 3, 60)
+    with open(path) as f:
+        assert [key for key, _, _ in json.load(f)] == ["new"]
+
+
+def test_unreadable_file_is_ignored(tmp_path):
+    path = tmp_path / "slurm.json"
+    path.write_text("{not json")
+    cache = TTLCache(path=str(path))
+    assert cache.get("key") == (False, None)
+    cache.set("key", 1, 60)
+    assert TTLCache(path=str(path)).get("key") == (True, 1)
@@ -0,0 +1,157 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import getpass
+
+import pytest
+
+from mycluster.exceptions import SchedulerException
+from mycluster.schedulers.lsf import LSFIndex
+
+from conftest import FIRST_JOB, JOBS, QUEUES
+
+BQUEUES = """\
+QUEUE: normal
+  -- Default queue
+
+PARAMETERS/STATISTICS
+PRIO NICE STATUS          MAX JL/U JL/P JL/H NJOBS  PEND   RUN SSUSP USUSP  RSV PJOBS
+ 30   20  Open:Active      96    -    -    -    10     2     8     0     0    0    0
+
+USERS: all
+HOSTS:  racks/ hostz+2 ~hosta
+
+QUEUE: everywhere
+PARAMETERS/STATISTICS
+PRIO NICE STATUS          MAX JL/U JL/P JL/H NJOBS  PEND   RUN SSUSP USUSP  RSV PJOBS
+ 30   20  Open:Active       -    -    -    -     0     0     0     0     0    0    0
+HOSTS:  all
+
+QUEUE: empty
+HOSTS:  none
+"""
+
+BMGROUP = """\
+GROUP_NAME    HOSTS
+racks         rack1/ rack2/
+rack1         hosta hostb
+rack2         hostc racks/
+"""
+
+
+def records(*records):
+    return json.dumps({"RECORDS": list(records)})
+
+
+@pytest.fixture
+def index():
+    return LSFIndex(
+        BQUEUES,
+        records(
+            {"HOST_NAME": "hosta", "MAX": "-"},
+            {"HOST_NAME": "hostb", "MAX": "32"},
+        ),
+        records(
+            {"HOST_NAME": "hosta", "ncpus": "16", "maxmem": "64G"},
+            {"HOST_NAME": "hostb", "ncpus": "32", "maxmem": "256000M"},
+        ),
+        BMGROUP,
+    )
+
+
+def test_host_groups_are_resolved(index):
+    # Nested groups are expanded once even if they refer back to each other
+    assert index.queue_hosts["normal"] == ["hosta", "hostb", "hostc", "hostz"]
+    assert index.queue_hosts["everywhere"] == ["hosta", "hostb"]
+    assert index.queue_hosts["empty"] == []
+
+
+def test_hosts_without_slot_limit_run_a_task_per_cpu(index):
+    assert index.node_config("normal") == {
+        "max task": 16,
+        "max thread": 16,
+        "max memory": 64.0,
+    }
+    assert index.tasks_per_node("empty") == 1
+
+
+def test_available_tasks(index):
+    assert index.available_tasks("normal") == {"available": 88, "max tasks": 96}
+    assert index.available_tasks("everywhere") == {"available": 0, "max tasks": 0}
+    with pytest.raises(SchedulerException):
+        index.available_tasks("missing")
+
+
+def test_invalid_json():
+    with pytest.raises(SchedulerException):
+        LSFIndex(BQUEUES, "not json", records(), BMGROUP)
+
+
+@pytest.fixture
+def lsf(fake_cluster):
+    return fake_cluster("lsf")
+
+
+def test_queues(lsf):
+    assert lsf.queues() == [f"q{index}" for index in range(QUEUES)]
+
+
+def test_index_from_fake_commands(lsf):
+    # q0 holds 3 of the fake nodes and runs a quarter of the jobs
+    assert lsf.available_tasks("q0") == {
+        "available": 144 - JOBS // QUEUES,
+        "max tasks": 144,
+    }
+    assert lsf.node_config("q3") == {
+        "max task": 48,
+        "max thread": 48,
+        "max memory": 186.5,
+    }
+
+
+def test_list_current_jobs(lsf):
+    jobs = lsf.list_current_jobs()
+    assert [job["id"] for job in jobs] == list(range(FIRST_JOB, FIRST_JOB + JOBS))
+    assert {job["user"] for job in jobs} == {getpass.getuser()}
+    assert [job["state"] for job in jobs[:5]] == ["RUN", "PEND", "RUN", "RUN", "PSUSP"]
+
+
+def test_get_jobs_details(lsf):
+    details = lsf.get_jobs_details([998, 999, FIRST_JOB])
+    assert {job_id: job["status"] for job_id, job in details.items()} == {
+        "998": "DONE",
+        "999": "EXIT",
+        str(FIRST_JOB): "RUN",
+    }
+    assert lsf.succeeded(details["998"])
+    assert not lsf.succeeded(details["999"])
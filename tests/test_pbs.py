@@ -0,0 +1,168 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import json
+import getpass
+import subprocess
+
+import pytest
+
+from mycluster.exceptions import SchedulerException
+from mycluster.schedulers.pbs import PBSNodeIndex
+
+from conftest import FIRST_JOB, JOBS, QUEUES
+
+QSTAT = ["qstat", "-f", "-F", "json"]
+
+
+@pytest.fixture
+def pbs(fake_cluster):
+    return fake_cluster("pbs")
+
+
+@pytest.mark.parametrize("read_size", [16, 100, 65536])
+def test_iter_qstat_json_matches_json_module(pbs, read_size):
+    # Small reads split job IDs, attributes and separators across chunks
+    pbs.json_read_size = read_size
+    expected = json.loads(subprocess.check_output(QSTAT))["Jobs"]
+    jobs = list(pbs._iter_qstat_json(QSTAT))
+    assert [job_id for job_id, _ in jobs] == list(expected)
+    assert dict(jobs) == expected
+
+
+def test_iter_qstat_json_allows_control_characters(pbs, tmp_path):
+    output = tmp_path / "qstat.json"
+    output.write_text('{"Jobs": {"1.server": {"Job_Name": "a\tb"}}}')
+    assert list(pbs._iter_qstat_json(["cat", str(output)])) == [
+        ("1.server", {"Job_Name": "a\tb"})
+    ]
+
+
+def test_iter_qstat_json_without_jobs(pbs, tmp_path):
+    output = tmp_path / "qstat.json"
+    output.write_text('{"timestamp": 1767225600, "pbs_server": "server"}')
+    assert list(pbs._iter_qstat_json(["cat", str(output)])) == []
+
+
+def test_iter_qstat_json_truncated(pbs, tmp_path):
+    output = tmp_path / "qstat.json"
+    output.write_text('{"Jobs": {"1.server": {"Job_Name": "a"}, "2.ser')
+    with pytest.raises(SchedulerException):
+        list(pbs._iter_qstat_json(["cat", str(output)]))
+
+
+def test_node_index_groups_vnodes_by_vntype():
+    index = PBSNodeIndex(
+        json.dumps(
+            {
+                "nodes": {
+                    "n1": {
+                        "resources_available": {
+                            "ncpus": 48,
+                            "mem": "191000mb",
+                            "vntype": "cpu, big",
+                        },
+                        "resources_assigned": {"ncpus": 8},
+                    },
+                    "n2": {"resources_available": {"ncpus": 4, "vntype": "cpu"}},
+                }
+            }
+        )
+    )
+    assert [node.name for node in index.vnodes("cpu")] == ["n1", "n2"]
+    assert [node.name for node in index.vnodes("big")] == ["n1"]
+    assert index.vnodes("cpu")[0].memory == 191000
+    assert index.vnodes("cpu")[0].assigned_ncpus == 8
+    assert index.vnodes("gpu") == []
+
+
+def test_node_index_invalid_output():
+    with pytest.raises(SchedulerException):
+        PBSNodeIndex("pbsnodes: Server has no node list")
+
+
+def test_queues(pbs):
+    assert pbs.queues() == [f"q{index}" for index in range(QUEUES)]
+
+
+def test_available_tasks(pbs):
+    # q0 holds fake nodes 0, 4 and 8 with 0, 28 and 7 cores busy
+    assert pbs.available_tasks("q0") == {"available": 109, "max tasks": 144}
+    assert pbs.tasks_per_node("q0") == 48
+
+
+def test_list_current_jobs(pbs):
+    jobs = pbs.list_current_jobs()
+    assert [job["id"] for job in jobs] == list(range(FIRST_JOB, FIRST_JOB + JOBS))
+    assert {job["user"] for job in jobs} == {getpass.getuser()}
+    assert [job["state"] for job in jobs[:5]] == ["R", "Q", "R", "R", "H"]
+
+
+def test_get_jobs_details(pbs):
+    details = pbs.get_jobs_details([998, 999])
+    assert pbs.succeeded(details["998"])
+    assert not pbs.succeeded(details["999"])
+
+
+def test_get_jobs_details_skips_unknown_jobs(pbs):
+    details = pbs.get_jobs_details([998, 99999])
+    assert list(details) == ["998"]
+
+
+def test_listing_fails_with_qstat(pbs, tmp_path, monkeypatch):
+    stub_dir = tmp_path / "stubs"
+    stub_dir.mkdir()
+    qstat = stub_dir / "qstat"
+    qstat.write_text(
+        "#!/bin/sh\necho 'qstat: cannot connect to server fakeserver' >&2\nexit 1\n"
+    )
+    qstat.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{stub_dir}:{os.environ['PATH']}")
+    with pytest.raises(SchedulerException):
+        pbs.list_current_jobs()
+    with pytest.raises(SchedulerException):
+        pbs.get_jobs_details([998])
+
+
+def test_array_job(pbs):
+    script = pbs.create_submit("q0", 48, "job", "run.sh", "01:00:00", array_size=3)
+    assert "#PBS -J 0-2" in script
+    assert pbs.array_task_ids("5[]", 3) == ["5[0]", "5[1]", "5[2]"]
+
+
+def test_single_task_array_is_a_single_job(pbs):
+    # PBS rejects -J 0-0
+    script = pbs.create_submit("q0", 48, "job", "run.sh", "01:00:00", array_size=1)
+    assert "#PBS -J" not in script
+    assert "export MYCLUSTER_ARRAY_INDEX=${PBS_ARRAY_INDEX:-0}" in script
+    assert pbs.array_task_ids("5", 1) == ["5"]
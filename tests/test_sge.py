@@ -0,0 +1,217 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import getpass
+
+import pytest
+
+from mycluster.schedulers.accounting import ACCOUNTING_FIELDS, SGEAccountingFile
+
+from conftest import FIRST_JOB, JOBS, NODES, QUEUES
+
+
+def accounting_line(job_id, failed=0, **fields):
+    """
+    A line of the SGE accounting file for job_id as the fake qacct reports
+    it, with fields replaced
+    """
+    record = {
+        "qname": f"q{job_id % QUEUES}",
+        "hostname": f"node{job_id % NODES:05d}",
+        "owner": getpass.getuser(),
+        "jobname": f"job{job_id}",
+        "jobnumber": str(job_id),
+        "failed": str(failed),
+        "exit_status": str(failed),
+        "ru_wallclock": "3600",
+        "granted_pe": "mpi",
+        "slots": "48",
+        "taskid": "undefined",
+        "cpu": "172740",
+        "mem": "1024",
+    }
+    record.update(fields)
+    values = ["0"] * (max(ACCOUNTING_FIELDS.values()) + 8)
+    for name, index in ACCOUNTING_FIELDS.items():
+        values[index] = record[name]
+    return ":".join(values) + "\n"
+
+
+@pytest.fixture
+def accounting(tmp_path):
+    path = tmp_path / "accounting"
+    path.write_text(
+        "# Version: 8.1.9\n"
+        + accounting_line(10, exit_status="137")
+        + accounting_line(11)
+        + accounting_line(10)
+    )
+    return path
+
+
+def test_last_record_of_each_job(accounting):
+    records = SGEAccountingFile(str(accounting), ":memory:").records(
+        ["10", "11.1", "12"]
+    )
+    assert sorted(records) == ["10", "11.1"]
+    # A rescheduled job is reported by its last record
+    assert records["10"]["exit_status"] == "0"
+    assert records["11.1"]["jobname"] == "job11"
+    assert records["11.1"]["cpu"] == "172740"
+
+
+def test_appended_records_are_indexed(accounting):
+    file = SGEAccountingFile(str(accounting), ":memory:")
+    assert file.records(["12"]) == {}
+    with open(accounting, "a") as f:
+        f.write(accounting_line(12, failed=1))
+        # The last record is still being written
+        f.write(accounting_line(13)[:20])
+    assert file.records(["12", "13"])["12"]["failed"] == "1"
+    assert "13" not in file.records(["13"])
+    with open(accounting, "a") as f:
+        f.write(accounting_line(13)[20:])
+    assert file.records(["13"])["13"]["jobnumber"] == "13"
+
+
+def test_rotated_file_is_indexed_again(accounting, tmp_path):
+    file = SGEAccountingFile(str(accounting), ":memory:")
+    assert sorted(file.records(["10", "11"])) == ["10", "11"]
+    rotated = tmp_path / "accounting.new"
+    rotated.write_text(accounting_line(20))
+    os.replace(rotated, accounting)
+    assert file.records(["10", "11", "20"]).keys() == {"20"}
+
+
+def test_index_is_persisted(accounting, tmp_path):
+    index = str(tmp_path / "index" / "accounting.db")
+    assert "11" in SGEAccountingFile(str(accounting), index).records(["11"])
+    assert "11" in SGEAccountingFile(str(accounting), index).records(["11"])
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "accounting"
+    path.write_text("")
+    assert SGEAccountingFile(str(path), ":memory:").records(["1"]) == {}
+
+
+@pytest.fixture
+def sge(fake_cluster, monkeypatch):
+    monkeypatch.delenv("MYCLUSTER_SGE_ACCOUNTING", raising=False)
+    monkeypatch.delenv("SGE_ROOT", raising=False)
+    return fake_cluster("sge")
+
+
+def test_queues(sge):
+    assert sge.queues() == [
+        f"{pe}:q{index}" for pe in ("mpi", "smp") for index in range(QUEUES)
+    ]
+
+
+def test_list_current_jobs(sge):
+    jobs = sge.list_current_jobs()
+    assert [job["id"] for job in jobs] == list(range(FIRST_JOB, FIRST_JOB + JOBS))
+    assert {job["user"] for job in jobs} == {getpass.getuser()}
+    assert [job["state"] for job in jobs[:5]] == ["r", "qw", "r", "r", "dr"]
+
+
+def test_get_jobs_details_from_qacct(sge):
+    details = sge.get_jobs_details([997, 998, 999])
+    assert {job_id: job["status"] for job_id, job in details.items()} == {
+        "997": "DONE",
+        "998": "DONE",
+        "999": "FAILED",
+    }
+    assert details["999"]["queue"] == "mpi:q3"
+    assert sge.succeeded(details["998"])
+    assert not sge.succeeded(details["999"])
+
+
+def test_accounting_file_matches_qacct(sge, tmp_path, monkeypatch):
+    job_ids = [997, 998, 999]
+    from_qacct = sge.get_jobs_details(job_ids)
+    path = tmp_path / "accounting"
+    path.write_text(
+        "".join(
+            accounting_line(job_id, failed=int(job_id % 3 == 0)) for job_id in job_ids
+        )
+    )
+    monkeypatch.setenv("MYCLUSTER_SGE_ACCOUNTING", str(path))
+    log = tmp_path / "commands.log"
+    monkeypatch.setenv("FAKE_SCHED_LOG", str(log))
+    assert sge.get_jobs_details(job_ids) == from_qacct
+    assert not log.exists()
+
+
+def qacct_record(job_id, exit_status):
+    return "\n".join(
+        [
+            "=" * 62,
+            "qname        q0",
+            "hostname     node00000",
+            f"owner        {getpass.getuser()}",
+            f"jobname      job{job_id}",
+            f"jobnumber    {job_id}",
+            "granted_pe   mpi",
+            "failed       0",
+            f"exit_status  {exit_status}",
+            "ru_wallclock 3600",
+            "cpu          172740.000",
+            "mem          1024.000",
+        ]
+    )
+
+
+def test_rescheduled_job_reports_last_run(sge, tmp_path, monkeypatch):
+    # Job 10 failed and was rescheduled, every path reports its last run
+    stub_dir = tmp_path / "stubs"
+    stub_dir.mkdir()
+    output = tmp_path / "qacct.txt"
+    output.write_text(
+        "\n".join([qacct_record(10, 137), qacct_record(11, 0), qacct_record(10, 0)])
+        + "\n"
+    )
+    qacct = stub_dir / "qacct"
+    qacct.write_text(f"#!/bin/sh\ncat '{output}'\n")
+    qacct.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{stub_dir}:{os.environ['PATH']}")
+    assert sge.get_job_details(10)["status"] == "DONE"
+    assert sge.get_jobs_details([10, 11])["10"]["status"] == "DONE"
+    path = tmp_path / "accounting"
+    path.write_text(
+        accounting_line(10, exit_status="137")
+        + accounting_line(11)
+        + accounting_line(10, exit_status="0")
+    )
+    monkeypatch.setenv("MYCLUSTER_SGE_ACCOUNTING", str(path))
+    assert sge.get_jobs_details([10, 11])["10"]["status"] == "DONE"
@@ -0,0 +1,192 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import getpass
+
+import pytest
+
+from mycluster.exceptions import SchedulerException
+from mycluster.schedulers.slurm import ClusterSnapshot
+
+from conftest import FIRST_JOB, JOBS, QUEUES
+
+SINFO = """\
+node001|work*|48|191000|idle|0/48/0/48
+node002|work*|48|191000|mixed|12/36/0/48
+node003|work*|48|191000+|allocated|48/0/0/48
+node004|gpu|8|64000|idle|0/8/0/8
+garbage line
+"""
+
+
+def test_snapshot_groups_nodes_by_partition():
+    snapshot = ClusterSnapshot(SINFO)
+    assert sorted(snapshot.partitions) == ["gpu", "work"]
+    assert [node.name for node in snapshot.partitions["work"]] == [
+        "node001",
+        "node002",
+        "node003",
+    ]
+    assert snapshot.partitions["work"][2].memory == 191000
+
+
+def test_snapshot_node_config():
+    snapshot = ClusterSnapshot(SINFO)
+    assert snapshot.node_config("gpu") == {
+        "max task": 8,
+        "max thread": 8,
+        "max memory": 64000,
+    }
+    assert snapshot.tasks_per_node("work") == 48
+
+
+def test_snapshot_only_counts_idle_nodes_as_available():
+    snapshot = ClusterSnapshot(SINFO)
+    assert snapshot.available_tasks("work") == {"available": 48, "max tasks": 144}
+
+
+def test_snapshot_unknown_partition():
+    with pytest.raises(SchedulerException):
+        ClusterSnapshot(SINFO).node_config("missing")
+
+
+@pytest.fixture
+def slurm(fake_cluster):
+    return fake_cluster("slurm")
+
+
+def test_queues(slurm):
+    assert slurm.queues() == [f"q{index}" for index in range(QUEUES)]
+
+
+def test_available_tasks(slurm):
+    # Of the 10 fake nodes only node00000 and node00007 are idle, q0 holds
+    # nodes 0, 4 and 8, q3 nodes 3 and 7
+    assert slurm.available_tasks("q0") == {"available": 48, "max tasks": 144}
+    assert slurm.available_tasks("q1") == {"available": 0, "max tasks": 144}
+    assert slurm.available_tasks("q3") == {"available": 48, "max tasks": 96}
+    assert slurm.node_config("q2")["max task"] == 48
+
+
+def test_list_current_jobs(slurm):
+    jobs = slurm.list_current_jobs()
+    assert [job["id"] for job in jobs] == list(range(FIRST_JOB, FIRST_JOB + JOBS))
+    assert {job["user"] for job in jobs} == {getpass.getuser()}
+    assert jobs[0] == {
+        "id": FIRST_JOB,
+        "queue": f"q{FIRST_JOB % QUEUES}",
+        "name": f"job{FIRST_JOB}",
+        "state": "R",
+        "user": getpass.getuser(),
+    }
+    assert jobs[1]["state"] == "PD"
+
+
+def test_get_jobs_details(slurm):
+    details = slurm.get_jobs_details([997, 998, 999, FIRST_JOB])
+    assert {job_id: job["status"] for job_id, job in details.items()} == {
+        "997": "COMPLETED",
+        "998": "COMPLETED",
+        "999": "FAILED",
+        str(FIRST_JOB): "RUNNING",
+    }
+    assert slurm.succeeded(details["998"])
+    assert not slurm.succeeded(details["999"])
+
+
+@pytest.fixture
+def stub_commands(tmp_path, monkeypatch):
+    """
+    Replaces Slurm commands with shell scripts, ahead of the fakes
+    """
+    stub_dir = tmp_path / "stubs"
+    stub_dir.mkdir()
+    monkeypatch.setenv("PATH", f"{stub_dir}:{os.environ['PATH']}")
+
+    def stub(command, script):
+        path = stub_dir / command
+        path.write_text(f"#!/bin/sh\n{script}\n")
+        path.chmod(0o755)
+
+    return stub
+
+
+def sacct_row(job_id, state, exit_code="0:0"):
+    return (
+        f"{job_id}|01:00:00|00:10:00|q0|||{state}|{exit_code}|"
+        "2026-01-01T00:00:00|2026-01-01T01:00:00"
+    )
+
+
+def test_wait_finds_jobs_that_ended_before_the_window(slurm, stub_commands):
+    # Jobs are only listed by the windowed query if they ended within it
+    stub_commands(
+        "sacct",
+        'case "$*" in *-S*) exit 0;; esac\n' f"echo '{sacct_row(500, 'COMPLETED')}'",
+    )
+    details = slurm.wait([500], timeout=5, poll=0.1)
+    assert details["500"]["status"] == "COMPLETED"
+
+
+def test_wait_for_array_job(slurm, stub_commands):
+    stub_commands(
+        "sacct",
+        'case "$*" in *-S*) printf "123_0|COMPLETED\\n123_1|FAILED\\n"; exit 0;; esac\n'
+        f"echo '{sacct_row('123_0', 'COMPLETED')}'\n"
+        f"echo '{sacct_row('123_1', 'FAILED', '1:0')}'",
+    )
+    details = slurm.wait([123], timeout=5, poll=0.1)
+    assert details["123"]["job_id"] == "123"
+    assert details["123"]["status"] == "FAILED"
+    assert [task["job_id"] for task in details["123"]["tasks"]] == ["123_0", "123_1"]
+    assert not slurm.succeeded(details["123"])
+
+
+def test_array_job_with_unfinished_tasks(slurm, stub_commands):
+    stub_commands(
+        "sacct",
+        'case "$*" in *-S*) printf "123_0|COMPLETED\\n123_[1-3]|PENDING\\n"; exit 0;; esac\n'
+        f"echo '{sacct_row('123_0', 'COMPLETED')}'\n"
+        f"echo '{sacct_row('123_[1-3]', 'PENDING')}'",
+    )
+    assert slurm._finished_jobs(["123"]) == {}
+    assert slurm.get_jobs_details([123])["123"]["status"] == "PENDING"
+
+
+def test_wait_for_unknown_job(slurm, stub_commands):
+    stub_commands("sacct", "exit 0")
+    stub_commands(
+        "squeue", "echo 'slurm_load_jobs error: Invalid job id specified' >&2; exit 1"
+    )
+    with pytest.raises(SchedulerException):
+        slurm.wait([42], poll=0.1)
@@ -0,0 +1,125 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import json
+import time
+import getpass
+
+import pytest
+
+from mycluster.exceptions import SchedulerException
+from mycluster.schedulers.base import command_deadline
+from mycluster.schedulers.slurmrest import ConnectionPool
+
+from conftest import FIRST_JOB, JOBS, QUEUES
+
+PING = "/slurm/v0.0.40/ping"
+
+
+def test_pool_reuses_connections(fake_slurmrestd):
+    with fake_slurmrestd():
+        pool = ConnectionPool(os.environ["MYCLUSTER_SLURMREST_URL"])
+        status, data = pool.request("GET", PING)
+        assert status == 200
+        assert json.loads(data)["errors"] == []
+        conn = pool._idle[0]
+        pool.request("GET", PING)
+        assert pool._idle == [conn]
+        pool.close()
+        assert pool._idle == []
+
+
+def test_pool_reconnects_after_server_restart(fake_slurmrestd):
+    with fake_slurmrestd():
+        pool = ConnectionPool(os.environ["MYCLUSTER_SLURMREST_URL"])
+        pool.request("GET", PING)
+        stale = pool._idle[0]
+    # The idle connection was closed by the server, a new one is made
+    with fake_slurmrestd():
+        assert pool.request("GET", PING)[0] == 200
+        assert pool._idle and pool._idle[0] is not stale
+
+
+def test_pool_raises_without_server(fake_slurmrestd):
+    with fake_slurmrestd():
+        pool = ConnectionPool(os.environ["MYCLUSTER_SLURMREST_URL"])
+    with pytest.raises(OSError):
+        pool.request("GET", PING)
+
+
+@pytest.fixture
+def slurmrest(fake_cluster, fake_slurmrestd):
+    scheduler = fake_cluster("slurmrest")
+    with fake_slurmrestd():
+        yield scheduler
+
+
+def test_queues(slurmrest):
+    assert slurmrest.queues() == [f"q{index}" for index in range(QUEUES)]
+
+
+def test_available_tasks(slurmrest):
+    assert slurmrest.available_tasks("q0") == {"available": 48, "max tasks": 144}
+
+
+def test_list_current_jobs(slurmrest):
+    jobs = slurmrest.list_current_jobs()
+    assert [job["id"] for job in jobs] == list(range(FIRST_JOB, FIRST_JOB + JOBS))
+    assert {job["user"] for job in jobs} == {getpass.getuser()}
+
+
+def test_get_jobs_details(slurmrest):
+    details = slurmrest.get_jobs_details([998, 999, FIRST_JOB])
+    assert {job_id: job["status"] for job_id, job in details.items()} == {
+        "998": "COMPLETED",
+        "999": "FAILED",
+        str(FIRST_JOB): "RUNNING",
+    }
+    assert slurmrest.succeeded(details["998"])
+    assert not slurmrest.succeeded(details["999"])
+
+
+def test_requests_end_at_the_command_deadline(
+    fake_cluster, fake_slurmrestd, monkeypatch
+):
+    scheduler = fake_cluster("slurmrest")
+    monkeypatch.setenv("FAKE_SCHED_LATENCY", "5")
+    with fake_slurmrestd():
+        token = command_deadline.set(time.monotonic() + 0.5)
+        start = time.monotonic()
+        try:
+            with pytest.raises(SchedulerException):
+                scheduler.queues()
+        finally:
+            command_deadline.reset(token)
+        assert time.monotonic() - start < 2
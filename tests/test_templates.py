@@ -0,0 +1,62 @@
+# BSD 3 - Clause License
+
+# Copyright(c) 2021, Zenotech
+# All rights reserved.
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and / or other materials provided with the distribution.
+
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES(INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#         SERVICES
+#         LOSS OF USE, DATA, OR PROFITS
+#         OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import subprocess
+
+import pytest
+
+
+@pytest.mark.parametrize("backend", ["slurm", "pbs", "sge", "lsf"])
+def test_array_params_path_is_quoted(fake_cluster, tmp_path, backend):
+    scheduler = fake_cluster(backend)
+    directory = tmp_path / "my 'runs'"
+    directory.mkdir()
+    params = directory / "params $1.txt"
+    params.write_text("first\nsecond\n")
+    queue = scheduler.queues()[0]
+    script = scheduler.create_submit(
+        queue, 48, "job", "run.sh", "01:00:00", array_params=str(params)
+    )
+    [line] = [
+        line
+        for line in script.splitlines()
+        if line.startswith("export MYCLUSTER_ARRAY_PARAMS=")
+    ]
+    output = subprocess.check_output(
+        [
+            "sh",
+            "-c",
+            f'MYCLUSTER_ARRAY_INDEX=1\n{line}\necho "$MYCLUSTER_ARRAY_PARAMS"',
+        ],
+        universal_newlines=True,
+    )
+    assert output == "second\n"